@@ -1,8 +1,29 @@
+from export import PNGWriter
+from matplotlib.colors import to_rgba_array
 import navigation as nav
+import numpy as np
+import os
 
 
 class Animator:
-    def __init__(self, fig, ax, cars_object, lights_object, num, frame_rate=1000, dt=1 / 1000, n=1, focus=None):
+    def __init__(self, fig, ax, cars_object, lights_object, num, frame_rate=1000, dt=1 / 1000, n=1, focus=None,
+                 blit=True, movie=None):
+        """
+        draws the cars, the lights and the light faces as three scatter collections, each updated with whole arrays
+
+        :param           fig:   figure: from matplotlib
+        :param            ax:     axis: from matplotlib
+        :param   cars_object:     Cars
+        :param lights_object: TrafficLights
+        :param           num:    tuple: the episode number out of the total number of episodes
+        :param    frame_rate: None or int: save a png every frame_rate frames (None saves none)
+        :param            dt:   double
+        :param             n:      int: number of cars to draw (the first n)
+        :param         focus:      int: the car ID on which the Animator should focus
+        :param          blit:     bool: draw each frame over a cached image of the static map. Leave False when a
+                                        matplotlib FuncAnimation drives the Animator, which does its own drawing
+        :param         movie: None or FFmpegPipe: receives every blitted frame
+        """
         self.fig = fig
         self.ax = ax
         self.num = num
@@ -12,11 +33,22 @@ class Animator:
         self.focus = focus  # the car ID on which the Animator should focus
         self.cars_object = cars_object
         self.lights_object = lights_object
-        self.number_of_lights = len(self.lights_object.state)
-        self.number_of_faces = sum(self.lights_object.state['degree'])
-        self.cars = sum([ax.plot([], [], color='blue', marker='o', ms=3) for n in range(self.N)], [])
-        self.lights = sum([ax.plot([], [], color='red', marker='+', ms=2) for l in range(self.number_of_lights)], [])
-        self.faces = sum([ax.plot([], [], color='red', marker='^', ms=2) for f in range(self.number_of_faces)], [])
+        self.blit = blit
+        self.movie = movie
+        # blitted frames only exist in the canvas buffer, from which they are written out on background threads
+        self.png_writer = None
+        self.background = None
+        self.face_colors = to_rgba_array(['red', 'green'])
+
+        face_xs, face_ys = self.lights_object.face_positions()
+        self.cars = ax.scatter([], [], color='blue', marker='o', s=9, animated=blit)
+        self.lights = ax.scatter(self.lights_object.state['x'], self.lights_object.state['y'],
+                                 color='red', marker='+', s=4, animated=blit)
+        self.faces = ax.scatter(face_xs, face_ys, color='red', marker='^', s=4, animated=blit)
+        self.label = ax.annotate('', xy=(0, 0))
+        self.artists = [self.cars, self.lights, self.faces]
+        # the static map is re-captured whenever the figure is redrawn in full (e.g. resized)
+        self.draw_event = self.fig.canvas.mpl_connect('draw_event', self.capture_background) if blit else None
 
     def reset(self, num=None):
         """
@@ -25,14 +57,8 @@ class Animator:
         :num    tuple: int, int
         :return cars + lights + faces:
         """
-        for car in self.cars:
-            car.set_data([], [])
-
-        for light in self.lights:
-            light.set_data([], [])
-
-        for face in self.faces:
-            face.set_data([], [])
+        self.cars.set_offsets(np.empty((0, 2)))
+        self.faces.set_color(self.face_colors[0])
 
         if self.focus:
             route = self.cars_object.state.loc[self.focus]['route']
@@ -43,10 +69,12 @@ class Animator:
         axis = self.ax.axis()
 
         self.num = num if num else self.num
-        self.ax.annotate('Episode {} of {}'.format(self.num[0] + 1, self.num[1]), xy=(axis[0] + 10, axis[2] + 10))
+        self.label.set_text('Episode {} of {}'.format(self.num[0] + 1, self.num[1]))
+        self.label.xy = (axis[0] + 10, axis[2] + 10)
+        # the background changes with the label and the limits, so it is captured again
         self.fig.canvas.draw()
 
-        return self.cars + self.lights + self.faces
+        return self.artists
 
     def animate(self, i):
         """
@@ -58,39 +86,69 @@ class Animator:
         self.lights_object.update(self.dt)
         self.cars_object.update(self.dt, self.lights_object.state)
 
-        for car, car_series in zip(self.cars, self.cars_object.state.iterrows()):
-            x = car_series[1]['x']
-            y = car_series[1]['y']
-            car.set_data(x, y)
+        self.cars.set_offsets(self.cars_object.state[['x', 'y']].to_numpy(dtype=float)[:self.N])
+        self.faces.set_color(self.face_colors[self.lights_object.face_go_values().astype(int)])
 
-        face_positions = []
-        face_colors = []
+        if self.blit:
+            self.draw()
+            if self.movie is not None:
+                self.movie.write(self.fig.canvas)
 
-        for light, light_series in zip(self.lights, self.lights_object.state.iterrows()):
-            xs = light_series[1]['out-xpositions']
-            ys = light_series[1]['out-ypositions']
-            face_go_values = light_series[1]['go-values']
+        if self.frame_rate and i % self.frame_rate == 0:
+            self.save_figure(i)
 
-            light.set_data(light_series[1]['x'], light_series[1]['y'])
+        return self.artists
 
-            for coords in zip(xs, ys):
-                face_positions.append(coords)
+    def capture_background(self, event=None):
+        """
+        keeps an image of everything but the moving artists, and draws them on top of it
 
-            for color in face_go_values:
-                face_colors.append(color)
+        :return None:
+        """
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
 
-        for face, position, color in zip(self.faces, face_positions, face_colors):
-            face.set_data(position[0], position[1])
-            if color:
-                face.set_color('green')
-            else:
-                face.set_color('red')
+    def draw_artists(self):
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
 
-        if i % self.frame_rate == 0:
-            self.save_figure(i)
+    def draw(self):
+        """
+        draws the current frame by restoring the cached background and drawing only the moving artists over it
 
-        self.fig.canvas.draw()
-        return self.cars + self.lights + self.faces
+        :return None:
+        """
+        canvas = self.fig.canvas
+        if self.background is None:
+            # drawing the figure in full triggers capture_background
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self.draw_artists()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def remove(self):
+        """
+        takes the Animator's artists off the axis, e.g. before another Animator is made for the next episode
+
+        :return None:
+        """
+        self.close()
+        if self.draw_event is not None:
+            self.fig.canvas.mpl_disconnect(self.draw_event)
+        for artist in self.artists + [self.label]:
+            artist.remove()
+
+    def close(self):
+        """
+        waits for the frames still being saved in the background
+
+        :return None:
+        """
+        if self.png_writer is not None:
+            self.png_writer.close()
+            self.png_writer = None
 
     def save_figure(self, i):
         """
@@ -98,9 +156,15 @@ class Animator:
 
         :return None:
         """
-        try:
-            self.fig.savefig('frames/episode{}_of{}_frame{}'.format(self.num[0] + 1, self.num[1], i))
-        except FileNotFoundError:
+        if not os.path.isdir('frames'):
             raise Exception('Please make a folder called "frames" in this project directory')
 
+        filename = 'frames/episode{}_of{}_frame{}.png'.format(self.num[0] + 1, self.num[1], i)
+        if self.blit:
+            if self.png_writer is None:
+                self.png_writer = PNGWriter()
+            self.png_writer.write(filename, self.fig.canvas)
+        else:
+            self.fig.savefig(filename)
+
         return None
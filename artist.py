@@ -1,67 +1,63 @@
-# python=3.6 requires using Qt4Agg backend for animation saving
-from animate import Animator
-import matplotlib
-# matplotlib.use('Qt4Agg')
 from cars import Cars, TrafficLights
 # import convergent_learner as cl
-from matplotlib import animation
-import osmnx as ox
+import navigation as nav
 import simulation as sim
 
 
-# load figure for animation
-""" Manhattan """
-# G = ox.load_graphml('manhattan.graphml')
-# G = ox.project_graph(G)
-# fig, ax = ox.plot_graph(G, fig_height=30, node_size=0, edge_linewidth=0.5)
-# ax.set_title('Manhattan, New York City')
-
-"""Lower Manhattan"""
-# G = ox.load_graphml('data/lowermanhattan.graphml')
-# G = ox.project_graph(G)
-# fig, ax = ox.plot_graph(G, fig_height=12, node_size=0, edge_linewidth=0.5)
-# ax.set_title('Lower Manhattan, New York City')
-
-
-"""San Francisco"""
-# G = ox.load_graphml('data/sanfrancisco.graphml')
-# G = ox.project_graph(G)
-# fig, ax = ox.plot_graph(G, fig_height=12, fig_width=10, node_size=0, edge_linewidth=0.5)
-# ax.set_title('San Francisco, California')
-
-
-"""Piedmont, California"""
-G = ox.load_graphml('piedmont.graphml')
-G = ox.project_graph(G)
-fig, ax = ox.plot_graph(G, node_size=0, edge_linewidth=0.5, show=False)
-ax.set_title('Piedmont, California')
-
-
-# grab the dimensions of the figure
-axis = ax.axis()
-
-
-""" initialize the car and light state objects """
 N = 33  # cars
-# cars = Cars(sim.init_culdesac_start_location(N, axis), axis)
-cars = Cars(sim.init_random_node_start_location(N, axis), axis)
-lights = TrafficLights(sim.init_traffic_lights(axis, prescale=40), axis)
-
-""" for an example of learning using a single, convergent learner, initialize the sim using these cars and lights: """
-# cars = Cars(cl.init_custom_agent(n=1, fig_axis=axis), axis=axis)
-# lights = TrafficLights(cl.init_custom_lights(fig_axis=axis, prescale=None), axis)
-
-
-# initialize the Animator
-animator = Animator(fig=fig, ax=ax, cars_object=cars, lights_object=lights, num=(1, 10), n=N)
-init = animator.reset
-animate = animator.animate
 
-# for creating HTML frame-movies
-# ani = animation.FuncAnimation(fig, animate, init_func=init, frames=1200, interval=30, blit=True)
-# ani.save('traffic.html', fps=300, extra_args=['-vcodec', 'libx264'])
 
-# for creating mp4 movies
-ani = animation.FuncAnimation(fig, animate, init_func=init, frames=10000)
-mywriter = animation.FFMpegWriter(fps=120)
-ani.save('movie.mp4', writer=mywriter)
+def main():
+    # frames are rendered off-screen and taken from the canvas buffer
+    import matplotlib
+    matplotlib.use('Agg')
+    from animate import Animator
+    import basemap
+    from export import FFmpegPipe
+
+    # load figure for animation
+    """ Manhattan """
+    # nav.load_map('manhattan.graphml')
+    # fig, ax = basemap.plot_map(figsize=(30, 30))
+    # ax.set_title('Manhattan, New York City')
+
+    """Lower Manhattan"""
+    # nav.load_map('data/lowermanhattan.graphml')
+    # fig, ax = basemap.plot_map(figsize=(12, 12))
+    # ax.set_title('Lower Manhattan, New York City')
+
+    """San Francisco"""
+    # nav.load_map('data/sanfrancisco.graphml')
+    # fig, ax = basemap.plot_map(figsize=(10, 12))
+    # ax.set_title('San Francisco, California')
+
+    """Piedmont, California"""
+    # the road network is drawn from segments cached under .basemap, rather than by osmnx on every run
+    nav.load_map('piedmont.graphml')
+    fig, ax = basemap.plot_map()
+    ax.set_title('Piedmont, California')
+
+    # grab the dimensions of the figure
+    axis = ax.axis()
+
+    """ initialize the car and light state objects """
+    # cars = Cars(sim.init_culdesac_start_location(N, axis), axis)
+    cars = Cars(sim.init_random_node_start_location(N, axis), axis)
+    lights = TrafficLights(sim.init_traffic_lights(axis, prescale=40), axis)
+
+    """ for an example of learning using a single, convergent learner, initialize the sim using these cars and lights: """
+    # cars = Cars(cl.init_custom_agent(n=1, fig_axis=axis), axis=axis)
+    # lights = TrafficLights(cl.init_custom_lights(fig_axis=axis, prescale=None), axis)
+
+    # for creating mp4 movies: every blitted frame is streamed to ffmpeg, which encodes while the simulation runs
+    with FFmpegPipe('movie.mp4', fps=120) as movie:
+        # initialize the Animator
+        animator = Animator(fig=fig, ax=ax, cars_object=cars, lights_object=lights, num=(1, 10), n=N, movie=movie)
+        animator.reset()
+        for i in range(10000):
+            animator.animate(i)
+        animator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Draws the road network of the map G without osmnx. osmnx.plot_graph builds a GeoDataFrame of every edge each time a
+figure is opened, which costs seconds on Piedmont and tens of seconds on Manhattan. Here the line segments of a map
+are extracted once and kept on disk under a hash of the map, and so is an image of the roads for each figure size and
+style, so that opening a figure is a cache load. plot_map draws the roads either as
+    a LineCollection of the segments, which stays sharp at any zoom (e.g. when an Animator focuses on a route), or
+    the cached image, the cheapest to draw, which fits the full map at the figure size it was drawn for.
+The figure is set up as osmnx.plot_graph sets it up, so either can be used in place of the other.
+"""
+import hashlib
+import json
+import navigation as nav
+import numpy as np
+import os
+
+
+cache_dir = '.basemap'
+
+
+def map_key():
+    """
+    :return key: str: a hash of the current map, from its nodes, their positions and its edges
+    """
+    cache = nav.map_cache()
+    if 'map-key' not in cache:
+        index, edges = nav.node_index(), nav.edge_geometry()
+        digest = hashlib.sha1()
+        for array in (index.ids, index.positions, edges.u, edges.v):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        cache['map-key'] = digest.hexdigest()[:16]
+    return cache['map-key']
+
+
+def segments():
+    """
+    the roads of the current map as polylines, extracted from the edge geometry on first use and then loaded from
+    the cache directory
+
+    :return    points: array: shape (m, 2) of the x and y of every point of every polyline, one after the other
+    :return   offsets: array: where each polyline starts in points (one more entry than there are polylines)
+    """
+    cache = nav.map_cache()
+    if 'segments' not in cache:
+        filename = os.path.join(cache_dir, '{}-segments.npz'.format(map_key()))
+        if os.path.isfile(filename):
+            with np.load(filename) as data:
+                cache['segments'] = data['points'], data['offsets']
+        else:
+            G = nav.graph()
+            lines = []
+            for u, v, data in G.edges(data=True):
+                if 'geometry' in data:
+                    lines.append(np.asarray(data['geometry'].coords, dtype=float))
+                else:
+                    # the edge is a straight line from node to node
+                    lines.append(np.array([(G.nodes[u]['x'], G.nodes[u]['y']), (G.nodes[v]['x'], G.nodes[v]['y'])]))
+            points = np.vstack(lines) if lines else np.empty((0, 2))
+            offsets = np.concatenate([[0], np.cumsum([len(line) for line in lines])]).astype(np.int64)
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(filename, points=points, offsets=offsets)
+            cache['segments'] = points, offsets
+    return cache['segments']
+
+
+def lines():
+    """
+    :return lines: list of arrays: the polylines of the roads of the current map, as taken by a LineCollection
+    """
+    points, offsets = segments()
+    return np.split(points, offsets[1:-1])
+
+
+def configure_axis(ax, axis):
+    """
+    sets the limits of an axis and hides its frame and ticks, as osmnx.plot_graph does
+
+    :param   ax: axis: from matplotlib
+    :param axis: tuple: xmin, xmax, ymin, ymax
+    :return None:
+    """
+    ax.set_xlim(axis[0], axis[1])
+    ax.set_ylim(axis[2], axis[3])
+    ax.margins(0)
+    ax.tick_params(which='both', direction='in')
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.get_xaxis().set_visible(False)
+    ax.get_yaxis().set_visible(False)
+    ax.set_aspect('equal')
+
+
+def raster(figsize=(8, 8), dpi=100, bgcolor='#111111', edge_color='#999999', edge_linewidth=0.5):
+    """
+    the roads of the current map as drawn inside the axis of a figure of the given size and style, drawn on first
+    use and then loaded from the cache directory
+
+    :param          figsize:  tuple: inches
+    :param              dpi:    int
+    :param          bgcolor:    str
+    :param       edge_color:    str
+    :param   edge_linewidth: double
+    :return           image:  array: RGBA, shape (height, width, 4)
+    """
+    style = json.dumps([list(figsize), dpi, bgcolor, edge_color, edge_linewidth])
+    filename = os.path.join(cache_dir, '{}-{}.png'.format(map_key(), hashlib.sha1(style.encode()).hexdigest()[:16]))
+    cache = nav.map_cache()
+    if ('raster', style) not in cache:
+        from matplotlib.image import imread, imsave
+        if os.path.isfile(filename):
+            cache[('raster', style)] = imread(filename)
+        else:
+            import matplotlib.pyplot as plt
+            fig, ax = plot_map(figsize=figsize, dpi=dpi, bgcolor=bgcolor, edge_color=edge_color,
+                               edge_linewidth=edge_linewidth)
+            fig.canvas.draw()
+            # the equal aspect ratio shrinks the axis inside the figure, so only the axis is kept
+            x0, y0, x1, y1 = np.round(ax.get_window_extent().extents).astype(int)
+            height = np.asarray(fig.canvas.buffer_rgba()).shape[0]
+            image = np.array(fig.canvas.buffer_rgba())[height - y1:height - y0, x0:x1]
+            plt.close(fig)
+            os.makedirs(cache_dir, exist_ok=True)
+            imsave(filename, image)
+            cache[('raster', style)] = image
+    return cache[('raster', style)]
+
+
+def plot_map(figsize=(8, 8), dpi=100, bgcolor='#111111', edge_color='#999999', edge_linewidth=0.5, image=False,
+             ax=None):
+    """
+    opens a figure of the road network of the current map, in place of osmnx.plot_graph(G, node_size=0, ...)
+
+    :param          figsize:  tuple: inches
+    :param              dpi:    int
+    :param          bgcolor:    str
+    :param       edge_color:    str
+    :param   edge_linewidth: double
+    :param            image:   bool: draw the cached image of the roads rather than their segments
+    :param               ax: None or axis: to draw on (default a new figure)
+    :return       fig, ax:
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    if ax is None:
+        fig, ax = plt.subplots(figsize=figsize, dpi=dpi, facecolor=bgcolor, frameon=False)
+        ax.set_facecolor(bgcolor)
+    else:
+        fig = ax.figure
+
+    axis = nav.map_bounds()
+    if image:
+        ax.imshow(raster(figsize, dpi, bgcolor, edge_color, edge_linewidth), extent=axis, interpolation='none',
+                  zorder=1)
+    else:
+        ax.add_collection(LineCollection(lines(), colors=edge_color, linewidths=edge_linewidth, zorder=1))
+    configure_axis(ax, axis)
+    return fig, ax
@@ -0,0 +1,311 @@
+"""
+Benchmarks the simulation on synthetic grid maps, so that it can be run offline and on maps of any size.
+
+grid_graph builds a Manhattan-style road network (long blocks one way, short blocks the other, optionally with
+alternating one-way streets) with projected coordinates, edge lengths and edge geometry, plus a dead-end stub off every
+boundary node so that cars have culdesacs to start from and head for. Each stage is run on each grid at increasing
+fleet sizes:
+    sim       Cars.update (with TrafficLights.update) for a number of ticks
+    routing   shortest routes and paths between random node pairs
+    lights    TrafficLights.update alone
+    learning  Env episodes chosen and learned from by a Q table, as in learn.train
+The ticks per second, routes per second and peak RSS of each run are written to a JSON file, with the scaling of the
+time per tick with the fleet size. Given a previous file as baseline, the runs which have slowed down are reported.
+
+    python benchmark.py [benchmark.json [baseline.json]]
+"""
+import json
+import learn
+import multiprocessing
+import navigation as nav
+import networkx as nx
+import numpy as np
+import qfunctions
+import random
+import sys
+import time
+
+
+# grids as (avenues, streets); every grid is run at every fleet size which fits on it
+grids = [(6, 10), (10, 20)]
+fleet_sizes = [1, 4, 16, 32]
+stages = ['sim', 'routing', 'lights', 'learning']
+dt = 1 / 1000
+ticks = 200  # per sim and lights run
+routes = 200  # per routing run
+episodes = 2  # per learning run
+max_time = 0.5  # simulated seconds after which a learning episode is given up on
+prescale = 4  # every prescale-th intersection has a traffic light
+seed = 0
+tolerance = 0.2  # a run is reported as a regression when it is this fraction slower than the baseline
+
+
+def grid_graph(avenues=10, streets=20, avenue_block=270, street_block=80, oneway=False, origin=(583000, 4506000)):
+    """
+    a synthetic road network in the form of a projected OSMnx graph
+
+    :param      avenues:   int: roads running north-south
+    :param      streets:   int: roads running east-west
+    :param avenue_block: double: metres between avenues
+    :param street_block: double: metres between streets
+    :param       oneway:   bool: inner avenues and streets alternate in direction (the outer ones are two-way)
+    :param       origin:  tuple: x and y of the south-west corner, in metres (UTM zone 18N by default)
+    :return           G: MultiDiGraph
+    """
+    from shapely.geometry import LineString
+
+    G = nx.MultiDiGraph(crs='epsg:32618', name='grid {}x{}'.format(avenues, streets))
+    streets_per_node = {}
+
+    def node_id(i, j):
+        return 1 + i * streets + j
+
+    def add_road(u, v, both_ways=True):
+        (ux, uy), (vx, vy) = (G.nodes[u]['x'], G.nodes[u]['y']), (G.nodes[v]['x'], G.nodes[v]['y'])
+        for a, b, coords in [(u, v, [(ux, uy), ((ux + vx) / 2, (uy + vy) / 2), (vx, vy)])] + \
+                ([(v, u, [(vx, vy), ((ux + vx) / 2, (uy + vy) / 2), (ux, uy)])] if both_ways else []):
+            G.add_edge(a, b, osmid=len(G.edges), oneway=not both_ways, length=float(np.hypot(vx - ux, vy - uy)),
+                       geometry=LineString(coords))
+        streets_per_node[u] = streets_per_node.get(u, 0) + 1
+        streets_per_node[v] = streets_per_node.get(v, 0) + 1
+
+    for i in range(avenues):
+        for j in range(streets):
+            G.add_node(node_id(i, j), x=origin[0] + i * avenue_block, y=origin[1] + j * street_block)
+
+    for i in range(avenues):
+        for j in range(streets):
+            if i + 1 < avenues:
+                # a street, from avenue i to avenue i + 1
+                outer = j in (0, streets - 1)
+                u, v = (node_id(i, j), node_id(i + 1, j)) if j % 2 or not oneway else (node_id(i + 1, j), node_id(i, j))
+                add_road(u, v, both_ways=outer or not oneway)
+            if j + 1 < streets:
+                # an avenue, from street j to street j + 1
+                outer = i in (0, avenues - 1)
+                u, v = (node_id(i, j), node_id(i, j + 1)) if i % 2 or not oneway else (node_id(i, j + 1), node_id(i, j))
+                add_road(u, v, both_ways=outer or not oneway)
+
+    # a dead end off every boundary node: the culdesacs. Cars start in one culdesac and head for the next, so they
+    # are added alternately from opposite sides of the perimeter, and every car crosses the grid
+    perimeter = [(i, 0) for i in range(avenues)] + [(avenues - 1, j) for j in range(1, streets)] + \
+        [(i, streets - 1) for i in range(avenues - 2, -1, -1)] + [(0, j) for j in range(streets - 2, 0, -1)]
+    # starting half way along the south side rather than at a corner, which is always a light
+    perimeter = perimeter[avenues // 2:] + perimeter[:avenues // 2]
+    half = len(perimeter) // 2
+    crossing = [corner for pair in zip(perimeter[:half], perimeter[half:]) for corner in pair] + perimeter[2 * half:]
+    for stub, (i, j) in enumerate(crossing, start=avenues * streets + 1):
+        dx, dy = (i == avenues - 1) - (i == 0), (j == streets - 1) - (j == 0)
+        G.add_node(stub, x=G.nodes[node_id(i, j)]['x'] + dx * street_block / 2,
+                   y=G.nodes[node_id(i, j)]['y'] + dy * street_block / 2)
+        add_road(node_id(i, j), stub)
+
+    G.graph['streets_per_node'] = streets_per_node
+    return G
+
+
+def peak_rss():
+    """
+    :return megabytes: None or double: the peak resident memory of this process so far (None where unavailable); as
+                                       every run has a process of its own (see run_isolated), that of the run
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def seed_all():
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def bench_sim(n, axis):
+    """
+    :return result: dict: ticks-per-second of n cars and the lights
+    """
+    from cars import Cars, TrafficLights
+    import simulation as sim
+    seed_all()
+    cars = Cars(sim.init_culdesac_start_location(n, axis), axis)
+    lights = TrafficLights(sim.init_traffic_lights(axis, prescale=prescale), axis)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        lights.update(dt)
+        cars.update(dt, lights.state)
+    seconds = time.perf_counter() - start
+    return {'ticks': ticks, 'seconds': seconds, 'ticks-per-second': ticks / seconds}
+
+
+def bench_routing(n, axis):
+    """
+    :return result: dict: routes-per-second, each a route and a path between two random nodes
+    """
+    seed_all()
+    nodes = np.asarray(list(nav.graph().nodes()))
+    pairs = [np.random.choice(nodes, size=2, replace=False) for _ in range(routes)]
+    start = time.perf_counter()
+    for origin, destination in pairs:
+        nav.get_route(origin, destination)
+        nav.get_init_path(origin, destination)
+    seconds = time.perf_counter() - start
+    return {'routes': routes, 'seconds': seconds, 'routes-per-second': routes / seconds}
+
+
+def bench_lights(n, axis):
+    """
+    :return result: dict: ticks-per-second of the lights alone
+    """
+    from cars import TrafficLights
+    import simulation as sim
+    seed_all()
+    lights = TrafficLights(sim.init_traffic_lights(axis, prescale=prescale), axis)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        lights.update(dt)
+    seconds = time.perf_counter() - start
+    return {'ticks': ticks, 'lights': len(lights.state), 'seconds': seconds, 'ticks-per-second': ticks / seconds}
+
+
+def bench_learning(n, axis):
+    """
+    :return result: dict: episodes of an Env of n cars, each an action chosen, simulated and learned from
+    """
+    from environment import Env
+    # the agent is the first car whose state can be determined: rerouting fails for some routes, e.g. those whose
+    # first intersection has a light
+    for agent in range(n):
+        seed_all()
+        env = Env(n=n, agent=agent, dt=dt, animate=False, max_time=max_time, axis=axis)
+        try:
+            env.reset((0, episodes))
+            break
+        except (ValueError, IndexError):
+            continue
+    else:
+        return {'error': 'the state of none of the {} cars could be determined'.format(n), 'seconds': 0}
+
+    model = qfunctions.make_value_function('tabular')
+    ticks_run = 0
+    start = time.perf_counter()
+    for i in range(episodes):
+        state = env.reset((i, episodes))
+        action = learn.choose_action(model, state, learn.eps)
+        new_state, reward, done, report = env.step(action=action, num=(i, episodes))
+        if not report['timeout']:
+            learn.learn_transition(model, state, action, reward, new_state)
+        ticks_run += report['ticks']
+    seconds = time.perf_counter() - start
+    return {'agent': agent, 'episodes': episodes, 'ticks': ticks_run, 'seconds': seconds,
+            'episodes-per-second': episodes / seconds, 'ticks-per-second': ticks_run / seconds}
+
+
+benches = {'sim': bench_sim, 'routing': bench_routing, 'lights': bench_lights, 'learning': bench_learning}
+
+
+def scaling(results):
+    """
+    fits the seconds per tick of each stage on each grid as a power of the fleet size
+
+    :param  results:  list: of result dicts
+    :return  curves:  list: per stage and grid, the cars, ticks-per-second and the exponent of the fit
+    """
+    curves = []
+    for stage in stages:
+        for grid in sorted({result['grid'] for result in results}):
+            runs = sorted([result for result in results if result['stage'] == stage and result['grid'] == grid
+                           and 'ticks-per-second' in result], key=lambda result: result['cars'])
+            if not runs:
+                continue
+            cars = np.array([run['cars'] for run in runs], dtype=float)
+            rates = np.array([run['ticks-per-second'] for run in runs])
+            exponent = float(np.polyfit(np.log(cars), -np.log(rates), 1)[0]) if np.unique(cars).size > 1 else None
+            curves.append({'stage': stage, 'grid': grid, 'cars': cars.astype(int).tolist(),
+                           'ticks-per-second': rates.tolist(), 'exponent': exponent})
+    return curves
+
+
+def compare(results, baseline):
+    """
+    :param    results:  list: of result dicts
+    :param   baseline:  list: of result dicts, from an earlier run
+    :return regressions: list: of (stage, grid, cars, rate, baseline rate) for runs more than tolerance slower
+    """
+    regressions = []
+    earlier = {(result['stage'], result['grid'], result['cars']): result for result in baseline}
+    for result in results:
+        key = (result['stage'], result['grid'], result['cars'])
+        rate = 'routes-per-second' if result['stage'] == 'routing' else 'ticks-per-second'
+        if rate in result and rate in earlier.get(key, {}) and result[rate] < (1 - tolerance) * earlier[key][rate]:
+            regressions.append(key + (result[rate], earlier[key][rate]))
+    return regressions
+
+
+def run_bench(stage, n, axis):
+    """
+    :return result: dict: of the bench, with the peak resident memory of the process it ran in
+    """
+    result = benches[stage](n, axis)
+    result['peak-rss-mb'] = peak_rss()
+    return result
+
+
+def run_isolated(stage, n, axis):
+    """
+    runs one stage in a new worker process, which inherits the map and the settings. The peak memory of a worker
+    starts from what it inherits, so it is that of this run alone rather than the largest of every run before it
+
+    :return result: dict: of run_bench
+    """
+    with multiprocessing.Pool(1) as pool:
+        return pool.apply(run_bench, (stage, n, axis))
+
+
+def run():
+    """
+    runs every stage on every grid at every fleet size
+
+    :return report: dict: the settings, the results of every run and the scaling curves
+    """
+    results = []
+    for avenues, streets in grids:
+        nav.set_graph(grid_graph(avenues, streets))
+        axis = nav.map_bounds()
+        grid = '{}x{}'.format(avenues, streets)
+        for n in fleet_sizes:
+            if n >= len(nav.find_culdesacs()):
+                print('Skipping {} cars, which do not fit on the {} grid'.format(n, grid))
+                continue
+            for stage in stages:
+                if stage in ('routing', 'lights') and n != fleet_sizes[0]:
+                    continue  # neither depends on the fleet
+                result = dict(run_isolated(stage, n, axis), stage=stage, grid=grid, cars=n,
+                              nodes=len(nav.graph()), edges=nav.graph().number_of_edges())
+                print('{stage:>8} {grid:>6} {cars:>4} cars: {seconds:.2f} s'.format(**result))
+                results.append(result)
+
+    settings = {'grids': grids, 'fleet-sizes': fleet_sizes, 'dt': dt, 'ticks': ticks, 'routes': routes,
+                'episodes': episodes, 'max-time': max_time, 'prescale': prescale, 'seed': seed}
+    return {'settings': settings, 'results': results, 'scaling': scaling(results)}
+
+
+def main(filename='benchmark.json', baseline=None):
+    report = run()
+    with open(filename, 'w') as file:
+        json.dump(report, file, indent=1)
+
+    if baseline:
+        with open(baseline) as file:
+            regressions = compare(report['results'], json.load(file)['results'])
+        for stage, grid, cars, rate, earlier in regressions:
+            print('Regression: {} on the {} grid with {} cars ran at {:.1f}/s against {:.1f}/s'.format(
+                stage, grid, cars, rate, earlier))
+        return len(regressions)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main(*sys.argv[1:3]) else 0)
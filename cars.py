@@ -5,10 +5,13 @@ Traffic lights when color=red are obstacles just like cars
 Cars slow down exponentially as radius of road curvature gets smaller
 Cars slow down for obstacles exponentially as obstacles get closer, and stop at stop_distance
 """
+import copy
 import simulation as sim
 import models
 import navigation as nav
 import numpy as np
+import profiling
+from scipy.spatial import cKDTree
 
 
 class Cars:
@@ -26,7 +29,10 @@ class Cars:
         self.lights = 0
         self.axis = axis
         self.stop_distance = 5
+        # objects with an observe_cars(cars) method, called after every update (e.g. a TrajectoryRecorder)
+        self.observers = []
 
+    @profiling.timed('Cars.update')
     def update(self, dt, lights):
         """
         update the position of the car by a dt time step
@@ -44,33 +50,215 @@ class Cars:
         self.time_elapsed += dt
         # determine binning and assign bins to cars
         # TODO: don't re-sort every time-step. Only place cars in a new bin if their bin is about to change
-        self.state['xbin'], self.state['ybin'] = models.determine_bins(self.axis, self.state)
+        with profiling.phase('Cars.update/bins'):
+            self.state['xbin'], self.state['ybin'] = models.determine_bins(self.axis, self.state)
 
-        node_distances, car_distances, light_distances = self.find_obstacles()
+        with profiling.phase('Cars.update/find-obstacles'):
+            node_distances, car_distances, light_distances = self.find_obstacles()
 
         self.state['distance-to-node'] = node_distances
         self.state['distance-to-car'] = car_distances
         self.state['distance-to-red-light'] = light_distances
 
-        self.state['route'], self.state['xpath'], self.state['ypath'], self.state['vx'], \
-            self.state['vy'], self.state['route-time'] = sim.update_cars(self.state, dt)
+        with profiling.phase('Cars.update/update-cars'):
+            self.state['route'], self.state['xpath'], self.state['ypath'], self.state['vx'], \
+                self.state['vy'], self.state['route-time'] = sim.update_cars(self.state, dt)
 
-        self.state['x'] = self.state['x'] + self.state['vx'] * dt
-        self.state['y'] = self.state['y'] + self.state['vy'] * dt
+        with profiling.phase('Cars.update/integrate'):
+            self.state['x'] = self.state['x'] + self.state['vx'] * dt
+            self.state['y'] = self.state['y'] + self.state['vy'] * dt
 
+        self.notify()
         return self.state
 
+    def notify(self):
+        for observer in self.observers:
+            observer.observe_cars(self)
+
+    def snapshot(self):
+        """
+        captures the state of the cars. Path lists are shared rather than copied, which is safe because the
+        simulation only ever replaces a car's path (slicing off crossed nodes) and never mutates it in place
+
+        :return snapshot: dict
+        """
+        return {'state': self.state.copy(), 'time-elapsed': self.time_elapsed}
+
+    def restore(self, snapshot):
+        """
+        returns the cars to a snapshot; the snapshot itself is left untouched and can be restored again
+
+        :param snapshot: dict: from Cars.snapshot
+        :return    self: Cars
+        """
+        self.state = snapshot['state'].copy()
+        self.time_elapsed = snapshot['time-elapsed']
+        return self
+
+    def fork(self):
+        """
+        :return cars: Cars: an independent copy of these cars which can be simulated separately (and unobserved)
+        """
+        cars = copy.copy(self).restore(self.snapshot())
+        cars.observers = []
+        return cars
+
     def find_obstacles(self):
-        node_distances, car_distances, light_distances = [], [], []
-        for car in self.state.iterrows():
-            frontview = nav.FrontView(car[1], stop_distance=self.stop_distance)
-            node_distances.append(frontview.distance_to_node())
-            car_distances.append(frontview.distance_to_car(self.state))
-            light_distances.append(frontview.distance_to_light(self.lights))
+        # one pass per kind of obstacle, so that each can be timed on its own
+        with profiling.phase('Cars.find_obstacles/front-views'):
+            frontviews = [nav.FrontView(car, stop_distance=self.stop_distance) for _, car in self.state.iterrows()]
+        with profiling.phase('Cars.find_obstacles/nodes'):
+            node_distances = [frontview.distance_to_node() for frontview in frontviews]
+        with profiling.phase('Cars.find_obstacles/cars'):
+            car_distances = [frontview.distance_to_car(self.state) for frontview in frontviews]
+        with profiling.phase('Cars.find_obstacles/lights'):
+            light_distances = [frontview.distance_to_light(self.lights) for frontview in frontviews]
 
         return node_distances, car_distances, light_distances
 
 
+def _numeric(dtype):
+    """
+    :param dtype: dtype: of a dataframe column
+    :return bool: True for numpy booleans, integers and floats
+    """
+    return isinstance(dtype, np.dtype) and dtype.kind in 'biuf'
+
+
+class RegionOfInterestCars(Cars):
+    def __init__(self, init_state, axis, agent, radius=400, refresh=100):
+        """
+        cars which are simulated at full fidelity only within radius of the agent's remaining path. The other cars
+        advance at free flow along their paths, in one catch-up every refresh time steps, when the region is also
+        redrawn around the agent's progress. The cost of a time step thus grows with the number of cars near the
+        agent rather than with the size of the fleet
+
+        :param init_state: dataframe: each Series row is a car
+        :param       axis:      list
+        :param      agent:       int: the ID of the car whose route time is being measured
+        :param     radius:    double: cars within this distance of the agent's remaining path are in the region
+        :param    refresh:       int: time steps between updates of the region
+        """
+        super().__init__(init_state, axis)
+        self.agent = agent
+        self.radius = radius
+        self.refresh = refresh
+        self.ticks = 0
+        self.lag = 0
+        self.region = np.ones(len(self.state), dtype=bool)
+
+    @profiling.timed('Cars.update')
+    def update(self, dt, lights):
+        """
+        update the position of the cars in the region by a dt time step
+
+        :param       dt:  double
+        :param   lights:  dataframe
+        :return self.state: dataframe
+        """
+        self.lights = lights
+        self.time_elapsed += dt
+        if self.ticks % self.refresh == 0:
+            with profiling.phase('Cars.update/region'):
+                self.update_region()
+        self.ticks += 1
+        self.lag += dt
+
+        state = self.state
+        self.state = state[self.region].reset_index(drop=True)
+        with profiling.phase('Cars.update/bins'):
+            self.state['xbin'], self.state['ybin'] = models.determine_bins(self.axis, self.state)
+
+        with profiling.phase('Cars.update/find-obstacles'):
+            node_distances, car_distances, light_distances = self.find_obstacles()
+
+        self.state['distance-to-node'] = node_distances
+        self.state['distance-to-car'] = car_distances
+        self.state['distance-to-red-light'] = light_distances
+
+        with profiling.phase('Cars.update/update-cars'):
+            self.state['route'], self.state['xpath'], self.state['ypath'], self.state['vx'], \
+                self.state['vy'], self.state['route-time'] = sim.update_cars(self.state, dt)
+
+        with profiling.phase('Cars.update/integrate'):
+            self.state['x'] = self.state['x'] + self.state['vx'] * dt
+            self.state['y'] = self.state['y'] + self.state['vy'] * dt
+
+        # write the cars of the region back into the fleet
+        with profiling.phase('Cars.update/write-back'):
+            rows = np.flatnonzero(self.region)
+            for column in self.state.columns:
+                values = self.state[column].to_numpy()
+                current = state[column].to_numpy() if column in state else np.full(len(state), np.nan)
+                if _numeric(values.dtype) and _numeric(current.dtype):
+                    # only the columns in which a car of the region changed are written. Replacing a column with
+                    # an updated copy of its array is cheaper than assigning to part of it in pandas
+                    dtype = np.result_type(current.dtype, values.dtype)
+                    if current.dtype != dtype or column not in state or \
+                            not np.array_equal(current[rows], values, equal_nan=dtype.kind == 'f'):
+                        current = current.astype(dtype)
+                        current[rows] = values
+                        state[column] = current
+                else:
+                    # routes and paths are lists, of which only those which were replaced are written, car by car
+                    if column not in state:
+                        state[column] = current
+                    position = state.columns.get_loc(column)
+                    for row, value, old in zip(rows, values, current[rows]):
+                        if value is not old:
+                            state.iat[row, position] = value
+        self.state = state
+
+        self.notify()
+        return self.state
+
+    def update_region(self):
+        """
+        catches up the cars outside the region by free flow over the time they were left out of it, then redraws the
+        region around what remains of the agent's path
+
+        :return region: array of bool
+        """
+        for row in np.flatnonzero(~self.region):
+            car = self.state.loc[row]
+            x, y, xpath, ypath, route_time = sim.free_flow(car, self.lag)
+            self.state.at[row, 'x'], self.state.at[row, 'y'] = x, y
+            self.state.at[row, 'xpath'], self.state.at[row, 'ypath'] = xpath, ypath
+            self.state.at[row, 'route-time'] = route_time
+        self.lag = 0
+        self.state['xbin'], self.state['ybin'] = models.determine_bins(self.axis, self.state)
+
+        agent = self.state.loc[self.agent]
+        path = np.column_stack([np.append(agent['x'], agent['xpath']),
+                                np.append(agent['y'], agent['ypath'])]).astype(float)
+        distances, _ = cKDTree(path).query(self.state[['x', 'y']].to_numpy(dtype=float),
+                                           distance_upper_bound=self.radius)
+        self.region = np.isfinite(distances)
+        self.region[self.agent] = True
+        return self.region
+
+    def snapshot(self):
+        """
+        captures the state of the cars along with the region and the time its outsiders are owed
+
+        :return snapshot: dict
+        """
+        snapshot = super().snapshot()
+        snapshot.update({'ticks': self.ticks, 'lag': self.lag, 'region': self.region.copy()})
+        return snapshot
+
+    def restore(self, snapshot):
+        """
+        :param snapshot: dict: from RegionOfInterestCars.snapshot (or Cars.snapshot, to start a fresh region)
+        :return    self: RegionOfInterestCars
+        """
+        super().restore(snapshot)
+        self.ticks = snapshot.get('ticks', 0)
+        self.lag = snapshot.get('lag', 0)
+        self.region = snapshot['region'].copy() if 'region' in snapshot else np.ones(len(self.state), dtype=bool)
+        return self
+
+
 class TrafficLights:
     def __init__(self, light_state, axis):
         """
@@ -83,7 +271,10 @@ class TrafficLights:
         self.time_elapsed = 0
         self.xbins = np.arange(axis[0], axis[1], 200)
         self.ybins = np.arange(axis[2], axis[3], 200)
+        # objects with an observe_lights(lights) method, called after every update
+        self.observers = []
 
+    @profiling.timed('TrafficLights.update')
     def update(self, dt):
         """
         update the state of the traffic lights
@@ -94,4 +285,50 @@ class TrafficLights:
         self.time_elapsed += dt
         time_to_switch = np.isclose(0, self.time_elapsed % self.state['switch-time'], rtol=1.0e-4)
         self.state['go-values'] = ~self.state['go-values'] * time_to_switch + self.state['go-values'] * ~time_to_switch
+        for observer in self.observers:
+            observer.observe_lights(self)
         return self.state
+
+    def face_positions(self):
+        """
+        :return xs, ys: arrays: the positions of the faces of all lights, concatenated in light order
+        """
+        if self.state.empty:
+            return np.zeros(0), np.zeros(0)
+        return np.concatenate([np.asarray(xs, dtype=float) for xs in self.state['out-xpositions']]), \
+            np.concatenate([np.asarray(ys, dtype=float) for ys in self.state['out-ypositions']])
+
+    def face_go_values(self):
+        """
+        :return go_values: array of bool: the go-values of the faces of all lights, concatenated in light order
+        """
+        if self.state.empty:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate([np.asarray(go, dtype=bool) for go in self.state['go-values']])
+
+    def snapshot(self):
+        """
+        captures the light phases and timer. The go-values arrays are shared, since update replaces them
+
+        :return snapshot: dict
+        """
+        return {'state': self.state.copy(), 'time-elapsed': self.time_elapsed}
+
+    def restore(self, snapshot):
+        """
+        returns the lights to a snapshot
+
+        :param snapshot: dict: from TrafficLights.snapshot
+        :return    self: TrafficLights
+        """
+        self.state = snapshot['state'].copy()
+        self.time_elapsed = snapshot['time-elapsed']
+        return self
+
+    def fork(self):
+        """
+        :return lights: TrafficLights: an independent copy of these lights (and unobserved)
+        """
+        lights = copy.copy(self).restore(self.snapshot())
+        lights.observers = []
+        return lights
@@ -1,28 +1,16 @@
-# python=3.6 requires using Qt4Agg backend for animation saving
-import matplotlib
-# matplotlib.use('Qt4Agg')
 import models
 import navigation as nav
 from networkx import NetworkXNoPath
 import numpy as np
-import osmnx as ox
 import pandas as pd
 
-"""Piedmont, California"""
-G = ox.load_graphml('piedmont.graphml')
-G = ox.project_graph(G)
-fig, ax = ox.plot_graph(G, node_size=0, edge_linewidth=0.5)
 
-# grab the dimensions of the figure
-axis = ax.axis()
-
-
-def init_custom_agent(n=1, fig_axis=axis, car_id=None, alternate_route=None):
+def init_custom_agent(n=1, fig_axis=None, car_id=None, alternate_route=None):
     """
-    This function initializes a singular car with custom origin and destination
+    This function initializes a singular car with custom origin and destination (on the Piedmont, California map)
 
     :param               n:          int
-    :param        fig_axis:         list
+    :param        fig_axis: None or list: x and y ranges of the map (default from the map data)
     :param          car_id:  None or int
     :param alternate_route: None or list
     :return     cars_frame:    DataFrame
@@ -59,6 +47,7 @@ def init_custom_agent(n=1, fig_axis=axis, car_id=None, alternate_route=None):
     cars_frame = pd.DataFrame(cars_data)
 
     # determine binning and assign bins to cars
+    fig_axis = fig_axis if fig_axis is not None else nav.map_bounds()
     cars_frame['xbin'], cars_frame['ybin'] = models.determine_bins(fig_axis, cars_frame)
 
     return cars_frame
@@ -1,23 +1,30 @@
-from animate import Animator
-from cars import Cars, TrafficLights
+import copy
+from cars import Cars, RegionOfInterestCars, TrafficLights
 import navigation as nav
 import numpy as np
+import profiling
 import simulation as sim
+import time
 
 # additional testing module
 # import convergent_learner
 
 
 class Env:
-    def __init__(self, n, fig, ax, agent, dt, animate=False):
+    def __init__(self, n, fig=None, ax=None, agent=0, dt=1 / 1000, animate=False, roi=None, max_time=None, axis=None):
         """
-        initializes an environment for a car in the system
+        initializes an environment for a car in the system. Without a figure the environment is headless, and the map
+        is only drawn if it is to be animated
 
         :param         n:       int: number of cars to simulate
-        :param       fig:    figure: from matplotlib
-        :param        ax:      axis: from matplotlib
+        :param       fig: None or figure: from matplotlib
+        :param        ax: None or axis: from matplotlib
         :param     agent:       int: the ID of the car (agent)
         :param   animate:      bool: if the environment is to be animated while learning
+        :param       roi: None or double: simulate only the cars within this distance of the agent's remaining path
+                                          at full fidelity, and the rest at free flow (None simulates every car fully)
+        :param  max_time: None or double: simulated seconds after which an agent which has not arrived is given up on
+        :param      axis: None or list: x and y ranges of the road network (default from ax, or else from the map data)
         """
         self.N = n
         self.num = None
@@ -27,17 +34,35 @@ class Env:
         self.dt = dt
         self.animate = animate
         self.animator = None
-        self.axis = self.ax.axis()
+        self.roi = roi
+        self.max_time = max_time
+        self.stop_distance = 5
+        self.stats = {}
+        self.timeouts = 0
+        if axis is not None:
+            self.axis = axis
+        elif self.ax is not None:
+            self.axis = self.ax.axis()
+        else:
+            self.axis = nav.map_bounds()
         self.route_times = []
         self.car_init_method = sim.init_culdesac_start_location
         self.light_init_method = sim.init_traffic_lights
         # self.car_init_method = convergent_learner.init_custom_agent
         # self.light_init_method = convergent_learner.init_custom_lights
-        self.cars_object = Cars(self.car_init_method(self.N, self.axis), self.axis)
+        # the initial fleet is routed once and kept as a template from which every reset is copied
+        self.init_cars = self.car_init_method(self.N, self.axis)
+        # rerouting never changes a destination, so the agent's is looked up once
+        self.destination = np.array(nav.get_position_of_node(self.init_cars.loc[self.agent]['destination']))
+        self.cars_object = self.make_cars()
         self.lights_object = TrafficLights(self.light_init_method(self.axis, prescale=40), self.axis)
+        self.stateview = None
+        # the snapshot from which the routes available to the agent are compared
+        self.decision_point = self.snapshot()
         self.high = 10
         self.low = 2
         self.shortest_route_thresh = 5
+        self.timeout_reward = 0
 
     def reset(self, num):
         """
@@ -46,9 +71,9 @@ class Env:
         :param    num: tuple: int, int
         :return state:   int
         """
-        # initialize cars every reset
-        init_cars = self.car_init_method(self.N, self.axis)
-        self.cars_object = Cars(init_state=init_cars, axis=self.axis)
+        # restore the cars from the initial template (Cars copies its init_state)
+        self.cars_object = self.make_cars()
+        self.decision_point = self.snapshot()
         stateview = self.refresh_stateview()
         state = stateview.determine_state()[0]
         state = state.index(True)
@@ -56,42 +81,170 @@ class Env:
         if self.animate:
             # init animator
             self.num = num
-            self.animator = Animator(fig=self.fig, ax=self.ax, cars_object=self.cars_object,
-                                     lights_object=self.lights_object, num=self.num)
+            self.animator = self.make_animator()
 
         return state
 
+    def make_animator(self):
+        """
+        prepares an animator for the current episode, first drawing the map if the environment has no figure.
+        Plotting modules are only imported here, so that a headless environment never loads them
+
+        :return animator: Animator
+        """
+        from animate import Animator
+        if self.animator is not None:
+            self.animator.remove()
+        if self.ax is None:
+            import basemap
+            self.fig, self.ax = basemap.plot_map()
+        return Animator(fig=self.fig, ax=self.ax, cars_object=self.cars_object,
+                        lights_object=self.lights_object, num=self.num)
+
+    def make_cars(self):
+        """
+        :return cars_object: Cars: a fresh copy of the initial fleet
+        """
+        if self.roi:
+            return RegionOfInterestCars(init_state=self.init_cars, axis=self.axis, agent=self.agent, radius=self.roi)
+        else:
+            return Cars(init_state=self.init_cars, axis=self.axis)
+
     def refresh_stateview(self):
         """
-        this function prepares a fresh depiction of what state the car is in
+        this function prepares a fresh depiction of what state the car is in. The agent's StateTracker persists
+        between calls, so only the features whose inputs have changed since the last call are recomputed
 
-        :return stateview: object
+        :return stateview: StateTracker
         """
-        stateview = nav.StateView(axis=self.axis, car_index=self.agent,
-                                  cars=self.cars_object.state, lights=self.lights_object.state)
-        return stateview
+        if self.stateview is None:
+            self.stateview = nav.StateTracker(axis=self.axis, car_index=self.agent,
+                                              cars=self.cars_object.state, lights=self.lights_object.state)
+            return self.stateview
+        return self.stateview.update(self.cars_object.state, self.lights_object.state)
 
     def initialize_custom_reset(self, alternate_route):
         """
-        resets the environment with a custom route for the agent
+        resets the environment to the decision point with a custom route for the agent
 
         :param alternate_route:   list: list of alternate route nodes for car agent
         :return          state:   list: initial state of agent
         """
-        # initialize the car and light state objects
-        init_car_state = self.car_init_method(self.N, self.axis, car_id=self.agent, alternate_route=alternate_route)
-        self.cars_object = Cars(init_state=init_car_state, axis=self.axis)
-
-        if self.animate:
-            # init animator
-            self.animator = Animator(fig=self.fig, ax=self.ax, cars_object=self.cars_object,
-                                     lights_object=self.lights_object, num=self.num)
+        self.branch(alternate_route)
 
         stateview = self.refresh_stateview()
         state = stateview.determine_state()[0]
         state = state.index(True)
         return state
 
+    def snapshot(self):
+        """
+        captures the full simulation state: car arrays, path cursors, light phases and timers
+
+        :return snapshot: dict
+        """
+        return {'cars': self.cars_object.snapshot(), 'lights': self.lights_object.snapshot()}
+
+    def restore(self, snapshot):
+        """
+        returns the simulation to a snapshot, which remains valid for further restores
+
+        :param snapshot: dict: from Env.snapshot
+        :return    None:
+        """
+        self.cars_object.restore(snapshot['cars'])
+        self.lights_object.restore(snapshot['lights'])
+
+    def branch(self, alternate_route=None, snapshot=None):
+        """
+        restores a snapshot (the decision point by default) and optionally prescribes the agent a different route
+
+        :param alternate_route: None or tuple: route, xpath and ypath for the agent
+        :param        snapshot: None or dict: from Env.snapshot
+        :return           None:
+        """
+        self.restore(snapshot if snapshot else self.decision_point)
+        if alternate_route:
+            self.cars_object.state = sim.set_route(self.cars_object.state, self.agent, alternate_route)
+
+    def fork(self):
+        """
+        copies the environment so that a what-if branch can be simulated without disturbing this one
+
+        :return env: Env
+        """
+        env = copy.copy(self)
+        env.cars_object = self.cars_object.fork()
+        env.lights_object = self.lights_object.fork()
+        env.route_times = list(self.route_times)
+        env.animate = False
+        env.animator = None
+        return env
+
+    def evaluate_routes(self, alternate_routes):
+        """
+        simulates each candidate route for the agent from the decision point, on a fork of this environment
+
+        :param alternate_routes:  list: of None (the current route) or (route, xpath, ypath) tuples
+        :return     route_times:  list: of double, the agent's route time for each candidate
+        """
+        route_times = []
+        for alternate_route in alternate_routes:
+            env = self.fork()
+            env.branch(alternate_route)
+            route_times.append(env.run_to_arrival())
+        return route_times
+
+    def run_to_arrival(self):
+        """
+        simulates from the current state until the agent arrives at its destination, or until max_time simulated
+        seconds have passed. How it went is kept in self.stats: the ticks simulated, ticks per second of wall time,
+        whether the agent timed out, and its arrival time (None on a timeout)
+
+        :return route_time: double: the route time so far if the agent timed out
+        """
+        max_ticks = np.inf if self.max_time is None else int(round(self.max_time / self.dt))
+        start = time.perf_counter()
+        arrived = self.agent_arrived()
+        i = 0
+        while not arrived and i < max_ticks:
+            arrived = self.simulation_step(i)
+            i += 1
+        wall_time = time.perf_counter() - start
+
+        route_time = self.cars_object.state.at[self.agent, 'route-time']
+        self.timeouts += not arrived
+        self.stats = {'ticks': i,
+                      'ticks-per-second': i / wall_time if wall_time else np.inf,
+                      'timeout': not arrived,
+                      'arrival-time': route_time if arrived else None}
+        return route_time
+
+    def simulation_step(self, i):
+        """
+        make one step in the simulation
+
+        :param         i:  int: simulation step
+        :return  arrived: bool: if the agent has arrived after the step
+        """
+        if self.animate:
+            self.animator.animate(i)
+        else:
+            self.lights_object.update(self.dt)
+            self.cars_object.update(self.dt, self.lights_object.state)
+        return self.agent_arrived()
+
+    def agent_arrived(self):
+        """
+        determines if the agent is within stop_distance of its destination, as navigation.arrived
+
+        :return bool:
+        """
+        state = self.cars_object.state
+        return bool(nav.arrived(state.at[self.agent, 'x'], state.at[self.agent, 'y'], self.destination[0],
+                                self.destination[1], self.stop_distance))
+
+    @profiling.timed('Env.step')
     def step(self, action, num):
         """
         This function runs a full simulation of a car from origin to destination
@@ -101,8 +254,19 @@ class Env:
         :param                         num: tuple: the simulation number out of the total number of simulations
         :return new_state, reward, done, _:  list: the end of the return is free to contain debugging info
         """
-        debug_report = []
+        new_state, route_time = self.act(action)
+        reward, done = self.score(route_time, num, timed_out=self.stats['timeout'])
+        debug_report = dict(self.stats, timeouts=self.timeouts)
+
+        return new_state, reward, done, debug_report
+
+    def act(self, action):
+        """
+        takes an action and simulates the agent's route to arrival, without scoring it
 
+        :param                 action:  int: 0 or 1
+        :return new_state, route_time: tuple: int, double
+        """
         if self.animate:
             self.animator.reset(self.num)
 
@@ -114,19 +278,29 @@ class Env:
         else:
             new_state = state.index(True)
 
-        arrived = False
-        i = 0
-        while not arrived:
-            arrived = self.simulation_step(i)
-            i += 1
+        route_time = self.run_to_arrival()
+        return new_state, route_time
+
+    def score(self, route_time, num, route_times=None, timed_out=False):
+        """
+        rewards a route time against the route times achieved so far. A route time at which the agent timed out is
+        not an arrival, so it is left out of the history and earns timeout_reward without ending the episode
 
-        route_time = self.cars_object.state.loc[self.agent]['route-time']
-        self.route_times.append(route_time)
+        :param   route_time:         double
+        :param          num:          tuple: the simulation number out of the total number of simulations
+        :param  route_times: None or list: history of route times to score against (default this Env's own)
+        :param    timed_out:          bool: if the agent was given up on at max_time
+        :return reward, done:         tuple: double, bool
+        """
+        if timed_out:
+            return self.timeout_reward, False
+        route_times = self.route_times if route_times is None else route_times
+        route_times.append(route_time)
         # TODO: need new way of identifying shortest route time.
-        if len(self.route_times) < self.shortest_route_thresh:
+        if len(route_times) < self.shortest_route_thresh:
             shortest_route_found_reward = 0
             done = False
-        elif np.isclose(0, self.route_times[-1] - np.min(self.route_times), atol=5 * self.dt).all():
+        elif np.isclose(0, route_times[-1] - np.min(route_times), atol=5 * self.dt).all():
             """
             If the route time achieved after the simulation is within 5 x dt second of the minimum time achieved.
             Define this environment condition as having found the shortest route (locally). 
@@ -137,34 +311,116 @@ class Env:
             shortest_route_found_reward = 0
             done = False
 
-        if num[0] < 1:
+        if num[0] < 1 or num[0] >= len(route_times):
+            # (num[0] is beyond the history when earlier simulations timed out)
             reward = 0
         else:
-            time_delta = self.route_times[num[0] - 1] - self.route_times[num[0]] + shortest_route_found_reward
+            time_delta = route_times[num[0] - 1] - route_times[num[0]] + shortest_route_found_reward
             if time_delta > 0:
                 reward = time_delta
             else:
                 reward = 0
 
-        return new_state, reward, done, debug_report
+        return reward, done
 
-    def simulation_step(self, i):
+
+class MultiAgentEnv(Env):
+    def __init__(self, n, fig=None, ax=None, dt=1 / 1000, animate=False, max_time=None, axis=None):
         """
-        make one step in the simulation
+        an environment in which every car in the fleet is a learning agent
+
+        :param         n:       int: number of cars to simulate
+        :param       fig: None or figure: from matplotlib
+        :param        ax: None or axis: from matplotlib
+        :param   animate:      bool: if the environment is to be animated while learning
+        :param  max_time: None or double: simulated seconds after which the cars which have not arrived are given up on
+        :param      axis: None or list: x and y ranges of the road network
+        """
+        super().__init__(n, fig, ax, agent=0, dt=dt, animate=animate, max_time=max_time, axis=axis)
+        self.agents = np.arange(len(self.init_cars))
+        self.agent_route_times = [[] for _ in self.agents]
+        self.destinations = nav.node_index().positions_of(self.init_cars['destination'].to_numpy())
 
-        :param         i: simulation step
-        :return  arrived: bool
+        # every episode starts from the same template, so each agent's decision is evaluated once
+        self.states, self.alternate_routes = nav.determine_states(self.axis, self.init_cars,
+                                                                   self.lights_object.state)
+        self.alternate_states = self.states.copy()
+        for agent, alternate_route in enumerate(self.alternate_routes):
+            if alternate_route:
+                cars = sim.set_route(self.init_cars, agent, alternate_route)
+                stateview = nav.StateView(axis=self.axis, car_index=agent, cars=cars, lights=self.lights_object.state)
+                self.alternate_states[agent] = stateview.determine_state()[0].index(True)
+
+    def reset(self, num):
         """
-        frontview = nav.FrontView(self.cars_object.state.loc[self.agent])
-        end_of_route = frontview.end_of_route()
-        if not end_of_route:
+        resets the environment
+
+        :param    num: tuple: int, int
+        :return states: array of int: the state of every agent
+        """
+        self.cars_object = Cars(init_state=self.init_cars, axis=self.axis)
+        self.decision_point = self.snapshot()
+
+        if self.animate:
+            # init animator
+            self.num = num
+            self.animator = self.make_animator()
+
+        return self.states.copy()
+
+    @profiling.timed('MultiAgentEnv.step')
+    def step(self, actions, num):
+        """
+        applies every agent's action together and runs the simulation until every car has arrived
+
+        :param                         actions: array of int: 0 or 1 for each agent
+        :param                             num:        tuple: the simulation number out of the total number
+        :return new_states, rewards, dones, info:     arrays: one entry per agent; info is a dict of arrays
+        """
+        if self.animate:
+            self.animator.reset(self.num)
+
+        actions = np.asarray(actions)
+        rerouted = [agent for agent in np.flatnonzero(actions) if self.alternate_routes[agent]]
+        self.branch()
+        self.cars_object.state = sim.set_routes(self.cars_object.state,
+                                                {agent: self.alternate_routes[agent] for agent in rerouted})
+        new_states = np.where(actions, self.alternate_states, self.states)
+
+        max_ticks = np.inf if self.max_time is None else int(round(self.max_time / self.dt))
+        start = time.perf_counter()
+        arrived = self.fleet_arrived()
+        i = 0
+        while not arrived.all() and i < max_ticks:
             if self.animate:
                 self.animator.animate(i)
             else:
                 self.lights_object.update(self.dt)
                 self.cars_object.update(self.dt, self.lights_object.state)
-            arrived = False
-        else:
-            arrived = True
+            arrived = self.fleet_arrived()
+            i += 1
+        wall_time = time.perf_counter() - start
+        self.timeouts += (~arrived).sum()
+
+        route_times = self.cars_object.state['route-time'].to_numpy(dtype=float)
+        rewards, dones = np.zeros(self.agents.size), np.zeros(self.agents.size, dtype=bool)
+        for agent in self.agents:
+            rewards[agent], dones[agent] = self.score(route_times[agent], num, self.agent_route_times[agent],
+                                                      timed_out=not arrived[agent])
+
+        info = {'route-times': route_times,
+                'timeouts': ~arrived,
+                'ticks': i,
+                'ticks-per-second': i / wall_time if wall_time else np.inf}
+        return new_states, rewards, dones, info
 
-        return arrived
+    def fleet_arrived(self, stop_distance=5):
+        """
+        determines which cars have reached the end of their routes (as navigation.arrived, for every car)
+
+        :param stop_distance: double
+        :return      arrived: array of bool
+        """
+        state = self.cars_object.state
+        return nav.arrived(state['x'].to_numpy(dtype=float), state['y'].to_numpy(dtype=float),
+                           self.destinations[:, 0], self.destinations[:, 1], stop_distance)
@@ -0,0 +1,135 @@
+"""
+Frame export for the Animator. Movie frames are streamed as raw RGBA straight from the canvas into an ffmpeg
+subprocess, which encodes while the simulation carries on; PNG frames are handed to a small pool of background
+threads. Simulating, rasterizing and encoding thereby overlap instead of running one after the other.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.image import imsave
+import numpy as np
+import subprocess
+import threading
+
+
+class FFmpegPipe:
+    def __init__(self, filename, fps=120, codec='libx264', executable='ffmpeg', extra_args=None):
+        """
+        an ffmpeg subprocess encoding the frames written to it into a movie. It is started by the first frame,
+        which fixes the size of the movie
+
+        :param   filename:         str: the movie file
+        :param        fps:         int: frames per second
+        :param      codec:         str: ffmpeg video codec
+        :param executable:         str: path to ffmpeg
+        :param extra_args: None or list: further ffmpeg output options
+        """
+        self.filename = filename
+        self.fps = fps
+        self.codec = codec
+        self.executable = executable
+        self.extra_args = extra_args if extra_args else []
+        self.process = None
+        self.frames = 0
+
+    def start(self, width, height):
+        """
+        :param  width: int: pixels
+        :param height: int: pixels
+        :return  None:
+        """
+        command = [self.executable, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '{}x{}'.format(width, height), '-r', str(self.fps),
+                   '-i', '-', '-an', '-vcodec', self.codec, '-pix_fmt', 'yuv420p',
+                   # yuv420p needs even dimensions
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2'] + self.extra_args + [self.filename]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, canvas):
+        """
+        writes the current image of an Agg canvas. The RGBA buffer is passed to the pipe as it is, without a copy
+
+        :param canvas: FigureCanvasAgg: drawn (or blitted) up to date
+        :return  None:
+        """
+        frame = canvas.buffer_rgba()
+        if self.process is None:
+            height, width = memoryview(frame).shape[:2]
+            self.start(width, height)
+        self.process.stdin.write(frame)
+        self.frames += 1
+
+    def close(self):
+        """
+        finishes the movie
+
+        :return None:
+        """
+        if self.process is not None:
+            self.process.stdin.close()
+            if self.process.wait():
+                raise RuntimeError('ffmpeg exited with code {} writing {}'.format(self.process.returncode,
+                                                                                 self.filename))
+            self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PNGWriter:
+    def __init__(self, workers=2, max_pending=8):
+        """
+        writes PNG frames on background threads. At most max_pending frames wait to be written; beyond that write
+        blocks, which bounds the memory held by copied frames
+
+        :param     workers: int: writer threads
+        :param max_pending: int
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.error = None
+
+    def write(self, filename, canvas):
+        """
+        copies the current image of an Agg canvas (which is redrawn before a thread gets to it) and queues it
+
+        :param filename:             str
+        :param   canvas: FigureCanvasAgg
+        :return    None:
+        """
+        self.raise_error()
+        frame = np.array(canvas.buffer_rgba())
+        self.slots.acquire()
+        future = self.executor.submit(imsave, filename, frame)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+        self.slots.release()
+
+    def raise_error(self):
+        """
+        re-raises, on the calling thread, the first error met by a writer thread
+
+        :return None:
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        """
+        waits for the queued frames to be written
+
+        :return None:
+        """
+        self.executor.shutdown(wait=True)
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
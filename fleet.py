@@ -0,0 +1,403 @@
+"""
+Stacked-array representation of M independent scenarios of the same fleet and traffic lights,
+advanced together by one vectorized kernel call per tick.
+
+The kernel follows simulation.update_cars: the same speed factors for road curvature, cars and red lights,
+the same node-crossing test and the same stall push. Obstacle detection is analytic: a car or light counts
+as an obstacle when it lies in the car's bin and within the bounding box of the stretch of road up to the next
+node, and the nearest such obstacle is used (the reference engine samples a linspace and checks only the first
+car or light in the bin).
+"""
+import math
+import models
+import navigation as nav
+import numpy as np
+import pandas as pd
+import simulation as sim
+
+
+def _flatten(column, dtype=float):
+    """
+    concatenates a column of per-row sequences into one flat array
+
+    :param column: Series of lists or arrays
+    :param  dtype: numpy dtype
+    :return  flat: array
+    """
+    parts = [np.asarray(part, dtype=dtype) for part in column]
+    return np.concatenate(parts) if parts else np.array([], dtype=dtype)
+
+
+def _pad_paths(paths, width):
+    """
+    packs a sequence of paths into a NaN padded 2D array
+
+    :param  paths: list of lists
+    :param  width: int
+    :return array: array: shape (len(paths), width)
+    """
+    array = np.full((len(paths), width), np.nan)
+    for i, path in enumerate(paths):
+        array[i, :len(path)] = path
+    return array
+
+
+class Fleet:
+    def __init__(self, cars, axis, m=1):
+        """
+        M copies of a fleet of N cars, stored scenario-major in flat arrays of length M * N
+
+        :param cars: dataframe: template car state, each Series row is a car
+        :param axis:      list: x and y ranges of the road network
+        :param    m:       int: number of scenarios
+        """
+        self.m, self.n = m, len(cars)
+        self.axis = axis
+        self.xbins, self.ybins = np.arange(axis[0], axis[1], 200), np.arange(axis[2], axis[3], 200)
+        self.scenario = np.repeat(np.arange(m), self.n)
+        self.routes = [list(route) for route in cars['route']] * m
+        self.origins = np.tile(cars['origin'].to_numpy(), m)
+        self.destinations = np.tile(cars['destination'].to_numpy(), m)
+        destinations = nav.node_index().positions_of(cars['destination'].to_numpy())
+        self.dest_x, self.dest_y = np.tile(destinations[:, 0], m), np.tile(destinations[:, 1], m)
+
+        xpaths, ypaths = [list(path) for path in cars['xpath']], [list(path) for path in cars['ypath']]
+        width = max([len(path) for path in xpaths] + [1])
+        self.template = {'x': np.tile(cars['x'].to_numpy(dtype=float), m),
+                         'y': np.tile(cars['y'].to_numpy(dtype=float), m),
+                         'vx': np.tile(cars['vx'].to_numpy(dtype=float), m),
+                         'vy': np.tile(cars['vy'].to_numpy(dtype=float), m),
+                         'route-time': np.tile(cars['route-time'].to_numpy(dtype=float), m),
+                         'xpath': np.tile(_pad_paths(xpaths, width), (m, 1)),
+                         'ypath': np.tile(_pad_paths(ypaths, width), (m, 1)),
+                         'length': np.tile(np.array([len(path) for path in xpaths]), m),
+                         'routes': list(self.routes)}
+        self.reset()
+
+    def reset(self, scenarios=None):
+        """
+        returns scenarios (all by default) to the template with array copies
+
+        :param scenarios: None or array of int
+        :return     None:
+        """
+        keys = ('x', 'y', 'vx', 'vy', 'route-time', 'length')
+        if scenarios is None:
+            rows = np.arange(self.m * self.n)
+            for key in keys + ('xpath', 'ypath'):
+                setattr(self, key.replace('-', '_'), self.template[key].copy())
+            self.cursor = np.zeros(rows.size, dtype=np.int64)
+            self.distance_to_node, self.distance_to_car, self.distance_to_red_light = \
+                np.zeros(rows.size), np.zeros(rows.size), np.zeros(rows.size)
+        else:
+            rows = (np.asarray(scenarios).reshape(-1, 1) * self.n + np.arange(self.n)).ravel()
+            for key in keys:
+                getattr(self, key.replace('-', '_'))[rows] = self.template[key][rows]
+            # set_route may have widened the paths beyond the template
+            width = self.template['xpath'].shape[1]
+            self.xpath[rows], self.ypath[rows] = np.nan, np.nan
+            self.xpath[rows, :width], self.ypath[rows, :width] = \
+                self.template['xpath'][rows], self.template['ypath'][rows]
+            self.cursor[rows] = 0
+            self.distance_to_node[rows], self.distance_to_car[rows], self.distance_to_red_light[rows] = 0, 0, 0
+        for row in rows:
+            self.routes[row] = self.template['routes'][row]
+        self.xbin, self.ybin = np.digitize(self.x, self.xbins), np.digitize(self.y, self.ybins)
+
+    def row(self, scenario, car):
+        """
+        :return row: int: the flat index of a car in a scenario
+        """
+        return scenario * self.n + car
+
+    def set_route(self, scenario, car, alternate_route):
+        """
+        prescribes an alternate route for one car in one scenario, starting from the beginning of the route
+
+        :param        scenario:   int
+        :param             car:   int
+        :param alternate_route: tuple: route, xpath and ypath
+        :return           None:
+        """
+        route, xpath, ypath = alternate_route
+        row = self.row(scenario, car)
+        if len(xpath) > self.xpath.shape[1]:
+            extra = np.full((self.xpath.shape[0], len(xpath) - self.xpath.shape[1]), np.nan)
+            self.xpath, self.ypath = np.hstack((self.xpath, extra)), np.hstack((self.ypath, extra))
+        self.xpath[row], self.ypath[row] = np.nan, np.nan
+        self.xpath[row, :len(xpath)], self.ypath[row, :len(ypath)] = xpath, ypath
+        self.length[row] = len(xpath)
+        self.cursor[row] = 0
+        self.routes[row] = list(route)
+
+    def arrived(self, car, stop_distance=sim.stop_distance):
+        """
+        determines, per scenario, if a car has reached the end of its route (as navigation.arrived)
+
+        :param           car: int
+        :param stop_distance: double
+        :return      arrived: array of bool, one per scenario
+        """
+        rows = np.arange(self.m) * self.n + car
+        return nav.arrived(self.x[rows], self.y[rows], self.dest_x[rows], self.dest_y[rows], stop_distance)
+
+    def frame(self, scenario):
+        """
+        converts one scenario back to the dataframe layout used by Cars, StateView and Animator
+
+        :param scenario:       int
+        :return    cars: dataframe
+        """
+        rows = np.arange(scenario * self.n, (scenario + 1) * self.n)
+        xpaths = [self.xpath[row, self.cursor[row]:self.length[row]].tolist() for row in rows]
+        ypaths = [self.ypath[row, self.cursor[row]:self.length[row]].tolist() for row in rows]
+        cars = pd.DataFrame({'object': 'car',
+                             'x': self.x[rows],
+                             'y': self.y[rows],
+                             'vx': self.vx[rows],
+                             'vy': self.vy[rows],
+                             'route-time': self.route_time[rows],
+                             'origin': self.origins[rows],
+                             'destination': self.destinations[rows],
+                             'route': pd.Series([self.routes[row] for row in rows], dtype=object),
+                             'xpath': pd.Series(xpaths, dtype=object),
+                             'ypath': pd.Series(ypaths, dtype=object),
+                             'distance-to-car': self.distance_to_car[rows],
+                             'distance-to-node': self.distance_to_node[rows],
+                             'distance-to-red-light': self.distance_to_red_light[rows],
+                             'xbin': self.xbin[rows],
+                             'ybin': self.ybin[rows]})
+        return cars
+
+
+class LightPhases:
+    def __init__(self, lights, axis, m=1, seed=None):
+        """
+        M copies of the phases of a set of traffic lights, with the faces of all lights in flat arrays
+
+        :param lights:   dataframe: light state, each Series row is a light
+        :param   axis:        list: x and y ranges of the road network
+        :param      m:         int: number of scenarios
+        :param   seed: None or int: if given, every scenario but the first starts each of its lights either in the
+                                    template phase or half a cycle on (every face switched), as drawn from this
+                                    seed; otherwise all scenarios start in the template phases
+        """
+        self.m = m
+        self.lights = lights
+        self.x, self.y = lights['x'].to_numpy(dtype=float), lights['y'].to_numpy(dtype=float)
+        self.switch_time = lights['switch-time'].to_numpy(dtype=float)
+        self.xbin, self.ybin = models.determine_bins(axis, lights)
+        self.xbin, self.ybin = self.xbin.to_numpy(), self.ybin.to_numpy()
+        self.face_light = np.repeat(np.arange(len(lights)), lights['degree'].to_numpy(dtype=np.int64))
+        self.face_xvector = _flatten(lights['out-xvectors'])
+        self.face_yvector = _flatten(lights['out-yvectors'])
+        self.template = {'go': np.tile(_flatten(lights['go-values'], dtype=bool), (m, 1)),
+                         'time-elapsed': np.zeros(m)}
+        if seed is not None:
+            # the switch times are left as they are, since StateView ranks the lights on a route by them
+            switched = np.random.default_rng(seed).random((m - 1, len(lights))) < 0.5
+            self.template['go'][1:] ^= switched[:, self.face_light]
+        self.reset()
+
+    def reset(self, scenarios=None):
+        """
+        returns scenarios (all by default) to the template phases
+
+        :param scenarios: None or array of int
+        :return     None:
+        """
+        if scenarios is None:
+            self.go = self.template['go'].copy()
+            self.time_elapsed = self.template['time-elapsed'].copy()
+        else:
+            self.go[scenarios] = self.template['go'][scenarios]
+            self.time_elapsed[scenarios] = self.template['time-elapsed'][scenarios]
+
+    def update(self, dt, running=None):
+        """
+        advances the light timers and switches faces as TrafficLights.update
+
+        :param      dt: double
+        :param running: None or array of bool: the scenarios to advance (all by default)
+        :return   None:
+        """
+        running = np.ones(self.m, dtype=bool) if running is None else running
+        self.time_elapsed[running] += dt
+        with np.errstate(invalid='ignore', divide='ignore'):
+            remainder = np.mod(self.time_elapsed[:, None], self.switch_time[None, :])
+        time_to_switch = np.isclose(0, remainder, rtol=1.0e-4) & running[:, None]
+        self.go ^= time_to_switch[:, self.face_light]
+
+    def frame(self, scenario):
+        """
+        converts one scenario back to the dataframe layout used by TrafficLights and StateView
+
+        :param scenario:       int
+        :return  lights: dataframe
+        """
+        lights = self.lights.copy()
+        faces = np.cumsum(lights['degree'].to_numpy(dtype=np.int64))[:-1]
+        lights['go-values'] = [np.array(go) for go in np.split(self.go[scenario], faces)]
+        return lights
+
+
+def obstacle_factor(d):
+    """
+    vectorized simulation.obstacle_factor
+
+    :param                d: array of double
+    :return obstacle_factor: array of double
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slowing = np.log(d / sim.stop_distance) / math.log(sim.free_distance / sim.stop_distance)
+    return np.where(d <= sim.stop_distance, 0., np.where(d <= sim.free_distance, slowing, 1.))
+
+
+def road_curvature_factor(theta, d):
+    """
+    vectorized simulation.road_curvature_factor
+
+    :param         theta: array of double: angles of road curvature ahead
+    :param             d: array of double: distances from cars to their next nodes
+    :return speed_factor: array of double
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = sim.stop_distance * 2 * theta / math.pi
+        slowing = np.log(d / scale) / np.log(sim.free_distance / scale)
+    bending = (sim.stop_distance < d) & (d <= sim.free_distance) & ~np.isclose(theta, 0, rtol=1.0e-1)
+    return np.where(bending, slowing, 1.)
+
+
+def _same_bin_pairs(keys, candidates, target_keys):
+    """
+    pairs every candidate with every target in the same bin
+
+    :param        keys: array of int: bin key of each candidate
+    :param  candidates: array of int: the indices of the candidates
+    :param target_keys: array of int: bin key of each target
+    :return candidates, targets: arrays of int: the indices of the candidate and the target of each pair
+    """
+    order = np.argsort(target_keys, kind='stable')
+    sorted_keys = target_keys[order]
+    starts = np.searchsorted(sorted_keys, keys, side='left')
+    counts = np.searchsorted(sorted_keys, keys, side='right') - starts
+    # the k-th pair overall is the (k - first pair of its candidate)-th target of the candidate's bin
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return np.repeat(candidates, counts), order[np.arange(counts.sum()) + offsets]
+
+
+def update(fleet, lights, dt, running=None):
+    """
+    advances every car of every running scenario by one dt time step
+
+    :param    fleet:                   Fleet
+    :param   lights:             LightPhases: already updated for this time step
+    :param       dt:                  double
+    :param  running: None or array of bool: the scenarios to advance (all by default)
+    :return    None:
+    """
+    m, n = fleet.m, fleet.n
+    running = np.ones(m, dtype=bool) if running is None else running
+    moving = running[fleet.scenario]
+    rows = np.arange(fleet.x.size)
+    x, y = fleet.x, fleet.y
+    remaining = fleet.length - fleet.cursor
+    live = moving & (remaining > 0)
+
+    # determine binning and assign bins to cars
+    fleet.xbin, fleet.ybin = np.digitize(x, fleet.xbins), np.digitize(y, fleet.ybins)
+
+    # the next three nodes in view
+    width = fleet.xpath.shape[1]
+    view = [np.minimum(fleet.cursor + i, width - 1) for i in range(3)]
+    px = [fleet.xpath[rows, column] for column in view]
+    py = [fleet.ypath[rows, column] for column in view]
+
+    crossed = live & np.isclose(px[0], x, rtol=1.0e-6) & np.isclose(py[0], y, rtol=1.0e-6)
+    next_x = np.where(crossed, np.where(remaining >= 2, px[1], fleet.dest_x), px[0])
+    next_y = np.where(crossed, np.where(remaining >= 2, py[1], fleet.dest_y), py[0])
+    next_x, next_y = np.where(live, next_x, fleet.dest_x), np.where(live, next_y, fleet.dest_y)
+    dx, dy = next_x - x, next_y - y
+    distance_to_node = np.hypot(dx, dy)
+
+    # angle of the road curvature between the next three nodes
+    v0x, v0y, v1x, v1y = px[1] - px[0], py[1] - py[0], px[2] - px[1], py[2] - py[1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine = (v0x * v1x + v0y * v1y) / (np.hypot(v0x, v0y) * np.hypot(v1x, v1y))
+    angle = np.arccos(np.clip(np.nan_to_num(cosine, nan=1.), -1.0, 1.0))
+    angle = np.where(angle > math.pi / 2, angle - math.pi / 2, angle)
+    angle = np.where(remaining >= 3, angle, 0.)
+    theta = np.where(remaining == 1, math.pi / 2, angle)
+
+    # obstacles lie in the car's bin and within the span of road between the car and its next node
+    detect = live & (np.abs(dx) >= 1) & (np.abs(dy) >= 1)
+    low_x, high_x = np.minimum(x, next_x), np.maximum(x, next_x)
+    low_y, high_y = np.minimum(y, next_y), np.maximum(y, next_y)
+
+    # only the pairs of a car and a car or light face in the same bin are compared, found through the cars and faces
+    # sorted by bin, so the work grows with the cars sharing a bin rather than with the square of the fleet
+    stride = fleet.ybins.size + 1
+    bins = fleet.xbin * stride + fleet.ybin
+    candidates = np.flatnonzero(detect)
+    bins_per_scenario = (fleet.xbins.size + 1) * stride
+    keys = fleet.scenario * bins_per_scenario + bins
+    behind, ahead = _same_bin_pairs(keys[candidates], candidates, keys)
+    ox, oy = x[ahead], y[ahead]
+    cars_ahead = (ahead != behind) & (remaining[ahead] > 0) & \
+        (low_x[behind] - 1.0e-6 * np.abs(ox) <= ox) & (ox <= high_x[behind] + 1.0e-6 * np.abs(ox)) & \
+        (low_y[behind] - 1.0e-6 * np.abs(oy) <= oy) & (oy <= high_y[behind] + 1.0e-6 * np.abs(oy))
+    distance_to_car = np.full(x.size, np.inf)
+    np.minimum.at(distance_to_car, behind[cars_ahead],
+                  np.hypot(ox - x[behind], oy - y[behind])[cars_ahead])
+    distance_to_car = np.where(np.isfinite(distance_to_car), distance_to_car, 0.)
+
+    face_bins = lights.xbin[lights.face_light] * stride + lights.ybin[lights.face_light]
+    behind, face = _same_bin_pairs(bins[candidates], candidates, face_bins)
+    fx, fy = lights.x[lights.face_light][face], lights.y[lights.face_light][face]
+    to_light_x, to_light_y = fx - x[behind], fy - y[behind]
+    light_gaps = np.hypot(to_light_x, to_light_y)
+    xvector, yvector = lights.face_xvector[face], lights.face_yvector[face]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        face_cosine = (to_light_x * xvector + to_light_y * yvector) / (light_gaps * np.hypot(xvector, yvector))
+    anti_parallel = np.isclose(math.pi, np.arccos(np.clip(face_cosine, -1.0, 1.0)), atol=0.1)
+    red_lights_ahead = ~lights.go[fleet.scenario[behind], face] & anti_parallel & \
+        (low_x[behind] - 1.0e-6 * np.abs(fx) <= fx) & (fx <= high_x[behind] + 1.0e-6 * np.abs(fx)) & \
+        (low_y[behind] - 1.0e-6 * np.abs(fy) <= fy) & (fy <= high_y[behind] + 1.0e-6 * np.abs(fy))
+    distance_to_red_light = np.full(x.size, np.inf)
+    np.minimum.at(distance_to_red_light, behind[red_lights_ahead], light_gaps[red_lights_ahead])
+    distance_to_red_light = np.where(np.isfinite(distance_to_red_light), distance_to_red_light, 0.)
+
+    # speed factor, as simulation.update_speed_factor
+    curvature_factor = road_curvature_factor(theta, distance_to_node)
+    car, light = distance_to_car > 0, distance_to_red_light > 0
+    nearest = obstacle_factor(np.where(distance_to_car <= distance_to_red_light, distance_to_car,
+                                       distance_to_red_light))
+    car_factor = obstacle_factor(distance_to_car)
+    weighed = car_factor * np.cos(distance_to_car / sim.free_distance) + \
+        curvature_factor * np.sin(distance_to_node / sim.free_distance)
+    car_only = np.where(distance_to_car > distance_to_node, weighed, car_factor)
+    factor = np.where(car & light, nearest,
+                      np.where(car, car_only, np.where(light, obstacle_factor(distance_to_red_light),
+                                                       curvature_factor)))
+    factor = np.abs(factor)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vx = dx / distance_to_node * sim.speed_limit * factor
+        vy = dy / distance_to_node * sim.speed_limit * factor
+
+    # if the car has stalled and has no obstacle immediately ahead, then give it a push
+    stalled = np.isclose(0, vx, atol=0.1) & np.isclose(0, vy, atol=0.1)
+    push = stalled & ~light & (~car | (distance_to_car > sim.stop_distance))
+    vx, vy = vx + push * sim.default_acceleration, vy + push * sim.default_acceleration
+
+    # cars at the end of their route stop; cars in scenarios which are not running keep their state
+    fleet.vx, fleet.vy = np.where(live, vx, np.where(moving, 0., fleet.vx)), \
+        np.where(live, vy, np.where(moving, 0., fleet.vy))
+    fleet.route_time = fleet.route_time + live * dt
+    fleet.cursor = fleet.cursor + crossed
+    fleet.distance_to_node = np.where(live, distance_to_node, fleet.distance_to_node)
+    fleet.distance_to_car = np.where(live, distance_to_car, fleet.distance_to_car)
+    fleet.distance_to_red_light = np.where(live, distance_to_red_light, fleet.distance_to_red_light)
+
+    fleet.x = x + np.where(moving, fleet.vx, 0.) * dt
+    fleet.y = y + np.where(moving, fleet.vy, 0.) * dt
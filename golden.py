@@ -0,0 +1,247 @@
+"""
+Checks fast engines against the reference simulation (Cars.update over simulation.py and navigation.py).
+
+A seeded scenario is run through the reference engine and through a fast engine, tick for tick, and the trajectories
+and route times of the cars are compared within tolerances. The report gives, for every car, the tick at which it
+first strayed further than the tolerance from its reference trajectory, its largest deviation and the difference
+in its route time, along with the speedup of the fast engine. An engine is a class with the interface of
+ReferenceEngine; registering it in engines makes it available here.
+
+The map is the map data by default; 'grid' runs on benchmark.grid_graph instead, which needs no map files and is
+what test_golden.py checks the fleet engine on.
+
+    python golden.py [engine [cars [ticks [map]]]]
+"""
+import numpy as np
+import pandas as pd
+import random
+import sys
+import time
+
+
+n = 10  # cars
+ticks = 2000
+dt = 1 / 1000
+seed = 0
+prescale = 40
+position_tolerance = 1.0  # metres
+route_time_tolerance = 5 * dt  # seconds
+stopped_speed = 1.0  # cars slower than this with a car or red light ahead have stopped for it
+
+
+class ReferenceEngine:
+    def __init__(self, cars, lights, axis):
+        """
+        Cars and TrafficLights, as simulated by artist, Env and the learners
+
+        :param   cars: dataframe: initial car state
+        :param lights: dataframe: initial light state
+        :param   axis:      list
+        """
+        from cars import Cars, TrafficLights
+        self.lights = TrafficLights(lights, axis)
+        self.cars = Cars(cars, axis)
+
+    def step(self, dt):
+        self.lights.update(dt)
+        self.cars.update(dt, self.lights.state)
+
+    def positions(self):
+        """
+        :return x, y: arrays: one entry per car
+        """
+        return self.cars.state['x'].to_numpy(dtype=float), self.cars.state['y'].to_numpy(dtype=float)
+
+    def route_times(self):
+        return self.cars.state['route-time'].to_numpy(dtype=float)
+
+    def stopped(self):
+        """
+        :return stopped: array of bool: one entry per car, if it stands behind a car or at a red light
+        """
+        state = self.cars.state
+        speed = np.hypot(state['vx'].to_numpy(dtype=float), state['vy'].to_numpy(dtype=float))
+        return (speed < stopped_speed) & ((state['distance-to-car'].to_numpy(dtype=float) > 0) |
+                                          (state['distance-to-red-light'].to_numpy(dtype=float) > 0))
+
+
+class FleetEngine(ReferenceEngine):
+    def __init__(self, cars, lights, axis):
+        """
+        the vectorized kernel of fleet.py, as used by VecEnv, for a single scenario
+        """
+        import fleet
+        self.kernel = fleet
+        self.cars = fleet.Fleet(cars, axis)
+        self.lights = fleet.LightPhases(lights, axis)
+
+    def step(self, dt):
+        self.lights.update(dt)
+        self.kernel.update(self.cars, self.lights, dt)
+
+    def positions(self):
+        return self.cars.x, self.cars.y
+
+    def route_times(self):
+        return self.cars.route_time
+
+    def stopped(self):
+        speed = np.hypot(self.cars.vx, self.cars.vy)
+        return (speed < stopped_speed) & ((self.cars.distance_to_car > 0) | (self.cars.distance_to_red_light > 0))
+
+
+class RegionOfInterestEngine(ReferenceEngine):
+    def __init__(self, cars, lights, axis, agent=0, radius=400):
+        """
+        RegionOfInterestCars around car 0. Only the cars near its path follow the reference, so compare those
+        (e.g. cars=[0]); the others move at free flow and are caught up in jumps
+        """
+        from cars import RegionOfInterestCars, TrafficLights
+        self.lights = TrafficLights(lights, axis)
+        self.cars = RegionOfInterestCars(cars, axis, agent=agent, radius=radius)
+
+
+engines = {'reference': ReferenceEngine, 'fleet': FleetEngine, 'roi': RegionOfInterestEngine}
+
+
+def use_map(road_map=None):
+    """
+    makes a map the map G
+
+    :param road_map: None or str: 'grid' for benchmark.grid_graph, a graphml file, or None to keep the current map
+    :return    None:
+    """
+    import navigation as nav
+    if road_map == 'grid':
+        import benchmark
+        nav.set_graph(benchmark.grid_graph())
+    elif road_map is not None:
+        nav.load_map(road_map)
+
+
+def scenario(n=n, seed=seed, prescale=prescale, axis=None, road_map=None):
+    """
+    a seeded initial state, the same on every call with the same arguments
+
+    :param         n:         int: cars
+    :param      seed:         int
+    :param  prescale:         int: of the traffic lights
+    :param      axis: None or list: x and y ranges of the road network (default from the map)
+    :param  road_map:  None or str: the map, as for use_map (default the current map, i.e. the map data)
+    :return cars, lights, axis: tuple: dataframe, dataframe, list
+    """
+    import navigation as nav
+    import simulation as sim
+    use_map(road_map)
+    random.seed(seed)
+    np.random.seed(seed)
+    axis = nav.map_bounds() if axis is None else axis
+    cars = sim.init_culdesac_start_location(n, axis)
+    lights = sim.init_traffic_lights(axis, prescale=prescale)
+    return cars, lights, axis
+
+
+def trace(engine, ticks, dt):
+    """
+    runs an engine, keeping the positions of the cars after every tick
+
+    :param     engine: engine instance
+    :param      ticks:    int
+    :param         dt: double
+    :return xs, ys, stops, seconds: tuple: arrays of shape (ticks, cars), the number of times a car stood behind a car
+                                           or at a red light after a tick, and the time spent stepping
+    """
+    xs, ys = [], []
+    stops = 0
+    seconds = 0
+    for _ in range(ticks):
+        start = time.perf_counter()
+        engine.step(dt)
+        seconds += time.perf_counter() - start
+        x, y = engine.positions()
+        xs.append(np.array(x, dtype=float))
+        ys.append(np.array(y, dtype=float))
+        stops += int(engine.stopped().sum())
+    return np.array(xs), np.array(ys), stops, seconds
+
+
+def compare(fast='fleet', initial=None, ticks=ticks, dt=dt, cars=None, position_tolerance=position_tolerance,
+            route_time_tolerance=route_time_tolerance):
+    """
+    runs a scenario through the reference engine and a fast engine and compares them car by car
+
+    :param                 fast:   str or class: the fast engine
+    :param              initial: None or tuple: cars, lights and axis (default scenario())
+    :param                ticks:          int
+    :param                   dt:       double
+    :param                 cars: None or list: the indices of the cars to compare (default all)
+    :param   position_tolerance:       double: metres from the reference trajectory
+    :param route_time_tolerance:       double: seconds from the reference route time
+    :return              report:         dict: 'passed', 'speedup', 'reference-seconds', 'fast-seconds',
+                                               'max-deviation', 'reference-stops' and 'fast-stops' (the car-ticks
+                                               spent stopped for an obstacle, see trace) and 'cars', a dataframe of
+                                               one row per car
+    """
+    cars_state, lights_state, axis = scenario() if initial is None else initial
+    fast = engines[fast] if isinstance(fast, str) else fast
+
+    # each engine starts from its own copy, so that neither can disturb the other's initial state
+    reference_engine = ReferenceEngine(cars_state.copy(deep=True), lights_state.copy(deep=True), axis)
+    reference_xs, reference_ys, reference_stops, reference_seconds = trace(reference_engine, ticks, dt)
+    fast_engine = fast(cars_state.copy(deep=True), lights_state.copy(deep=True), axis)
+    fast_xs, fast_ys, fast_stops, fast_seconds = trace(fast_engine, ticks, dt)
+
+    selected = np.arange(reference_xs.shape[1]) if cars is None else np.asarray(cars)
+    deviation = np.hypot(fast_xs - reference_xs, fast_ys - reference_ys)[:, selected]
+    strayed = deviation > position_tolerance
+    diverged = strayed.any(axis=0)
+    first = strayed.argmax(axis=0)
+    reference_times, fast_times = reference_engine.route_times()[selected], fast_engine.route_times()[selected]
+
+    table = pd.DataFrame({'car': selected,
+                          'diverged': diverged,
+                          'divergence-tick': np.where(diverged, first + 1, -1),
+                          'divergence-time': np.where(diverged, (first + 1) * dt, np.nan),
+                          'reference-x': np.where(diverged, reference_xs[first, selected], np.nan),
+                          'reference-y': np.where(diverged, reference_ys[first, selected], np.nan),
+                          'fast-x': np.where(diverged, fast_xs[first, selected], np.nan),
+                          'fast-y': np.where(diverged, fast_ys[first, selected], np.nan),
+                          'max-deviation': deviation.max(axis=0, initial=0),
+                          'reference-route-time': reference_times,
+                          'fast-route-time': fast_times,
+                          'route-time-difference': fast_times - reference_times})
+    passed = not diverged.any() and bool((np.abs(table['route-time-difference']) <= route_time_tolerance).all())
+    return {'passed': passed,
+            'speedup': reference_seconds / fast_seconds if fast_seconds else np.inf,
+            'reference-seconds': reference_seconds,
+            'fast-seconds': fast_seconds,
+            'max-deviation': float(deviation.max(initial=0)),
+            'reference-stops': reference_stops,
+            'fast-stops': fast_stops,
+            'cars': table}
+
+
+def summary(report):
+    """
+    :param report: dict: from compare
+    :return  text:  str
+    """
+    table = report['cars']
+    heading = '{}: {} of {} cars diverged, largest deviation {:.3f} m, speedup {:.1f}x ({:.2f} s against {:.2f} s), ' \
+              '{} car-ticks stopped for obstacles ({} in the reference)'
+    lines = [heading.format('passed' if report['passed'] else 'FAILED', int(table['diverged'].sum()), len(table),
+                            report['max-deviation'], report['speedup'], report['fast-seconds'],
+                            report['reference-seconds'], report['fast-stops'], report['reference-stops'])]
+    columns = ['car', 'divergence-tick', 'max-deviation', 'reference-route-time', 'route-time-difference']
+    lines.append(table[columns].to_string(index=False, float_format='{:.4f}'.format))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # python golden.py [engine [cars [ticks [map]]]]
+    engine = sys.argv[1] if len(sys.argv) > 1 else 'fleet'
+    report = compare(engine, initial=scenario(int(sys.argv[2]) if len(sys.argv) > 2 else n,
+                                              road_map=sys.argv[4] if len(sys.argv) > 4 else None),
+                     ticks=int(sys.argv[3]) if len(sys.argv) > 3 else ticks)
+    print(summary(report))
+    sys.exit(0 if report['passed'] else 1)
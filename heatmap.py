@@ -0,0 +1,240 @@
+"""
+Congestion heatmaps over the 200 m bins of models.determine_bins, accumulated as a simulation runs.
+
+Every sampled time step adds each car's presence and speed to the cell of its bin, with np.add.at, so a whole run
+is summarized in a few arrays of one entry per cell whatever its length, rather than in trajectories. The run is
+also cut into windows of a fixed number of samples; each finished window is written out as a snapshot (.npz).
+Heatmaps are drawn as an image over the map, beneath the Animator's artists, and can be coarsened into a pyramid
+of 2x2 merged cells to view a whole city at once.
+"""
+import numpy as np
+import os
+
+
+cell = 200  # metres, as in models.determine_bins
+
+
+class HeatmapAccumulator:
+    def __init__(self, axis, every=1, window=1000, path=None):
+        """
+        observes a Cars object (see attach) and accumulates occupancy and speed per bin
+
+        :param   axis:        list: x and y ranges of the road network, as given to Cars
+        :param  every:         int: take a sample every so many time steps
+        :param window:         int: samples per window
+        :param   path: None or str: directory to which each finished window is written (None writes none)
+        """
+        self.axis = tuple(float(limit) for limit in axis)
+        self.every = every
+        self.window = window
+        self.path = path
+        # np.digitize numbers the cells from 0 (before the first bin edge) to the number of edges (after the last)
+        self.shape = (np.arange(axis[0], axis[1], cell).size + 1, np.arange(axis[2], axis[3], cell).size + 1)
+        self.ticks = 0
+        self.totals = Heatmap(self.axis, self.shape)
+        self.current = Heatmap(self.axis, self.shape)
+        self.last_window = None
+        self.windows = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def attach(self, cars_object):
+        """
+        :param cars_object: Cars
+        :return       self: HeatmapAccumulator
+        """
+        cars_object.observers.append(self)
+        return self
+
+    def detach(self, cars_object):
+        cars_object.observers.remove(self)
+
+    def observe_cars(self, cars):
+        """
+        samples the time step which has just been simulated, if it is one of every few
+
+        :param cars: Cars: whose xbin and ybin columns are up to date
+        :return None:
+        """
+        self.ticks += 1
+        if (self.ticks - 1) % self.every:
+            return None
+        state = cars.state
+        self.add(cars.time_elapsed, state['xbin'].to_numpy(dtype=np.int64), state['ybin'].to_numpy(dtype=np.int64),
+                 np.hypot(state['vx'].to_numpy(dtype=float), state['vy'].to_numpy(dtype=float)))
+
+    def add(self, time, xbin, ybin, speed):
+        """
+        adds one sample of a fleet, one entry per car
+
+        :param  time: double
+        :param  xbin: array of int
+        :param  ybin: array of int
+        :param speed: array of double
+        :return None:
+        """
+        xbin, ybin = np.clip(xbin, 0, self.shape[0] - 1), np.clip(ybin, 0, self.shape[1] - 1)
+        for heatmap in (self.totals, self.current):
+            heatmap.add(time, xbin, ybin, speed)
+        if self.current.samples == self.window:
+            self.end_window()
+
+    def end_window(self):
+        """
+        closes the current window, writing it out as a snapshot if there is a path, and starts a new one
+
+        :return None:
+        """
+        if self.current.samples:
+            if self.path:
+                self.current.save(os.path.join(self.path, 'window{:05d}.npz'.format(self.windows)))
+            self.last_window = self.current
+            self.windows += 1
+            self.current = Heatmap(self.axis, self.shape)
+
+    def close(self):
+        """
+        closes the last (partial) window and writes the totals of the run
+
+        :return None:
+        """
+        self.end_window()
+        if self.path:
+            self.totals.save(os.path.join(self.path, 'totals.npz'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Heatmap:
+    def __init__(self, axis, shape, occupancy=None, speed=None, samples=0, start=None, end=None, level=0):
+        """
+        the occupancy and summed speed of each cell over a number of samples
+
+        :param      axis:        tuple: x and y ranges of the road network
+        :param     shape:        tuple: cells along x and y
+        :param occupancy: None or array: car samples per cell
+        :param     speed: None or array: summed speeds per cell
+        :param   samples:          int
+        :param     start: None or double: time of the first sample
+        :param       end: None or double: time of the last sample
+        :param     level:          int: 0 for the bins, k for cells of 2^k x 2^k bins
+        """
+        self.axis = axis
+        self.shape = tuple(shape)
+        self.occupancy = np.zeros(self.shape) if occupancy is None else occupancy
+        self.speed = np.zeros(self.shape) if speed is None else speed
+        self.samples = samples
+        self.start, self.end = start, end
+        self.level = level
+
+    def add(self, time, xbin, ybin, speed):
+        np.add.at(self.occupancy, (xbin, ybin), 1)
+        np.add.at(self.speed, (xbin, ybin), speed)
+        self.samples += 1
+        self.start = time if self.start is None else self.start
+        self.end = time
+
+    def density(self):
+        """
+        :return density: array: mean cars per cell
+        """
+        return self.occupancy / max(self.samples, 1)
+
+    def mean_speed(self):
+        """
+        :return speed: array: mean speed of the cars in each cell (NaN where there were none)
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.occupancy > 0, self.speed / self.occupancy, np.nan)
+
+    def congestion(self):
+        """
+        :return congestion: array: 0 where cars moved at the speed limit, 1 where they stood still (NaN where there
+                                   were none)
+        """
+        import simulation as sim
+        return np.clip(1 - self.mean_speed() / sim.speed_limit, 0, 1)
+
+    def coarsen(self):
+        """
+        :return heatmap: Heatmap: with every 2x2 block of cells merged into one
+        """
+        width, height = -(-self.shape[0] // 2), -(-self.shape[1] // 2)
+
+        def merge(array):
+            padded = np.zeros((2 * width, 2 * height))
+            padded[:self.shape[0], :self.shape[1]] = array
+            return padded.reshape(width, 2, height, 2).sum(axis=(1, 3))
+
+        return Heatmap(self.axis, (width, height), merge(self.occupancy), merge(self.speed), self.samples,
+                       self.start, self.end, self.level + 1)
+
+    def pyramid(self, levels=3):
+        """
+        :param    levels:  int
+        :return pyramid: list: of Heatmaps, from these cells (level 0) to the coarsest
+        """
+        pyramid = [self]
+        for _ in range(levels - 1):
+            pyramid.append(pyramid[-1].coarsen())
+        return pyramid
+
+    def extent(self):
+        """
+        :return extent: tuple: the left, right, bottom and top of the cells, for imshow
+        """
+        size = cell * 2 ** self.level
+        # cell 0 lies before the first bin edge, at axis[0] and axis[2]
+        left, bottom = self.axis[0] - cell, self.axis[2] - cell
+        return left, left + size * self.shape[0], bottom, bottom + size * self.shape[1]
+
+    def draw(self, ax, quantity='congestion', image=None, cmap='inferno', alpha=0.5, zorder=0.5):
+        """
+        draws the heatmap over the map, or updates an image drawn before (which leaves every other artist alone)
+
+        :param       ax:        axis: from matplotlib
+        :param quantity:         str: 'congestion', 'density' or 'mean-speed'
+        :param    image: None or AxesImage: from an earlier draw
+        :param     cmap:         str
+        :param    alpha:      double
+        :param   zorder:      double: beneath the roads (1) and the Animator's artists by default
+        :return   image:   AxesImage
+        """
+        values = {'congestion': self.congestion, 'density': self.density, 'mean-speed': self.mean_speed}[quantity]()
+        # the arrays are indexed [x, y], images [row, column] from the bottom
+        values = np.ma.masked_invalid(values.T)
+        if image is None:
+            limits = ax.axis()
+            image = ax.imshow(values, origin='lower', extent=self.extent(), cmap=cmap, alpha=alpha, zorder=zorder,
+                              interpolation='nearest', aspect=ax.get_aspect())
+            # imshow fits the axis to the image, which extends beyond the map
+            ax.axis(limits)
+        else:
+            image.set_data(values)
+        if values.count():
+            image.set_clim(values.min(), values.max())
+        return image
+
+    def save(self, filename):
+        """
+        :param filename: str: .npz
+        :return    None:
+        """
+        times = [np.nan if self.start is None else self.start, np.nan if self.end is None else self.end]
+        np.savez_compressed(filename, axis=self.axis, occupancy=self.occupancy, speed=self.speed,
+                            samples=self.samples, level=self.level, times=times)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        :param filename: str: .npz, from save
+        :return heatmap: Heatmap
+        """
+        with np.load(filename) as data:
+            start, end = data['times']
+            return cls(tuple(data['axis']), data['occupancy'].shape, data['occupancy'], data['speed'],
+                       int(data['samples']), start, end, int(data['level']))
@@ -1,86 +1,299 @@
-# python=3.6 requires using Qt4Agg backend for animation saving
-import matplotlib
-# matplotlib.use('Qt4Agg')
-from environment import Env
-from keras import Sequential, layers
-import matplotlib.pyplot as plt
+from environment import Env, MultiAgentEnv
 import numpy as np
-import osmnx as ox
+import qfunctions
+import random
+from replay import BatchedQLearner
+from rollout import RolloutRunner
+from vecenv import VecEnv
 
 dt = 1 / 1000
 N = 1
 agent = 0
 
-"""Lower Manhattan"""
-# G = ox.load_graphml('lowermanhattan.graphml')
-# G = ox.project_graph(G)
-# fig, ax = ox.plot_graph(G, node_size=0, edge_linewidth=0.5)
+# Q learning parameters ('tabular' uses NumPy, 'keras' loads the neural model)
+backend = 'tabular'
+y = 0.95
+eps = 0.5
+decay_factor = 0.999
+num_episodes = 10
 
-"""San Francisco"""
-# G = ox.load_graphml('sanfrancisco.graphml')
-# G = ox.project_graph(G)
-# fig, ax = ox.plot_graph(G, node_size=0, edge_linewidth=0.5)
+# simulated seconds after which an agent which has not arrived is given up on (None waits indefinitely)
+max_time = 60
 
-"""Piedmont, California"""
-G = ox.load_graphml('piedmont.graphml')
-G = ox.project_graph(G)
-fig, ax = ox.plot_graph(G, node_size=0, edge_linewidth=0.5)
+# run episodes across a pool of worker processes (None uses one worker per core)
+parallel = False
+processes = None
+seed = 0
 
-# initialize the environment for the learning agent
-env = Env(n=N, fig=fig, ax=ax, agent=agent, dt=dt, animate=False)
+# or step many scenarios in lockstep in a single process
+vectorized = False
+scenarios = 16
 
-# initialize the Keras training model
-model = Sequential()
-model.add(layers.InputLayer(batch_input_shape=(1, 10)))
-model.add(layers.Dense(10, activation='sigmoid'))
-model.add(layers.Dense(2, activation='linear'))
-model.compile(loss='mse', optimizer='adam', metrics=['mae'])
+# every car in the fleet learns, from one shared Q table or from one each
+multi_agent = False
+shared_q = True
+
+# learn from a replay buffer in mini-batches instead of fitting every transition as it happens
+batched = False
+batch_size = 32
+train_every = 4
+target_update = 25  # fits between target network updates (None for no target network)
+
+
+def choose_action(model, state, eps):
+    """
+    epsilon-greedy action selection
+
+    :param  model: value function
+    :param  state:    int
+    :param    eps: double
+    :return action:   int
+    """
+    if np.random.random() < eps:
+        return np.random.randint(0, 2)
+    else:
+        return np.argmax(model.predict(np.identity(10)[state:state + 1]))
+
+
+def learn_transition(model, state, action, r, new_s):
+    """
+    fits the model to one Q learning target
+
+    :return None:
+    """
+    target = r + y * np.max(model.predict(np.identity(10)[new_s:new_s + 1]))
+    target_vec = model.predict(np.identity(10)[state:state + 1])[0]
+    target_vec[action] = target
+    model.fit(np.identity(10)[state:state + 1], target_vec.reshape(-1, 2), epochs=1, verbose=0)
+
+
+def train(env, model, file):
+    """
+    executes Q learning one episode after another
+
+    :return r_sum_list: list: average reward per game
+    """
+    global eps
+    r_avg_list = []
+    r_sum_list = []
+
+    for i in range(num_episodes):
+        print("Episode {} of {}".format(i + 1, num_episodes))
+        eps *= decay_factor
+        r_sum = 0
+        done = False
+        diag_action = 0
+        diag_reward = 0
+        state = env.reset((i, num_episodes))
+        while not done:
+            env.reset((i, num_episodes))
+            action = choose_action(model, state, eps)
+            new_s, r, done, report = env.step(action=action, num=(i, num_episodes))
+            if report['timeout']:
+                # a timed-out simulation is not an outcome of the action, so it is not learned from. Every step
+                # replays the same scenario, which would time out again, so the episode ends
+                print('Agent timed out after {} ticks'.format(report['ticks']))
+                done = True
+            else:
+                learn_transition(model, state, action, r, new_s)
+                state = new_s
+            r_sum += r
+            print('Action: {}, Reward: {}'.format(action, r))
+            file.write('Action: {}, Reward: {}'.format(action, round(r, 2)))
+            diag_action += action
+            diag_reward += r
+        r_avg_list.append(r_sum)
+        r_sum_list.append(sum(r_avg_list) / (i + 1))
+        file.write('Episode: {}, Total Rewards: {} \n'.format(i, round(r_sum, 2)))
+
+    return r_sum_list
+
+
+def train_batched(env, learner, file):
+    """
+    executes Q learning one episode after another, learning from experience replay
+
+    :return r_sum_list: list: average reward per game
+    """
+    global eps
+    r_avg_list = []
+    r_sum_list = []
+
+    for i in range(num_episodes):
+        print("Episode {} of {}".format(i + 1, num_episodes))
+        eps *= decay_factor
+        r_sum = 0
+        done = False
+        state = env.reset((i, num_episodes))
+        while not done:
+            env.reset((i, num_episodes))
+            action = learner.act(state, eps)
+            new_s, r, done, report = env.step(action=action, num=(i, num_episodes))
+            if report['timeout']:
+                # a timed-out simulation is not an outcome of the action, so it is not learned from. Every step
+                # replays the same scenario, which would time out again, so the episode ends
+                print('Agent timed out after {} ticks'.format(report['ticks']))
+                done = True
+            else:
+                learner.observe(state, action, r, new_s, done)
+                state = new_s
+            r_sum += r
+            print('Action: {}, Reward: {}'.format(action, r))
+            file.write('Action: {}, Reward: {}'.format(action, round(r, 2)))
+        r_avg_list.append(r_sum)
+        r_sum_list.append(sum(r_avg_list) / (i + 1))
+        file.write('Episode: {}, Total Rewards: {} \n'.format(i, round(r_sum, 2)))
+
+    return r_sum_list
+
+
+def train_multi_agent(env, models, file):
+    """
+    executes Q learning for every agent of a MultiAgentEnv, one episode after another
+
+    :param  models: list: the value function of each agent (the same object repeated if it is shared)
+    :return r_sum_list: list: average reward per game, summed over the agents
+    """
+    global eps
+    r_avg_list = []
+    r_sum_list = []
+
+    for i in range(num_episodes):
+        print("Episode {} of {}".format(i + 1, num_episodes))
+        eps *= decay_factor
+        states = env.reset((i, num_episodes))
+        actions = np.array([choose_action(models[agent], state, eps) for agent, state in enumerate(states)])
+        new_states, rewards, dones, info = env.step(actions=actions, num=(i, num_episodes))
+        for agent, (state, action, r, new_s) in enumerate(zip(states, actions, rewards, new_states)):
+            if not info['timeouts'][agent]:
+                learn_transition(models[agent], state, action, r, new_s)
+        r_sum = rewards.sum()
+        print('Actions: {}, Rewards: {}'.format(actions.sum(), r_sum))
+        file.write('Actions: {}, Reward: {}'.format(actions.sum(), round(r_sum, 2)))
+        r_avg_list.append(r_sum)
+        r_sum_list.append(sum(r_avg_list) / (i + 1))
+        file.write('Episode: {}, Total Rewards: {} \n'.format(i, round(r_sum, 2)))
+
+    return r_sum_list
+
+
+def train_parallel(env, model, runner, file):
+    """
+    executes Q learning with one transition per episode, simulating a batch of episodes at a time on the runner's
+    workers; the transitions of a batch are learned in episode order once the whole batch has arrived
+
+    :return r_sum_list: list: average reward per game
+    """
+    global eps
+    r_avg_list = []
+    r_sum_list = []
+    batch_size = runner.processes
+
+    for start in range(0, num_episodes, batch_size):
+        episodes = range(start, min(start + batch_size, num_episodes))
+        state = env.reset((start, num_episodes))
+
+        jobs = []
+        for i in episodes:
+            eps *= decay_factor
+            jobs.append((i, choose_action(model, state, eps), seed + i))
+
+        for i, (state, action, r, new_s, done, timed_out) in zip(episodes,
+                                                                 runner.transitions(jobs, env, num_episodes)):
+            print("Episode {} of {}".format(i + 1, num_episodes))
+            if timed_out:
+                print('Agent timed out')
+            else:
+                learn_transition(model, state, action, r, new_s)
+            print('Action: {}, Reward: {}'.format(action, r))
+            file.write('Action: {}, Reward: {}'.format(action, round(r, 2)))
+            r_avg_list.append(r)
+            r_sum_list.append(sum(r_avg_list) / (i + 1))
+            file.write('Episode: {}, Total Rewards: {} \n'.format(i, round(r, 2)))
+
+    return r_sum_list
+
+
+def train_vectorized(vecenv, model, file):
+    """
+    executes Q learning with one transition per scenario, a batch of vecenv.M episodes at a time
+
+    :return r_sum_list: list: average reward per game
+    """
+    global eps
+    r_avg_list = []
+    r_sum_list = []
+
+    for start in range(0, num_episodes, vecenv.M):
+        states = vecenv.reset()
+        actions = []
+        for _ in states:
+            eps *= decay_factor
+            actions.append(choose_action(model, states[0], eps))
+
+        new_states, rewards, dones, info = vecenv.step(np.array(actions), num=(start // vecenv.M, num_episodes))
+        for j, (state, action, r, new_s) in enumerate(zip(states, actions, rewards, new_states)):
+            i = start + j
+            if i >= num_episodes:
+                break
+            print("Episode {} of {}".format(i + 1, num_episodes))
+            if info['timeouts'][j]:
+                print('Agent timed out')
+            else:
+                learn_transition(model, state, action, r, new_s)
+            print('Action: {}, Reward: {}'.format(action, r))
+            file.write('Action: {}, Reward: {}'.format(action, round(r, 2)))
+            r_avg_list.append(r)
+            r_sum_list.append(sum(r_avg_list) / (i + 1))
+            file.write('Episode: {}, Total Rewards: {} \n'.format(i, round(r, 2)))
+
+    return r_sum_list
+
+
+def main():
+    # the map is the one loaded by navigation, and the environment takes its bounds from the map data,
+    # so no figure is drawn for training
+
+    # initialize the environment for the learning agent
+    # (seeded identically to the rollout workers so that every process draws the same traffic lights)
+    random.seed(seed)
+    np.random.seed(seed)
+    if multi_agent:
+        env = MultiAgentEnv(n=N, dt=dt, animate=False, max_time=max_time)
+    else:
+        env = Env(n=N, agent=agent, dt=dt, animate=False, max_time=max_time)
+
+    model = qfunctions.make_value_function(backend)
+
+    file = open('diag.txt', 'w')
+
+    if multi_agent:
+        models = [model if shared_q else qfunctions.make_value_function(backend) for _ in env.agents]
+        r_sum_list = train_multi_agent(env, models, file)
+    elif batched:
+        target_model = qfunctions.clone_value_function(model) if target_update else None
+        learner = BatchedQLearner(model, target_model, y=y, batch_size=batch_size, train_every=train_every,
+                                  target_update=target_update, seed=seed)
+        r_sum_list = train_batched(env, learner, file)
+    elif vectorized:
+        r_sum_list = train_vectorized(VecEnv(env, scenarios, max_time, seed), model, file)
+    elif parallel:
+        with RolloutRunner(n=N, agent=agent, dt=dt, axis=env.axis, processes=processes, seed=seed,
+                           max_time=max_time) as runner:
+            r_sum_list = train_parallel(env, model, runner, file)
+    else:
+        r_sum_list = train(env, model, file)
+
+    file.close()
+
+    # matplotlib is only loaded for the final plot
+    import matplotlib.pyplot as plt
+    plt.plot(np.arange(len(r_sum_list)), r_sum_list)
+    plt.xlabel('Game number')
+    plt.ylabel('Average reward per game')
+    plt.suptitle('Average reward per game for car no. {}'.format(agent))
+    plt.savefig('avg_rewards.png')
 
-# now execute Q learning
-y = 0.95
-eps = 0.5
-decay_factor = 0.999
-num_episodes = 10
 
-r_avg_list = []
-r_sum_list = []
-
-file = open('diag.txt', 'w')
-
-for i in range(num_episodes):
-    print("Episode {} of {}".format(i + 1, num_episodes))
-    eps *= decay_factor
-    r_sum = 0
-    done = False
-    diag_action = 0
-    diag_reward = 0
-    state = env.reset((i, num_episodes))
-    while not done:
-        env.reset((i, num_episodes))
-        rand = np.random.random()
-        if rand < eps:
-            action = np.random.randint(0, 2)
-        else:
-            action = np.argmax(model.predict(np.identity(10)[state:state + 1]))
-        new_s, r, done, _ = env.step(action=action, num=(i, num_episodes))
-        target = r + y * np.max(model.predict(np.identity(10)[new_s:new_s + 1]))
-        target_vec = model.predict(np.identity(10)[state:state + 1])[0]
-        target_vec[action] = target
-        model.fit(np.identity(10)[state:state + 1], target_vec.reshape(-1, 2), epochs=1, verbose=0)
-        state = new_s
-        r_sum += r
-        print('Action: {}, Reward: {}'.format(action, r))
-        file.write('Action: {}, Reward: {}'.format(action, round(r, 2)))
-        diag_action += action
-        diag_reward += r
-    r_avg_list.append(r_sum)
-    r_sum_list.append(sum(r_avg_list) / (i + 1))
-    file.write('Episode: {}, Total Rewards: {} \n'.format(i, round(r_sum, 2)))
-
-file.close()
-
-plt.plot(np.arange(num_episodes), r_sum_list)
-plt.xlabel('Game number')
-plt.ylabel('Average reward per game')
-plt.suptitle('Average reward per game for car no. {}'.format(agent))
-plt.savefig('avg_rewards.png')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Fleet statistics computed as a simulation runs, from the state arrays of the cars:
+    time                     simulated seconds
+    cars                     cars in the fleet
+    mean-speed               over all cars
+    stopped-cars             cars slower than stopped_speed
+    occupied-bins            bins of models.determine_bins holding at least one car
+    busiest-bin-cars         cars in the fullest bin
+    congested-bins           bins holding max_cars or more (the StateView threshold for congested traffic)
+    red-light-queue          stopped cars with a red light ahead
+    longest-red-light-queue  the most such cars queued at any one light
+    throughput               trips completed since the previous sample
+    completed-trips          trips completed so far
+
+Samples go into fixed-size ring buffers, which are written out whenever they fill up (and on close), so a run of
+any length holds at most capacity samples in memory. A .csv file is overwritten by the first flush and appended to
+by every later one; a .parquet file is written one row group per flush with pyarrow, which is only imported in that
+case.
+"""
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+columns = ['time', 'cars', 'mean-speed', 'stopped-cars', 'occupied-bins', 'busiest-bin-cars', 'congested-bins',
+           'red-light-queue', 'longest-red-light-queue', 'throughput', 'completed-trips']
+
+
+class FleetMetrics:
+    def __init__(self, filename='metrics.csv', every=1, capacity=1000, stopped_speed=1.0, max_cars=10):
+        """
+        observes a Cars object (see attach) and samples its statistics every few time steps
+
+        :param      filename:    str: .csv or .parquet
+        :param         every:    int: take a sample every so many time steps
+        :param      capacity:    int: samples held in memory before they are written out
+        :param stopped_speed: double: cars slower than this are stopped
+        :param      max_cars:    int: cars in a bin for the bin to be congested
+        """
+        self.filename = filename
+        self.every = every
+        self.capacity = capacity
+        self.stopped_speed = stopped_speed
+        self.max_cars = max_cars
+        self.buffers = {column: np.zeros(capacity, dtype=float if column in ('time', 'mean-speed') else np.int64)
+                        for column in columns}
+        self.count = 0  # samples taken
+        self.flushed = 0  # samples written out
+        self.ticks = 0
+        self.completed = None
+        self.light_tree = None
+        self.writer = None
+
+    def attach(self, cars_object, lights_object=None):
+        """
+        starts sampling a simulation
+
+        :param   cars_object:          Cars
+        :param lights_object: None or TrafficLights: to assign red light queues to lights (default a single queue)
+        :return         self: FleetMetrics
+        """
+        cars_object.observers.append(self)
+        if lights_object is not None:
+            self.light_tree = cKDTree(lights_object.state[['x', 'y']].to_numpy(dtype=float))
+        return self
+
+    def detach(self, cars_object):
+        """
+        :return None:
+        """
+        cars_object.observers.remove(self)
+
+    def observe_cars(self, cars):
+        """
+        samples the time step which has just been simulated, if it is one of every few
+
+        :param cars: Cars
+        :return None:
+        """
+        self.ticks += 1
+        if (self.ticks - 1) % self.every:
+            return None
+
+        state = cars.state
+        remaining = np.fromiter((len(path) for path in state['xpath']), dtype=np.int64, count=len(state))
+        self.sample(cars.time_elapsed, state['vx'].to_numpy(dtype=float), state['vy'].to_numpy(dtype=float),
+                    state['xbin'].to_numpy(dtype=np.int64), state['ybin'].to_numpy(dtype=np.int64),
+                    state['distance-to-red-light'].to_numpy(dtype=float), remaining,
+                    state['x'].to_numpy(dtype=float), state['y'].to_numpy(dtype=float))
+
+    def sample(self, time, vx, vy, xbin, ybin, red_light_distances, remaining, x, y):
+        """
+        takes one sample from the state arrays of a fleet (e.g. those of fleet.Fleet), one entry per car
+
+        :param                time:    double
+        :param              vx, vy:  arrays: velocities
+        :param          xbin, ybin:  arrays of int: bins
+        :param red_light_distances:  arrays: distances to the red lights ahead (0 where there is none)
+        :param           remaining:  arrays of int: nodes left in the path of each car (0 once it has arrived)
+        :param                x, y:  arrays: positions
+        :return               None:
+        """
+        speed = np.hypot(vx, vy)
+        stopped = speed < self.stopped_speed
+        # cars per bin, counted over a single integer key per bin
+        _, per_bin = np.unique(xbin * (int(ybin.max(initial=0)) + 1) + ybin, return_counts=True)
+        queued = stopped & (red_light_distances > 0)
+        if self.light_tree is not None and queued.any():
+            _, nearest = self.light_tree.query(np.stack([x[queued], y[queued]], axis=-1))
+            longest_queue = np.bincount(nearest).max()
+        else:
+            longest_queue = queued.sum()
+        completed = remaining == 0
+        if self.completed is not None and self.completed.shape != completed.shape:
+            # another fleet (e.g. after a restore into different Cars): its trips cannot be told apart from before
+            self.completed = None
+        throughput = (completed & ~self.completed).sum() if self.completed is not None else completed.sum()
+        self.completed = completed
+
+        row = self.count % self.capacity
+        for column, value in (('time', time), ('cars', speed.size), ('mean-speed', speed.mean() if speed.size else 0),
+                              ('stopped-cars', stopped.sum()), ('occupied-bins', per_bin.size),
+                              ('busiest-bin-cars', per_bin.max(initial=0)),
+                              ('congested-bins', (per_bin >= self.max_cars).sum()),
+                              ('red-light-queue', queued.sum()), ('longest-red-light-queue', longest_queue),
+                              ('throughput', throughput), ('completed-trips', completed.sum())):
+            self.buffers[column][row] = value
+        self.count += 1
+        if self.count - self.flushed == self.capacity:
+            self.flush()
+
+    def rows(self, start, stop):
+        """
+        :param   start: int: first sample (which must still be in the buffers)
+        :param    stop: int: sample at which to stop
+        :return samples: dataframe: one row per sample
+        """
+        positions = np.arange(start, stop) % self.capacity
+        return pd.DataFrame({column: self.buffers[column][positions] for column in columns})
+
+    def recent(self, k=None):
+        """
+        :param       k: None or int: number of samples (default all those still in memory)
+        :return samples: dataframe: the latest samples, oldest first
+        """
+        k = self.capacity if k is None else min(k, self.capacity)
+        return self.rows(max(self.count - k, 0), self.count)
+
+    def flush(self):
+        """
+        writes out the samples taken since the last flush
+
+        :return None:
+        """
+        if self.count == self.flushed:
+            return None
+        samples = self.rows(self.flushed, self.count)
+        if self.filename.endswith('.parquet'):
+            import pyarrow
+            import pyarrow.parquet
+            table = pyarrow.Table.from_pandas(samples, preserve_index=False)
+            if self.writer is None:
+                self.writer = pyarrow.parquet.ParquetWriter(self.filename, table.schema)
+            self.writer.write_table(table)
+        else:
+            samples.to_csv(self.filename, mode='a' if self.flushed else 'w', header=not self.flushed, index=False)
+        self.flushed = self.count
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -7,14 +7,290 @@ and calculating the curvature of the bend in the road for speed adjustments
 import models
 import networkx as nx
 import numpy as np
-import osmnx as ox
+import profiling
+from scipy.spatial import cKDTree
 
 
-G = ox.load_graphml('piedmont.graphml')
-# G = ox.load_graphml('manhattan.graphml')
-# G = ox.load_graphml('data/sanfrancisco.graphml')
-# G = ox.load_graphml('data/lowermanhattan.graphml')
-G = ox.project_graph(G)
+# the map G, loaded from map_file by the first function which needs it (or set with set_graph)
+map_file = 'piedmont.graphml'
+# map_file = 'manhattan.graphml'
+# map_file = 'data/sanfrancisco.graphml'
+# map_file = 'data/lowermanhattan.graphml'
+_graph = None
+# the file from which G was loaded (None if it was set with set_graph)
+_graph_file = None
+
+# metadata derived from the map G, built once on first use and discarded whenever G is replaced
+_map_cache = {}
+
+
+def load_map(filepath=None):
+    """
+    loads and projects a map with osmnx, which is only imported here, and makes it the map G
+
+    :param filepath: None or str: graphml file (default map_file)
+    :return       G: MultiDiGraph
+    """
+    import osmnx as ox
+    filepath = filepath if filepath else map_file
+    return set_graph(ox.project_graph(ox.load_graphml(filepath)), filepath)
+
+
+def set_graph(graph, filepath=None):
+    """
+    replaces the map G, e.g. with a synthetic road network; all metadata derived from the previous map is discarded
+
+    :param    graph: MultiDiGraph: projected, with x and y node coordinates and edge lengths
+    :param filepath: None or str: the graphml file the map was loaded from
+    :return       G: MultiDiGraph
+    """
+    global _graph, _graph_file
+    _graph = graph
+    _graph_file = filepath
+    return _graph
+
+
+def graph_file():
+    """
+    :return filepath: None or str: the file from which the current map was loaded (None if there is no map yet, or
+                                   it was set with set_graph)
+    """
+    return _graph_file
+
+
+def graph():
+    """
+    :return G: MultiDiGraph: the current map, loaded on first use
+    """
+    if _graph is None:
+        load_map()
+    return _graph
+
+
+def __getattr__(name):
+    # navigation.G remains available to other modules, without loading the map at import
+    if name == 'G':
+        return graph()
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+
+class NodeIndex:
+    def __init__(self, graph):
+        """
+        a read-only array view of the node coordinates of a map, with an id -> index map and a KD-tree
+
+        :param graph: MultiDiGraph: projected OSMnx graph
+        """
+        self.ids = np.array(list(graph.nodes()))
+        self.positions = np.array([(data['x'], data['y']) for _, data in graph.nodes(data=True)], dtype=float)
+        self.positions.setflags(write=False)
+        self.index_of = {node: i for i, node in enumerate(self.ids.tolist())}
+        self.order = np.argsort(self.ids)
+        self.sorted_ids = self.ids[self.order]
+        self.tree = cKDTree(self.positions)
+
+    def indices_of(self, nodes):
+        """
+        vectorized id -> index lookup
+
+        :param    nodes: array-like of node IDs
+        :return indices: array of int
+        """
+        nodes = np.asarray(nodes)
+        positions = np.searchsorted(self.sorted_ids, nodes).clip(max=self.sorted_ids.size - 1)
+        unknown = self.sorted_ids[positions] != nodes
+        if np.any(unknown):
+            # as index_of would, rather than taking the index of a neighbouring node
+            raise KeyError(nodes[unknown].flat[0])
+        return self.order[positions]
+
+    def positions_of(self, nodes):
+        """
+        :param      nodes: array-like of node IDs
+        :return positions: array: shape (len(nodes), 2) of [x, y]
+        """
+        return self.positions[self.indices_of(nodes)]
+
+    def distance_sums(self, candidates, targets):
+        """
+        for each candidate node, the sum of its distances to all target nodes
+
+        :param candidates: array-like of node IDs
+        :param    targets: array-like of node IDs
+        :return      sums: array of double, one per candidate
+        """
+        candidate_positions = self.positions_of(candidates).reshape(-1, 1, 2)
+        target_positions = self.positions_of(targets).reshape(1, -1, 2)
+        return np.linalg.norm(candidate_positions - target_positions, axis=2).sum(axis=1)
+
+    def rank_by_distance(self, candidates, targets):
+        """
+        orders candidate nodes by the sum of their distances to the target nodes (closest first)
+
+        :param candidates: array-like of node IDs
+        :param    targets: array-like of node IDs
+        :return    ranked: array of node IDs
+        """
+        candidates = np.asarray(candidates)
+        return candidates[self.distance_sums(candidates, targets).argsort()]
+
+    def nearest(self, x, y):
+        """
+        snaps arbitrary (x, y) points to their nearest nodes on the map
+
+        :param                  x: double or array of double
+        :param                  y: double or array of double
+        :return  nodes, distances: node ID(s) and the snapping distance(s)
+        """
+        distances, indices = self.tree.query(np.stack([x, y], axis=-1))
+        return self.ids[indices], distances
+
+
+class NodeClasses:
+    def __init__(self, graph, index):
+        """
+        typed arrays classifying the nodes of a map, computed once so that they can be queried without graph scans
+
+        :param graph: MultiDiGraph: projected OSMnx graph
+        :param index:    NodeIndex: of the same graph
+        """
+        streets_per_node = graph.graph.get('streets_per_node', {})
+        self.ids = index.ids
+        self.degrees = np.array([degree for _, degree in graph.degree()], dtype=np.int64)
+        self.streets = np.array([streets_per_node.get(node, 0) for node in self.ids.tolist()], dtype=np.int64)
+        neighbours = np.array([len((set(graph.pred[node]) | set(graph.succ[node])) - {node})
+                               for node in self.ids.tolist()], dtype=np.int64)
+        # culdesacs keep the ordering of the OSMnx streets_per_node attribute, on which car initialization relies
+        self.culdesacs = np.array([key for key, value in streets_per_node.items() if value == 1], dtype=np.int64)
+        # nodes where the map was clipped have fewer neighbours in the graph than streets in the real world
+        self.boundary = self.ids[neighbours < self.streets]
+        self.light_candidates = np.flatnonzero(self.degrees > 3)
+        self._lights = {}
+        for array in (self.degrees, self.streets, self.culdesacs, self.boundary, self.light_candidates):
+            array.setflags(write=False)
+
+    def traffic_lights(self, prescale=10):
+        """
+        every prescale-th node (in graph order) which is a light candidate
+
+        :param prescale: int
+        :return  lights: array: shape (n, 2) of [node ID, degree]
+        """
+        if prescale not in self._lights:
+            candidates = self.light_candidates[self.light_candidates % prescale == 0]
+            lights = np.column_stack((self.ids[candidates], self.degrees[candidates]))
+            lights.setflags(write=False)
+            self._lights[prescale] = lights
+        return self._lights[prescale]
+
+    def sample(self, n, nodes=None, seed=0):
+        """
+        deterministically samples n distinct nodes
+
+        :param     n: int
+        :param nodes: None or array: the node IDs to sample from (default all nodes)
+        :param  seed: int
+        :return     : array of node IDs
+        """
+        nodes = self.ids if nodes is None else nodes
+        rng = np.random.default_rng(seed)
+        return rng.choice(nodes, size=min(n, len(nodes)), replace=False)
+
+
+class EdgeGeometry:
+    def __init__(self, graph, index):
+        """
+        flat arrays describing the directed edges of a map; where there are parallel edges only the shortest is kept.
+        The first point of each edge's line geometry after its origin is what traffic light faces point towards.
+
+        :param graph: MultiDiGraph: projected OSMnx graph
+        :param index:    NodeIndex: of the same graph
+        """
+        us, vs, lengths, first_points = [], [], [], []
+        for u, v, data in graph.edges(data=True):
+            us.append(u)
+            vs.append(v)
+            lengths.append(data['length'])
+            if 'geometry' in data:
+                first_points.append(data['geometry'].coords[1])
+            else:
+                # the edge is a straight line from node to node
+                first_points.append((graph.nodes[v]['x'], graph.nodes[v]['y']))
+
+        u, v = index.indices_of(us), index.indices_of(vs)
+        lengths, first_points = np.array(lengths, dtype=float), np.array(first_points, dtype=float).reshape(-1, 2)
+
+        # parallel edges are adjacent in the edge ordering of the graph, so keeping the shortest of each
+        # group and then restoring the original ordering preserves the adjacency order of each node
+        by_length = np.lexsort((lengths, v, u))
+        shortest = np.ones(by_length.size, dtype=bool)
+        shortest[1:] = (np.diff(u[by_length]) != 0) | (np.diff(v[by_length]) != 0)
+        keep = np.sort(by_length[shortest])
+
+        self.u, self.v = u[keep], v[keep]
+        self.length = lengths[keep]
+        self.first_x, self.first_y = first_points[keep, 0], first_points[keep, 1]
+
+
+def map_cache():
+    """
+    returns the metadata cache of the current map, emptying it first if G has been replaced
+
+    :return cache: dict
+    """
+    if _map_cache.get('graph') is not graph():
+        _map_cache.clear()
+        _map_cache['graph'] = graph()
+    return _map_cache
+
+
+def node_index():
+    """
+    :return index: NodeIndex of the current map, built on first use
+    """
+    cache = map_cache()
+    if 'node-index' not in cache:
+        cache['node-index'] = NodeIndex(graph())
+    return cache['node-index']
+
+
+def edge_geometry():
+    """
+    :return geometry: EdgeGeometry of the current map, built on first use
+    """
+    cache = map_cache()
+    if 'edge-geometry' not in cache:
+        cache['edge-geometry'] = EdgeGeometry(graph(), node_index())
+    return cache['edge-geometry']
+
+
+def node_classes():
+    """
+    :return classes: NodeClasses of the current map, built on first use
+    """
+    cache = map_cache()
+    if 'node-classes' not in cache:
+        cache['node-classes'] = NodeClasses(graph(), node_index())
+    return cache['node-classes']
+
+
+def map_bounds(margin=0.02):
+    """
+    the x and y ranges of the road network, padded as osmnx.plot_graph pads its axes, so that the simulation can be
+    set up without drawing the map
+
+    :param margin: double: fraction of each range added on either side
+    :return  axis:  tuple: xmin, xmax, ymin, ymax
+    """
+    cache = map_cache()
+    if ('bounds', margin) not in cache:
+        points = [node_index().positions] + [np.asarray(data['geometry'].coords)
+                                             for _, _, data in graph().edges(data=True) if 'geometry' in data]
+        points = np.vstack(points)
+        (west, south), (east, north) = points.min(axis=0), points.max(axis=0)
+        margin_ew, margin_ns = (east - west) * margin, (north - south) * margin
+        cache[('bounds', margin)] = (west - margin_ew, east + margin_ew, south - margin_ns, north + margin_ns)
+    return cache[('bounds', margin)]
 
 
 class FrontView:
@@ -115,15 +391,7 @@ class FrontView:
         :return bool: False if not, True if car is at the end of its root
         """
         xdest, ydest = get_position_of_node(self.car['destination'])
-        xdiff = xdest - self.car['x']
-        ydiff = ydest - self.car['y']
-        car_near_xdest = np.isclose(0, xdiff, atol=self.stop_distance)
-        car_near_ydest = np.isclose(0, ydiff, atol=self.stop_distance)
-
-        if car_near_xdest and car_near_ydest:
-            return True
-        else:
-            return False
+        return bool(arrived(self.car['x'], self.car['y'], xdest, ydest, self.stop_distance))
 
 
 class StateView:
@@ -146,6 +414,7 @@ class StateView:
         self.max_cars = 10  # the number of cars in a bin for the bin to be considered 'congested traffic'
         self.speed_limit = 250
 
+    @profiling.timed('StateView.determine_state')
     def determine_state(self):
         """
         this method gathers information about the car's route, and determines which state the car is in
@@ -205,12 +474,12 @@ class StateView:
         Calculate the length of the detour and the length of  
         the stretch of the original route which was avoided by the detour:
         """
-        detour_length = sum([G.get_edge_data(detour[i], detour[i + 1])[0]['length']
+        detour_length = sum([graph().get_edge_data(detour[i], detour[i + 1])[0]['length']
                              for i in range(len(detour) - 1)])
         departure_ind = np.where(self.route == detour[0])[0][0]
         return_ind = np.where(self.route == detour[-1])[0][0]
         span = return_ind - departure_ind
-        original_length = sum([G.get_edge_data(self.route[departure_ind + i],
+        original_length = sum([graph().get_edge_data(self.route[departure_ind + i],
                                                self.route[departure_ind + i + 1])[0]['length']
                                for i in range(span + 1)])
         if detour_length <= 2 * original_length:
@@ -382,32 +651,295 @@ class StateView:
         :param      node:
         :return dv_table:
         """
-        possible_directions = np.array([dot for dot in G[node].__iter__()])
+        possible_directions = np.array([dot for dot in graph()[node].__iter__()])
         nodes_already_in_route = [np.where(route_node == possible_directions)[0][0] for route_node in self.route
                                   if np.where(route_node == possible_directions)[0].size > 0]
         possible_directions = np.delete(possible_directions, nodes_already_in_route)
 
         reroute_node_index = np.where(node == self.route)[0][0]
-        sum_three_node_dist = []
-        directions = []
-        for direction in possible_directions:
-            twice_out = np.array([dot for dot in G[direction].__iter__()])
-            if twice_out.size == 0 or (direction == self.route).any():
-                # avoid culdesacs and nodes already in the route
-                continue
-
-            directions.append(direction)
-            distances = []
-            for compare_node in self.route[reroute_node_index + 2:reroute_node_index + 5]:
-                compare_node_pos = get_position_of_node(compare_node)
-                potential_node_pos = get_position_of_node(direction)
-                distances.append(np.linalg.norm(compare_node_pos - potential_node_pos))
-            sum_three_node_dist.append(sum(distances))
+        # avoid culdesacs and nodes already in the route
+        directions = [direction for direction in possible_directions
+                      if len(graph()[direction]) and not (direction == self.route).any()]
+        compare_nodes = self.route[reroute_node_index + 2:reroute_node_index + 5]
+        sum_three_node_dist = node_index().distance_sums(directions, compare_nodes)
 
         dv_table = models.make_table({'potential-nodes': directions, 'sum-distances': sum_three_node_dist})
         return dv_table
 
 
+class StateTracker(StateView):
+    def __init__(self, axis, car_index, cars, lights, cache_size=64):
+        """
+        a StateView which persists for one agent from call to call. update() points it at the current fleet; the
+        ETA advances with the car along its route, and each feature of determine_state is recomputed only when its
+        inputs change: lights in the route when the route or the lights change, traffic nodes when the route or the
+        cars in the bins along it change, and alternate routes when the route, the obstacle to avoid or the traffic
+        changes. Traffic needs more than max_cars cars in the bins along the route, so while there are no more than
+        that, the cars can move about freely without invalidating anything; light phases do not enter the state
+        either, so a light changing colour invalidates nothing
+
+        :param       axis:
+        :param  car_index:
+        :param       cars: DataFrame
+        :param     lights: DataFrame
+        :param cache_size:       int: results kept per feature before the oldest are discarded
+        """
+        self.axis = axis
+        self.index = car_index
+        self.max_cars = 10  # the number of cars in a bin for the bin to be considered 'congested traffic'
+        self.speed_limit = 250
+        self.cache_size = cache_size
+        self.lights = None
+        self.lights_key = None
+        # a pair of bins (xbin, ybin) is packed into one integer key, xbin * bin_stride + ybin
+        self.bin_stride = np.arange(axis[2], axis[3], 200).size + 1
+        self.bin_keys = None
+        self.occupied_bins, self.bin_counts = None, None
+        self.full_route = None
+        self.route_features = {}
+        self.route_bins = {}
+        self.light_cache = {}
+        self.traffic_cache = {}
+        self.alternate_cache = {}
+        self.state_cache = {}
+        self.update(cars, lights)
+
+    def update(self, cars, lights=None):
+        """
+        points the tracker at the current state of the fleet (and, optionally, of the lights)
+
+        :param   cars: DataFrame
+        :param lights: None or DataFrame
+        :return  self: StateTracker
+        """
+        if lights is not None:
+            lights_key = lights['node'].to_numpy().tobytes() + lights['switch-time'].to_numpy(dtype=float).tobytes()
+            if lights_key != self.lights_key:
+                self.lights_key = lights_key
+                for cache in (self.route_features, self.light_cache, self.state_cache):
+                    cache.clear()
+            self.lights = lights
+
+        # the cars per bin, each bin as a single integer key
+        self.bin_keys = cars['xbin'].to_numpy(dtype=np.int64) * self.bin_stride + cars['ybin'].to_numpy(dtype=np.int64)
+        self.occupied_bins, self.bin_counts = np.unique(self.bin_keys, return_counts=True)
+
+        self.cars = cars
+        self.car = cars.loc[self.index]
+        route = np.array(self.car['route'])
+        if route.ndim == 1:
+            if not self.follows(route):
+                self.full_route = route
+            self.route = route
+            features = self.features()
+            cursor = self.full_route.size - route.size
+        else:
+            # the simulation drops the route of a car once it is under way, so its progress is read from its path
+            if self.full_route is None:
+                # a car first seen under way: its route is made up of the nodes along its path
+                self.full_route = self.route_from_path()
+            features = self.features()
+            cursor = features['next-node'][max(0, features['next-node'].size - len(self.car['xpath']))] \
+                if features['next-node'].size else 0
+            self.route = self.full_route[cursor:]
+
+        self.eta = features['length-to-go'][cursor] / self.speed_limit + features['wait-to-go'][cursor] / 2
+        return self
+
+    def route_from_path(self):
+        """
+        :return route: array: the node the car has last passed, and those its path passes through, in order
+        """
+        xpath, ypath = np.asarray(self.car['xpath'], dtype=float), np.asarray(self.car['ypath'], dtype=float)
+        if not xpath.size:
+            return np.array([], dtype=np.int64)
+        nodes, distances = node_index().nearest(xpath, ypath)
+        nodes = nodes[distances < 1e-6]
+        if not nodes.size:
+            return nodes
+        # the geometry of an edge may end on its node as the next edge starts on it
+        nodes = nodes[np.append(True, nodes[1:] != nodes[:-1])]
+
+        # the car is on the edge to the first of them from the predecessor it is least out of the way of
+        previous = np.array(list(graph().predecessors(nodes[0])))
+        if previous.size:
+            position = np.array([self.car['x'], self.car['y']], dtype=float)
+            starts, end = node_index().positions_of(previous), node_index().positions_of(nodes[:1])[0]
+            out_of_the_way = np.linalg.norm(starts - position, axis=1) + np.linalg.norm(end - position) - \
+                np.linalg.norm(starts - end, axis=1)
+            nodes = np.append(previous[out_of_the_way.argmin()], nodes)
+        return nodes
+
+    def traffic_key(self, route=None):
+        """
+        what get_traffic_nodes reads of the fleet for a route. Traffic needs more than max_cars matches of a car and
+        a bin along the route, so while the bins along the route hold no more cars than that, there is none however
+        the cars move (the key is None); otherwise it is the cars in those bins, where they are and the path ahead
+
+        :param route: None or list
+        :return  key: None or tuple
+        """
+        route = self.given_route(route)
+        route_key = route.tobytes()
+        if route_key not in self.route_bins:
+            xbins, ybins = self.get_bins_in_route(route.tolist())
+            self.remember(self.route_bins, route_key, np.array(xbins, dtype=np.int64) * self.bin_stride +
+                          np.array(ybins, dtype=np.int64))
+        bins = self.route_bins[route_key]
+        positions = np.minimum(np.searchsorted(self.occupied_bins, bins), self.occupied_bins.size - 1)
+        cars_in_bins = np.where(self.occupied_bins[positions] == bins, self.bin_counts[positions], 0).sum()
+        if cars_in_bins <= self.max_cars:
+            return None
+        near = np.isin(self.bin_keys, bins)
+        return (np.flatnonzero(near).tobytes(), self.cars.loc[near, ['x', 'y']].to_numpy(dtype=float).tobytes(),
+                repr([np.asarray(route).ravel()[:1].tolist() for route in self.cars.loc[near, 'route']]),
+                len(self.car['xpath']))
+
+    def given_route(self, route):
+        """
+        :param  route: None, list or array: a route argument of StateView, in which an empty route, like None, stands
+                                            for the car's own route
+        :return route: array
+        """
+        return self.route if route is None or not len(route) else np.asarray(route)
+
+    def follows(self, route):
+        """
+        :param route: array
+        :return bool: True if route is what remains of the route being tracked
+        """
+        return self.full_route is not None and route.size <= self.full_route.size and \
+            np.array_equal(self.full_route[self.full_route.size - route.size:], route)
+
+    def features(self):
+        """
+        the per-node features of the tracked route, from which what remains of them is read in constant time
+
+        :return features: dict: 'length-to-go' and 'wait-to-go' (the route length and the expected light waits still
+                                ahead of each node), and 'next-node' (the next route node at each point of the path)
+        """
+        key = self.full_route.tobytes()
+        if key not in self.route_features:
+            route = self.full_route
+            lengths = np.array([graph().get_edge_data(route[i], route[i + 1])[0]['length']
+                                for i in range(route.size - 1)])
+            switch_times = dict(zip(self.lights['node'][::-1], self.lights['switch-time'][::-1]))
+            waits = np.array([switch_times.get(node, 0) for node in route], dtype=float)
+
+            xpath, ypath = np.asarray(self.car['xpath'], dtype=float), np.asarray(self.car['ypath'], dtype=float)
+            positions = node_index().positions_of(route) if route.size else np.zeros((0, 2))
+            next_node = np.zeros(xpath.size, dtype=np.int64)
+            j = route.size - 1
+            for p in range(xpath.size - 1, -1, -1):
+                if j > 0 and np.isclose(xpath[p], positions[j - 1, 0]) and np.isclose(ypath[p], positions[j - 1, 1]):
+                    j -= 1
+                next_node[p] = j
+
+            self.remember(self.route_features, key, {
+                'length-to-go': np.append(np.cumsum(lengths[::-1])[::-1], [0, 0]),
+                'wait-to-go': np.append(np.cumsum(waits[::-1])[::-1], 0),
+                'next-node': next_node})
+        return self.route_features[key]
+
+    def remember(self, cache, key, value):
+        """
+        stores a result, discarding the whole cache once it holds cache_size results
+
+        :return value:
+        """
+        if len(cache) >= self.cache_size:
+            cache.clear()
+        cache[key] = value
+        return value
+
+    @profiling.timed('StateTracker.determine_state')
+    def determine_state(self):
+        key = (self.route.tobytes(), self.traffic_key() if self.route.size else None, self.lights_key)
+        if key not in self.state_cache:
+            self.remember(self.state_cache, key, super().determine_state())
+        state, new_route, new_xpath, new_ypath = self.state_cache[key]
+        if state[6] or state[9]:
+            # states 7 and 10 keep to the car's own path, which has moved on since the state was cached
+            return state, self.route, self.car['xpath'], self.car['ypath']
+        return state, new_route, new_xpath, new_ypath
+
+    def find_alternate_route(self, avoid, traffic=0):
+        key = (self.route.tobytes(), avoid, traffic)
+        if key not in self.alternate_cache:
+            self.remember(self.alternate_cache, key, super().find_alternate_route(avoid, traffic))
+        return self.alternate_cache[key]
+
+    def get_lights_in_route(self, route=None):
+        route = self.given_route(route)
+        key = route.tobytes()
+        if key not in self.light_cache:
+            self.remember(self.light_cache, key, super().get_lights_in_route(route.tolist()))
+        return self.light_cache[key]
+
+    def get_traffic_nodes(self, route=None):
+        traffic = self.traffic_key(route)
+        if traffic is None:
+            return None
+        route = self.given_route(route)
+        key = (route.tobytes(), traffic)
+        if key not in self.traffic_cache:
+            self.remember(self.traffic_cache, key, super().get_traffic_nodes(route.tolist()))
+        return self.traffic_cache[key]
+
+
+def determine_states(axis, cars, lights, max_cars=10):
+    """
+    determines the state of every car in the fleet at once. One vectorized pass over all routes finds the cars
+    which have a traffic light on their route, or enough cars in the bins along their route for it to be congested;
+    only those cars build a StateView and search for a detour, the rest have no obstacles (or have arrived)
+
+    :param                     axis:      list: x and y ranges of the road network
+    :param                     cars: DataFrame
+    :param                   lights: DataFrame
+    :param                 max_cars:       int: as StateView.max_cars
+    :return states, alternate_routes:    tuple: array of state indices (0-9), and a list holding for each car
+                                                either None or the (route, xpath, ypath) its StateView proposes
+                                                (None, in state 7, if no detour could be built)
+    """
+    n = len(cars)
+    routes = [np.asarray(route) for route in cars['route']]
+    lengths = np.array([route.size for route in routes], dtype=np.int64)
+    states = np.where(lengths > 0, 6, 9)
+    alternate_routes = [None] * n
+    if not lengths.sum():
+        return states, alternate_routes
+
+    flat_route = np.concatenate(routes)
+    owner = np.repeat(np.arange(n), lengths)
+    has_light = np.bincount(owner, weights=np.isin(flat_route, lights['node'].to_numpy()), minlength=n) > 0
+
+    # an upper bound on the number of congesting cars StateView.get_traffic_nodes can find: every car in every bin
+    # along the route (bins which repeat after leaving them are counted again, as in StateView.get_bins_in_route)
+    xbins, ybins = np.arange(axis[0], axis[1], 200), np.arange(axis[2], axis[3], 200)
+    positions = node_index().positions_of(flat_route)
+    keys = np.digitize(positions[:, 0], xbins) * (ybins.size + 1) + np.digitize(positions[:, 1], ybins)
+    car_keys = np.digitize(cars['x'], xbins) * (ybins.size + 1) + np.digitize(cars['y'], ybins)
+    bin_keys, occupancy = np.unique(car_keys, return_counts=True)
+    position_in_bins = np.minimum(np.searchsorted(bin_keys, keys), bin_keys.size - 1)
+    cars_in_bin = np.where(bin_keys[position_in_bins] == keys, occupancy[position_in_bins], 0)
+    entered = np.ones(keys.size, dtype=bool)
+    entered[1:] = (keys[1:] != keys[:-1]) | (owner[1:] != owner[:-1])
+    may_be_congested = np.bincount(owner, weights=cars_in_bin * entered, minlength=n) > max_cars
+
+    for i in np.flatnonzero((lengths > 0) & (has_light | may_be_congested)):
+        stateview = StateView(axis=axis, car_index=cars.index[i], cars=cars, lights=lights)
+        try:
+            state, new_route, new_xpath, new_ypath = stateview.determine_state()
+        except (IndexError, ValueError):
+            # no detour could be built around the obstacle, so the car keeps its route
+            print('Could not determine state for car {}'.format(i))
+            continue
+        states[i] = list(state).index(True)
+        alternate_routes[i] = (new_route, new_xpath, new_ypath)
+
+    return states, alternate_routes
+
+
 def car_obstacles(frontview, cars):
     """
     Determines if there are any other_cars within the car's bin and then
@@ -493,56 +1025,88 @@ def determine_pedigree(node_id):
      :param  node_id:    int
      :return vectors:   list: list of vectors pointing from the intersection to the nearest point on the out roads
      """
-    x, y = get_position_of_node(node_id)
+    faces = light_faces([node_id])
+    return list(zip(faces['xvectors'], faces['yvectors']))
 
-    out_nodes = [dot for dot in G[node_id].__iter__()]
 
-    vectors = []
-    for node in out_nodes:
-        try:
-            out_x, out_y = lines_to_node(node_id, node)[0][1]
-        except IndexError:
-            continue
-        vectors.append((out_x - x, out_y - y))
+def light_faces(nodes):
+    """
+    determines the pedigree of many traffic lights at once: one face per out road of each light node
+
+    :param  nodes: array-like of node IDs
+    :return faces: dict of flat arrays, grouped by light:
+                       'light' (index into nodes), 'xvectors', 'yvectors', and
+                       'offsets' (faces of light i are offsets[i]:offsets[i + 1])
+    """
+    index, geometry = node_index(), edge_geometry()
+    nodes = index.indices_of(nodes)
 
-    return vectors
+    light_of_node = np.full(index.ids.size, -1)
+    light_of_node[nodes] = np.arange(nodes.size)
+    # self-loops do not lead out of the intersection
+    is_face = (light_of_node[geometry.u] >= 0) & (geometry.u != geometry.v)
+    face_edges = np.flatnonzero(is_face)
+    face_edges = face_edges[np.argsort(light_of_node[geometry.u[face_edges]], kind='stable')]
+
+    light = light_of_node[geometry.u[face_edges]]
+    origins = index.positions[geometry.u[face_edges]]
+    faces = {'light': light,
+             'xvectors': geometry.first_x[face_edges] - origins[:, 0],
+             'yvectors': geometry.first_y[face_edges] - origins[:, 1],
+             'offsets': np.concatenate(([0], np.cumsum(np.bincount(light, minlength=nodes.size))))}
+    return faces
 
 
 def find_culdesacs():
     """
     culdesacs are nodes with only one edge connection and which are not on the boundary of the OpenStreetMap
 
-    :return culdesacs: list of node IDs
+    :return culdesacs: array of node IDs
     """
-    culdesacs = [key for key, value in G.graph['streets_per_node'].items() if value == 1]
-    return culdesacs
+    return node_classes().culdesacs
 
 
 def find_traffic_lights(prescale=10):
     """
     traffic lights are nodes in the graph which have degree > 3
 
-    :return light_intersections: a list of node IDs suitable for traffic lights
+    :param             prescale: int: only every prescale-th node of the graph is considered
+    :return light_intersections: array of [node ID, degree] rows suitable for traffic lights
+    """
+    return node_classes().traffic_lights(prescale)
+
+
+def find_boundary_nodes():
     """
-    light_intersections = []
-    for i, node in enumerate(G.degree()):
-        if (node[1] > 3) and not (i % prescale):
-            light_intersections.append(node)
+    boundary nodes are those where the OpenStreetMap was clipped, i.e. with streets leading off the map
 
-    return light_intersections
+    :return boundary: array of node IDs
+    """
+    return node_classes().boundary
 
 
-def find_nodes(n):
+def find_nodes(n, seed=0):
     """
-    returns n node IDs from the networkx graph
+    returns n distinct node IDs from the networkx graph, sampled deterministically
 
     :param      n: int
-    :return nodes: list
+    :param   seed: int
+    :return nodes: array
+    """
+    return node_classes().sample(n, seed=seed)
+
+
+def arrived(x, y, xdest, ydest, stop_distance):
+    """
+    the arrival test of every engine (FrontView, Env, MultiAgentEnv and fleet.Fleet): a car has arrived when it is
+    within stop_distance of its destination along both x and y
+
+    :param          x, y: double or array: positions of the cars
+    :param  xdest, ydest: double or array: positions of their destinations
+    :param stop_distance: double
+    :return      arrived: bool or array of bool
     """
-    nodes = []
-    for node in G.nodes():
-        nodes.append(node)
-    return nodes[:n]
+    return np.isclose(0, xdest - x, atol=stop_distance) & np.isclose(0, ydest - y, atol=stop_distance)
 
 
 def get_position_of_node(node):
@@ -555,10 +1119,23 @@ def get_position_of_node(node):
     # note that the x and y coordinates of the G.nodes are flipped
     # this is possibly an issue with the omnx G.load_graphml method
     # a correction is to make the position tuple be (y, x) as below
-    position = np.array([G.nodes[node]['x'], G.nodes[node]['y']])
+    index = node_index()
+    position = index.positions[index.index_of[node]]
     return position
 
 
+def snap_to_node(x, y):
+    """
+    finds the nearest node on the map to an arbitrary point, e.g. coordinates supplied by a demand file
+
+    :param         x: double or array of double
+    :param         y: double or array of double
+    :return node(s): node ID or array of node IDs
+    """
+    nodes, _ = node_index().nearest(x, y)
+    return nodes
+
+
 def get_init_path(origin, destination):
     """
     compiles a list of tuples which represents a route
@@ -585,7 +1162,7 @@ def get_route(origin, destination):
     :param destination: node ID
     :return:     route: list of intersection nodes
     """
-    return nx.shortest_path(G, origin, destination, weight='length')
+    return nx.shortest_path(graph(), origin, destination, weight='length')
 
 
 def eta(car, lights, speed_limit=250):
@@ -600,7 +1177,7 @@ def eta(car, lights, speed_limit=250):
     route = np.array(car['route'])
 
     if route.size > 0:
-        route_length = sum([G.get_edge_data(route[i], route[i + 1])[0]['length'] for i in range(route.size - 1)])
+        route_length = sum([graph().get_edge_data(route[i], route[i + 1])[0]['length'] for i in range(route.size - 1)])
 
         eta_from_distance = route_length / speed_limit
 
@@ -634,12 +1211,9 @@ def build_new_route(route, reroute_node, direction, traffic, avoid):
     new_route.append(direction)
     detour = [reroute_node, direction]
 
-    # get the coordinate positions of the next three nodes in the original route
+    # the next three nodes in the original route, against which the potential new nodes are ranked
     # TODO: this will not work if we are building a new route near the very end of a route, where there are not 3 nodes
-    next_nodes_pos = []
-    for node in route[reroute_index + 1:reroute_index + 4]:
-        x, y = get_position_of_node(node)
-        next_nodes_pos.append((x, y))
+    next_nodes = route[reroute_index + 1:reroute_index + 4]
 
     returned = False
     i = 0
@@ -650,17 +1224,17 @@ def build_new_route(route, reroute_node, direction, traffic, avoid):
                 route, avoid, direction
             ))
             break
-        out_from_direction = [dot for dot in G[direction].__iter__() if dot != reroute_node]
+        out_from_direction = [dot for dot in graph()[direction].__iter__() if dot != reroute_node]
 
-        # Populate a list of the sums of the distances to the next
-        # three nodes in the original route, for each potential new node
-        sum_three_node_dist, refined_out_from_direction = [], []
+        # Rank the potential new nodes by the sums of their distances
+        # to the next three nodes in the original route
+        refined_out_from_direction = []
         for node in out_from_direction:
             if (node == route[:avoid_index + 1 + traffic]).any():
                 # avoid all the nodes in the route including the ones around which we are rerouting
                 continue
 
-            twice_out = np.array([dot for dot in G[node].__iter__()])
+            twice_out = np.array([dot for dot in graph()[node].__iter__()])
             if (direction == twice_out).any():
                 twice_out = np.delete(twice_out, np.where(twice_out == direction)[0][0])
 
@@ -668,21 +1242,13 @@ def build_new_route(route, reroute_node, direction, traffic, avoid):
                 # avoid culdesacs
                 continue
 
-            distances = []
-            for compare_node in next_nodes_pos:
-                potential_node_pos = get_position_of_node(node)
-                distances.append(np.linalg.norm(compare_node - potential_node_pos))
-            sum_three_node_dist.append(sum(distances))
             refined_out_from_direction.append(node)
 
-        sum_three_node_dist = np.array(sum_three_node_dist)
-        refined_out_from_direction = np.array(refined_out_from_direction)
-
-        if refined_out_from_direction.size == 0:
+        if not refined_out_from_direction:
             # unable to continue rerouting, try rerouting from an earlier node in the route
             return False
 
-        next_node = refined_out_from_direction[sum_three_node_dist.argsort()[0]]
+        next_node = node_index().rank_by_distance(refined_out_from_direction, next_nodes)[0]
 
         if (next_node == route[:reroute_index]).any():
             # going in circles, try rerouting from an earlier node in the route
@@ -742,6 +1308,7 @@ def lines_to_node(origin, destination):
     :return      lines: list
     """
 
+    G = graph()
     route = nx.shortest_path(G, origin, destination, weight='length')
 
     # find the route lines
@@ -784,6 +1351,7 @@ def shortest_path_lines_nx(origin, destination):
         [(double, double), ...]:   each tuple represents the bend-point in a straight road
     """
 
+    G = graph()
     route = nx.shortest_path(G, origin, destination, weight='length')
 
     # find the route lines
@@ -0,0 +1,255 @@
+"""
+Opt-in timers around the phases of a simulation tick: binning, the obstacle search (front views, nodes, cars and
+lights), sim.update_cars and the integration in Cars.update, as well as TrafficLights.update, Env.step and
+determine_state. Profiling is off unless enabled, in which case phase returns a shared null context and timed calls
+the function straight through, so the instrumented code runs as it would without them.
+
+    import profiling
+    profiling.enable()
+    ... simulate ...
+    print(profiling.summary())
+    profiling.export_chrome_trace('trace.json')  # open in chrome://tracing or Perfetto
+
+However long a run is profiled, each phase takes the same memory: its durations go into counters of fixed,
+logarithmically spaced bins, alongside their count, sum, minimum and maximum, and into a bounded reservoir sample
+from which the percentiles are taken. Only the trace holds individual passes, and only its first max_events.
+"""
+import contextlib
+import functools
+import json
+import math
+import numpy as np
+import os
+import random
+import threading
+import time
+
+
+_profiler = None
+_null_phase = contextlib.nullcontext()
+
+bins_per_decade = 10
+shortest = 100  # nanoseconds, the upper edge of the first bin
+decades = 9  # up to 100 s, the lower edge of the last bin
+reservoir_size = 10000
+
+
+class Phase:
+    def __init__(self, profiler, name):
+        """
+        times one pass through a phase
+
+        :param profiler: Profiler
+        :param     name:      str
+        """
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.start, time.perf_counter_ns() - self.start)
+
+
+class PhaseStatistics:
+    def __init__(self):
+        """
+        the durations of one phase, in bins of fixed logarithmic width and a bounded reservoir sample
+        """
+        self.calls = 0
+        self.total = 0
+        self.min = math.inf
+        self.max = 0
+        # counts[0] also holds the durations below shortest, counts[-1] those beyond the last edge
+        self.counts = [0] * (bins_per_decade * decades + 1)
+        self.reservoir = []
+        self.random = random.Random(0)
+
+    def add(self, duration):
+        """
+        :param duration: int: nanoseconds
+        :return    None:
+        """
+        self.calls += 1
+        self.total += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        position = int(math.log10(duration / shortest) * bins_per_decade) + 1 if duration >= shortest else 0
+        self.counts[min(position, len(self.counts) - 1)] += 1
+        # Algorithm R: every duration so far is in the reservoir with the same probability
+        if len(self.reservoir) < reservoir_size:
+            self.reservoir.append(duration)
+        else:
+            j = self.random.randrange(self.calls)
+            if j < reservoir_size:
+                self.reservoir[j] = duration
+
+
+def edges():
+    """
+    :return edges: array: of the bins of PhaseStatistics in nanoseconds, from 0 to infinity
+    """
+    return np.concatenate([[0], shortest * np.logspace(0, decades, bins_per_decade * decades + 1)[:-1], [np.inf]])
+
+
+class Profiler:
+    def __init__(self, max_events=1000000):
+        """
+        collects statistics of the durations of every phase, and a trace of the first max_events of them
+
+        :param max_events: int: phase passes kept for the Chrome trace
+        """
+        self.max_events = max_events
+        self.phases = {}
+        self.events = []
+        self.origin = time.perf_counter_ns()
+
+    def phase(self, name):
+        """
+        :param   name:   str: e.g. 'Cars.update/find-obstacles'
+        :return phase: Phase: a context manager timing the code it encloses
+        """
+        return Phase(self, name)
+
+    def add(self, name, start, duration):
+        """
+        :param     name: str
+        :param    start: int: perf_counter_ns at the start of the phase
+        :param duration: int: nanoseconds
+        :return    None:
+        """
+        statistics = self.phases.get(name)
+        if statistics is None:
+            statistics = self.phases[name] = PhaseStatistics()
+        statistics.add(duration)
+        if len(self.events) < self.max_events:
+            self.events.append((name, start, duration, threading.get_ident()))
+
+    def statistics(self):
+        """
+        :return table: dataframe: one row per phase, of its calls and the total, mean, median, 95th percentile and
+                                  maximum of its durations in milliseconds, slowest phase first (the percentiles
+                                  are those of the reservoir sample)
+        """
+        import pandas as pd
+        rows = []
+        for name, statistics in self.phases.items():
+            sample = np.array(statistics.reservoir) / 1e6
+            rows.append({'phase': name, 'calls': statistics.calls, 'total-ms': statistics.total / 1e6,
+                         'mean-ms': statistics.total / statistics.calls / 1e6, 'p50-ms': np.percentile(sample, 50),
+                         'p95-ms': np.percentile(sample, 95), 'max-ms': statistics.max / 1e6})
+        columns = ['phase', 'calls', 'total-ms', 'mean-ms', 'p50-ms', 'p95-ms', 'max-ms']
+        return pd.DataFrame(rows, columns=columns).sort_values('total-ms', ascending=False).reset_index(drop=True)
+
+    def histogram(self, name):
+        """
+        :param          name:   str: phase
+        :return counts, edges: arrays: as from np.histogram, over the bins from the shortest to the longest duration,
+                                       the edges in milliseconds
+        """
+        statistics = self.phases[name]
+        counts = np.array(statistics.counts)
+        first, last = np.flatnonzero(counts)[[0, -1]]
+        return counts[first:last + 1], edges()[first:last + 2] / 1e6
+
+    def histograms(self):
+        """
+        :return histograms: dict: phase -> (counts, edges)
+        """
+        return {name: self.histogram(name) for name in self.phases}
+
+    def summary(self):
+        """
+        :return table: str: the statistics as text
+        """
+        return self.statistics().to_string(index=False, float_format='{:.3f}'.format)
+
+    def chrome_trace(self):
+        """
+        :return trace: dict: the phase passes as complete ('X') events of the Chrome trace event format
+        """
+        pid = os.getpid()
+        return {'traceEvents': [{'name': name, 'cat': name.split('/')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                                 'ts': (start - self.origin) / 1e3, 'dur': duration / 1e3}
+                                for name, start, duration, tid in self.events],
+                'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, filename):
+        """
+        :param filename: str: a .json file
+        :return    None:
+        """
+        with open(filename, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+
+def enable(max_events=1000000):
+    """
+    starts profiling, discarding what was collected before
+
+    :param max_events:      int
+    :return  profiler: Profiler
+    """
+    global _profiler
+    _profiler = Profiler(max_events)
+    return _profiler
+
+
+def disable():
+    """
+    stops profiling
+
+    :return profiler: None or Profiler: what was collected
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def profiler():
+    """
+    :return profiler: None or Profiler: the current profiler (None when profiling is off)
+    """
+    return _profiler
+
+
+def phase(name):
+    """
+    :param   name:               str
+    :return phase: Phase or nullcontext: a timer when profiling is on, a shared no-op otherwise
+    """
+    return _null_phase if _profiler is None else _profiler.phase(name)
+
+
+def timed(name):
+    """
+    a decorator timing every call of a function as the phase name, when profiling is on
+
+    :param       name: str
+    :return decorator:
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary():
+    return _profiler.summary() if _profiler is not None else 'profiling is not enabled'
+
+
+def export_chrome_trace(filename):
+    if _profiler is not None:
+        _profiler.export_chrome_trace(filename)
+    else:
+        print('profiling is not enabled, so there is no trace to export')
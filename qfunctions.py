@@ -0,0 +1,91 @@
+"""
+Value-function backends for Q learning. Every backend takes one-hot encoded states and offers the subset of the Keras
+model interface used by the learners (predict, fit, get_weights, set_weights), so they are interchangeable.
+
+The state space of StateView.determine_state has 10 states and 2 actions, so the default is a NumPy table;
+Keras (and with it TensorFlow) is only imported when a neural model is requested.
+"""
+import numpy as np
+
+
+class TabularQ:
+    def __init__(self, n_states=10, n_actions=2, learning_rate=0.1):
+        """
+        a Q table, fitted by moving each visited entry a fraction of the way towards its target
+
+        :param      n_states:    int
+        :param     n_actions:    int
+        :param learning_rate: double
+        """
+        self.table = np.zeros((n_states, n_actions))
+        self.learning_rate = learning_rate
+
+    def predict(self, x, **kwargs):
+        """
+        :param        x: array: one-hot states, shape (n, n_states)
+        :return q_values: array: shape (n, n_actions)
+        """
+        return np.asarray(x) @ self.table
+
+    def fit(self, x, y, epochs=1, **kwargs):
+        """
+        :param      x: array: one-hot states, shape (n, n_states)
+        :param      y: array: target values, shape (n, n_actions)
+        :param epochs:   int
+        :return  None:
+        """
+        states = np.argmax(x, axis=1)
+        for _ in range(epochs):
+            errors = np.asarray(y) - self.table[states]
+            # average the updates of states which appear more than once in the batch
+            counts = np.bincount(states, minlength=self.table.shape[0])[states].reshape(-1, 1)
+            np.add.at(self.table, states, self.learning_rate * errors / counts)
+
+    def get_weights(self):
+        return [self.table.copy()]
+
+    def set_weights(self, weights):
+        self.table = np.array(weights[0])
+
+
+def build_keras_model(n_states=10, n_actions=2):
+    """
+    initializes the Keras three-layer training model; Keras is imported here, on first use
+
+    :return model: Sequential
+    """
+    from keras import Sequential, layers
+
+    model = Sequential()
+    model.add(layers.InputLayer(input_shape=(n_states,)))
+    model.add(layers.Dense(n_states, activation='sigmoid'))
+    model.add(layers.Dense(n_actions, activation='linear'))
+    model.compile(loss='mse', optimizer='adam', metrics=['mae'])
+    return model
+
+
+def make_value_function(backend='tabular', n_states=10, n_actions=2):
+    """
+    :param  backend: str: 'tabular' or 'keras'
+    :return   model: object
+    """
+    if backend == 'tabular':
+        return TabularQ(n_states, n_actions)
+    elif backend == 'keras':
+        return build_keras_model(n_states, n_actions)
+    else:
+        raise ValueError('Unknown value function backend {}. Choose tabular or keras'.format(backend))
+
+
+def clone_value_function(model):
+    """
+    copies the structure of a value function, e.g. for a target network (weights are set by the caller)
+
+    :param  model: object
+    :return clone: object
+    """
+    if isinstance(model, TabularQ):
+        return TabularQ(*model.table.shape, learning_rate=model.learning_rate)
+    else:
+        from keras.models import clone_model
+        return clone_model(model)
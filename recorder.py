@@ -0,0 +1,210 @@
+"""
+Records the cars and lights of a simulation so that it can be rendered afterwards, any number of times, without
+simulating it again (see render.py).
+
+A recording is a directory holding meta.json and, for every chunk of frames, one .npy file per column:
+    time          float32: the simulated time of each frame
+    car-offsets   int64:   where each frame's cars start in car-x and car-y (one more entry than there are frames)
+    car-x, car-y  float32: the positions of the cars of all frames, one frame after the other
+    go-values     uint8:   the go-values of all light faces, one row per frame
+Each column is a plain array, so it can be memory-mapped rather than read. meta.json names the map of the recording,
+by its file and by basemap.map_key, so that it is rendered on the roads it was recorded on.
+"""
+import basemap
+import json
+import navigation as nav
+import numpy as np
+import os
+
+
+class TrajectoryRecorder:
+    def __init__(self, path, axis, dt, decimation=10, chunk_frames=1000):
+        """
+        observes a Cars and a TrafficLights object and records every decimation-th time step
+
+        :param         path:    str: directory of the recording (created if need be)
+        :param         axis:   list: x and y ranges of the road network
+        :param           dt: double: the time step of the simulation
+        :param   decimation:    int: record one time step out of every decimation
+        :param chunk_frames:    int: frames held in memory before they are written out
+        """
+        self.path = path
+        self.axis = axis
+        self.dt = dt
+        self.decimation = decimation
+        self.chunk_frames = chunk_frames
+        self.ticks = 0
+        self.lights = None
+        self.chunks = []
+        self.static = {}
+        self.clear()
+        os.makedirs(self.path, exist_ok=True)
+
+    def clear(self):
+        self.times, self.xs, self.ys, self.go_values = [], [], [], []
+
+    def attach(self, cars_object, lights_object):
+        """
+        starts recording a simulation
+
+        :param   cars_object:          Cars
+        :param lights_object: TrafficLights
+        :return         self: TrajectoryRecorder
+        """
+        cars_object.observers.append(self)
+        lights_object.observers.append(self)
+        self.lights = lights_object
+        face_xs, face_ys = lights_object.face_positions()
+        # the routes at the start of the recording, e.g. to focus a render on one car
+        routes = [np.asarray(route).tolist() if np.ndim(route) else [] for route in cars_object.state['route']]
+        self.static = {'map-file': nav.graph_file(), 'map-key': basemap.map_key(),
+                       'light-x': lights_object.state['x'].tolist(), 'light-y': lights_object.state['y'].tolist(),
+                       'face-x': face_xs.tolist(), 'face-y': face_ys.tolist(), 'routes': routes}
+        return self
+
+    def detach(self, cars_object, lights_object):
+        """
+        :return None:
+        """
+        cars_object.observers.remove(self)
+        lights_object.observers.remove(self)
+
+    def observe_lights(self, lights):
+        # the lights are read when the cars of the same time step have been updated
+        self.lights = lights
+
+    def observe_cars(self, cars):
+        """
+        records the time step which has just been simulated, if it is not decimated
+
+        :param cars: Cars
+        :return None:
+        """
+        self.ticks += 1
+        if (self.ticks - 1) % self.decimation:
+            return None
+
+        self.times.append(cars.time_elapsed)
+        self.xs.append(cars.state['x'].to_numpy(dtype=np.float32))
+        self.ys.append(cars.state['y'].to_numpy(dtype=np.float32))
+        self.go_values.append(self.lights.face_go_values().astype(np.uint8))
+        if len(self.times) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        """
+        writes the frames held in memory as a new chunk, and brings meta.json up to date
+
+        :return None:
+        """
+        if self.times:
+            number = len(self.chunks)
+            columns = {'time': np.array(self.times, dtype=np.float32),
+                       'car-offsets': np.concatenate([[0], np.cumsum([x.size for x in self.xs])]).astype(np.int64),
+                       'car-x': np.concatenate(self.xs),
+                       'car-y': np.concatenate(self.ys),
+                       'go-values': np.stack(self.go_values)}
+            for column, array in columns.items():
+                np.save(os.path.join(self.path, 'chunk{:05d}-{}.npy'.format(number, column)), array)
+            self.chunks.append({'number': number, 'frames': len(self.times)})
+            self.clear()
+
+        meta = {'axis': [float(limit) for limit in self.axis], 'dt': self.dt, 'decimation': self.decimation,
+                'chunks': self.chunks}
+        meta.update(self.static)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as file:
+            json.dump(meta, file)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Recording:
+    def __init__(self, path):
+        """
+        read access to a recording; chunks are memory-mapped, so only the frames which are read are loaded
+
+        :param path: str: directory of the recording
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.axis = tuple(self.meta['axis'])
+        self.dt = self.meta['dt'] * self.meta['decimation']  # simulated time between frames
+        self.chunks = [{column: np.load(os.path.join(path, 'chunk{:05d}-{}.npy'.format(chunk['number'], column)),
+                                        mmap_mode='r')
+                        for column in ('time', 'car-offsets', 'car-x', 'car-y', 'go-values')}
+                       for chunk in self.meta['chunks']]
+        self.starts = np.concatenate([[0], np.cumsum([chunk['frames'] for chunk in self.meta['chunks']])])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def load_map(self):
+        """
+        makes the map the recording was made on the map G, loading it from its file if another map is current.
+        Recordings from before the map was kept in meta.json are taken to be of the current map
+
+        :return None:
+        """
+        if 'map-key' not in self.meta:
+            return None
+        map_file = self.meta['map-file']
+        if map_file and (nav.graph_file() is None or os.path.abspath(nav.graph_file()) != os.path.abspath(map_file)):
+            nav.load_map(map_file)
+        if basemap.map_key() != self.meta['map-key']:
+            raise ValueError('the recording {} was made on another map ({}) than the current one; set that map with '
+                             'navigation.set_graph before rendering it'.format(self.path, map_file or 'not from a file'))
+
+    def max_cars(self):
+        """
+        :return n: int: the largest number of cars in any frame
+        """
+        return max((int(np.diff(chunk['car-offsets']).max()) for chunk in self.chunks), default=0)
+
+    def frame(self, i):
+        """
+        :param      i:  int: frame number
+        :return frame: dict: 'time', 'x' and 'y' of the cars, and the 'go-values' of the light faces
+        """
+        number = np.searchsorted(self.starts, i, side='right') - 1
+        chunk, j = self.chunks[number], i - self.starts[number]
+        start, stop = chunk['car-offsets'][j], chunk['car-offsets'][j + 1]
+        return {'time': float(chunk['time'][j]),
+                'x': chunk['car-x'][start:stop],
+                'y': chunk['car-y'][start:stop],
+                'go-values': chunk['go-values'][j].astype(bool)}
+
+    def frames(self, start=0, stop=None, step=1):
+        """
+        :return frames: generator of frame dicts
+        """
+        for i in range(start, len(self) if stop is None else min(stop, len(self)), step):
+            yield self.frame(i)
+
+
+def record(cars_object, lights_object, dt, ticks, path, decimation=10):
+    """
+    simulates headless for a number of time steps, recording as it goes
+
+    :param   cars_object:          Cars
+    :param lights_object: TrafficLights
+    :param            dt:        double
+    :param         ticks:           int
+    :param          path:           str: directory of the recording
+    :param    decimation:           int
+    :return    recording:     Recording
+    """
+    with TrajectoryRecorder(path, cars_object.axis, dt, decimation) as recorder:
+        recorder.attach(cars_object, lights_object)
+        for _ in range(ticks):
+            lights_object.update(dt)
+            cars_object.update(dt, lights_object.state)
+        recorder.detach(cars_object, lights_object)
+    return Recording(path)
@@ -0,0 +1,190 @@
+"""
+Renders recordings made with recorder.TrajectoryRecorder into movies. The Animator draws a recording through two
+stand-ins for Cars and TrafficLights which replay the recorded frames, so a recording looks exactly as the live
+simulation would have, without being simulated again.
+
+Frames do not depend on each other, so render_parallel splits a recording into frame ranges, renders each range into
+a movie segment in its own process, and joins the segments with ffmpeg's concat demuxer.
+"""
+import multiprocessing
+import navigation as nav
+import numpy as np
+import os
+import pandas as pd
+from recorder import Recording
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+class Playback:
+    def __init__(self, recording, start=0, step=1):
+        """
+        a cursor over the frames of a recording, shared by its PlaybackCars and PlaybackLights
+
+        :param recording: Recording
+        :param     start:       int: first frame
+        :param      step:       int: frames advanced per animation step
+        """
+        self.recording = recording
+        self.index = start - step
+        self.step = step
+        self.current = None
+        self.cars = PlaybackCars(self)
+        self.lights = PlaybackLights(self)
+
+    def advance(self):
+        self.index += self.step
+        self.current = self.recording.frame(self.index)
+        return self.current
+
+
+class PlaybackCars:
+    def __init__(self, playback):
+        """
+        replays the recorded car positions in place of a Cars object
+
+        :param playback: Playback
+        """
+        self.playback = playback
+        self.state = pd.DataFrame({'x': [], 'y': []})
+        self.time_elapsed = 0
+
+    def update(self, dt, lights):
+        frame = self.playback.current
+        self.state = pd.DataFrame({'x': frame['x'], 'y': frame['y']})
+        self.time_elapsed = frame['time']
+        return self.state
+
+
+class PlaybackLights:
+    def __init__(self, playback):
+        """
+        replays the recorded light phases in place of a TrafficLights object
+
+        :param playback: Playback
+        """
+        meta = playback.recording.meta
+        self.playback = playback
+        self.state = pd.DataFrame({'x': meta['light-x'], 'y': meta['light-y']})
+        self.face_xs, self.face_ys = np.array(meta['face-x']), np.array(meta['face-y'])
+
+    def update(self, dt):
+        # the Animator updates the lights first, so they move the playback on to the next frame
+        self.playback.advance()
+        return self.state
+
+    def face_positions(self):
+        return self.face_xs, self.face_ys
+
+    def face_go_values(self):
+        if self.playback.current is None:
+            return np.zeros(self.face_xs.size, dtype=bool)
+        return self.playback.current['go-values']
+
+
+def render(path, filename='movie.mp4', fps=120, start=0, stop=None, step=1, focus=None, fig=None, ax=None,
+           executable='ffmpeg'):
+    """
+    renders (part of) a recording into a movie
+
+    :param       path:         str: directory of the recording
+    :param   filename:         str: the movie file
+    :param        fps:         int
+    :param      start:         int: first frame
+    :param       stop: None or int: frame at which to stop (default the end of the recording)
+    :param       step:         int: render every step-th frame
+    :param      focus: None or int: the car ID on whose (initial) route the movie should focus
+    :param        fig: None or figure: to draw on (default a new basemap.plot_map)
+    :param         ax: None or axis
+    :param executable:         str: path to ffmpeg
+    :return    frames:         int: number of frames rendered
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from animate import Animator
+    from export import FFmpegPipe
+
+    recording = Recording(path)
+    recording.load_map()
+    if ax is None:
+        import basemap
+        # the cached image of the roads only fits the full map
+        fig, ax = basemap.plot_map(image=focus is None)
+    if focus is None:
+        ax.set_xlim(recording.axis[0], recording.axis[1])
+        ax.set_ylim(recording.axis[2], recording.axis[3])
+    else:
+        # as Animator.reset does for a live simulation
+        new_axis = nav.determine_limits(recording.meta['routes'][focus])
+        ax.set_xlim(new_axis[0], new_axis[1])
+        ax.set_ylim(new_axis[2], new_axis[3])
+
+    stop = len(recording) if stop is None else min(stop, len(recording))
+    frames = len(range(start, stop, step))
+    playback = Playback(recording, start, step)
+    with FFmpegPipe(filename, fps=fps, executable=executable) as movie:
+        animator = Animator(fig=fig, ax=ax, cars_object=playback.cars, lights_object=playback.lights, num=(0, 1),
+                            frame_rate=None, dt=recording.dt, n=recording.max_cars(), movie=movie)
+        animator.reset()
+        for i in range(frames):
+            animator.animate(i)
+        animator.close()
+    return frames
+
+
+def _render_segment(kwargs):
+    return render(**kwargs)
+
+
+def render_parallel(path, filename='movie.mp4', processes=None, fps=120, start=0, stop=None, step=1, focus=None,
+                    executable='ffmpeg'):
+    """
+    renders a recording into a movie, one contiguous range of frames per process
+
+    :param       path:         str: directory of the recording
+    :param   filename:         str: the movie file
+    :param  processes: None or int: number of processes (default one per core)
+    :param        fps:         int
+    :param      start:         int: first frame
+    :param       stop: None or int: frame at which to stop (default the end of the recording)
+    :param       step:         int: render every step-th frame
+    :param      focus: None or int: the car ID on whose route the movie should focus
+    :param executable:         str: path to ffmpeg
+    :return    frames:         int: number of frames rendered
+    """
+    processes = processes if processes else multiprocessing.cpu_count()
+    recording = Recording(path)
+    stop = len(recording) if stop is None else min(stop, len(recording))
+    frames = np.arange(start, stop, step)
+    if not frames.size:
+        return 0
+    # the workers render on the recorded map (and take the focus limits from it); loading it here first means that
+    # forked workers inherit it rather than each loading it again
+    recording.load_map()
+    bounds = [(chunk[0], chunk[-1] + 1) for chunk in np.array_split(frames, processes) if chunk.size]
+
+    directory = tempfile.mkdtemp(prefix='render-')
+    try:
+        segments = [os.path.join(directory, 'segment{:04d}{}'.format(i, os.path.splitext(filename)[1]))
+                    for i in range(len(bounds))]
+        jobs = [{'path': path, 'filename': segment, 'fps': fps, 'start': int(first), 'stop': int(last), 'step': step,
+                 'focus': focus, 'executable': executable} for segment, (first, last) in zip(segments, bounds)]
+        with multiprocessing.Pool(len(jobs)) as pool:
+            rendered = sum(pool.map(_render_segment, jobs, chunksize=1))
+
+        listing = os.path.join(directory, 'segments.txt')
+        with open(listing, 'w') as file:
+            file.writelines("file '{}'\n".format(segment) for segment in segments)
+        subprocess.run([executable, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listing,
+                        '-c', 'copy', filename], stdin=subprocess.DEVNULL, check=True)
+    finally:
+        shutil.rmtree(directory)
+
+    return rendered
+
+
+if __name__ == '__main__':
+    # python render.py recording-directory [movie.mp4 [processes]]
+    render_parallel(*sys.argv[1:3], processes=int(sys.argv[3]) if len(sys.argv) > 3 else None)
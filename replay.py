@@ -0,0 +1,152 @@
+"""
+Experience replay for Q learning: transitions are collected into fixed-size NumPy arrays and the value function is
+fitted in mini-batches every few steps, so that the model is called once per batch rather than several times per step.
+"""
+import numpy as np
+
+
+class ReplayBuffer:
+    def __init__(self, capacity=10000, seed=0):
+        """
+        a ring buffer of (state, action, reward, new_state, done) transitions
+
+        :param capacity: int: the oldest transitions are overwritten once the buffer is full
+        :param     seed: int: seeds mini-batch sampling
+        """
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity)
+        self.new_states = np.zeros(capacity, dtype=np.int64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.position = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, new_state, done):
+        """
+        stores one transition
+
+        :return None:
+        """
+        self.extend([state], [action], [reward], [new_state], [done])
+
+    def extend(self, states, actions, rewards, new_states, dones):
+        """
+        stores a batch of transitions, e.g. one per scenario of a VecEnv
+
+        :param     states: array-like of int
+        :param    actions: array-like of int
+        :param    rewards: array-like of double
+        :param new_states: array-like of int
+        :param      dones: array-like of bool
+        :return      None:
+        """
+        rows = (self.position + np.arange(len(states))) % self.capacity
+        self.states[rows], self.actions[rows], self.rewards[rows] = states, actions, rewards
+        self.new_states[rows], self.dones[rows] = new_states, dones
+        self.position = (self.position + len(states)) % self.capacity
+        self.size = min(self.size + len(states), self.capacity)
+
+    def sample(self, batch_size):
+        """
+        draws a uniform mini-batch of stored transitions
+
+        :param   batch_size: int
+        :return       batch: tuple of arrays: states, actions, rewards, new_states, dones
+        """
+        rows = self.rng.integers(0, self.size, size=min(batch_size, self.size))
+        return self.states[rows], self.actions[rows], self.rewards[rows], self.new_states[rows], self.dones[rows]
+
+
+class BatchedQLearner:
+    def __init__(self, model, target_model=None, n_states=10, y=0.95, batch_size=32, train_every=4,
+                 target_update=100, capacity=10000, seed=0):
+        """
+        Q learning from a replay buffer, with an optional target network
+
+        :param         model:  object: value function with Keras-style predict(x) and fit(x, y, ...) on one-hot states
+        :param  target_model:  object: None, or a copy of model with get_weights/set_weights, used for the targets
+        :param      n_states:     int
+        :param             y:  double: discount factor
+        :param    batch_size:     int
+        :param   train_every:     int: fit a mini-batch every train_every observed transitions
+        :param target_update:     int: copy the weights of model to target_model every target_update fits
+        :param      capacity:     int: of the replay buffer
+        :param          seed:     int
+        """
+        self.model = model
+        self.target_model = target_model
+        self.identity = np.identity(n_states)
+        self.y = y
+        self.batch_size = batch_size
+        self.train_every = train_every
+        self.target_update = target_update
+        self.buffer = ReplayBuffer(capacity, seed)
+        self.rng = np.random.default_rng(seed)
+        self.steps = 0
+        self.fits = 0
+        self.q_table = None
+        if self.target_model is not None:
+            self.target_model.set_weights(self.model.get_weights())
+
+    def q_values(self):
+        """
+        predicts the values of all states in one call; cached until the model is next fitted
+
+        :return q_table: array: shape (n_states, 2)
+        """
+        if self.q_table is None:
+            self.q_table = np.asarray(self.model.predict(self.identity))
+        return self.q_table
+
+    def act(self, state, eps):
+        """
+        epsilon-greedy action selection
+
+        :param   state:    int
+        :param     eps: double
+        :return action:    int
+        """
+        if self.rng.random() < eps:
+            return int(self.rng.integers(0, 2))
+        else:
+            return int(np.argmax(self.q_values()[state]))
+
+    def observe(self, state, action, reward, new_state, done):
+        """
+        stores a transition, and fits a mini-batch every train_every transitions
+
+        :return None:
+        """
+        self.buffer.add(state, action, reward, new_state, done)
+        self.steps += 1
+        if self.steps % self.train_every == 0:
+            self.learn()
+
+    def learn(self):
+        """
+        fits the model to the Q learning targets of one mini-batch from the replay buffer
+
+        :return None:
+        """
+        if not len(self.buffer):
+            return None
+
+        states, actions, rewards, new_states, dones = self.buffer.sample(self.batch_size)
+        q_table = self.q_values()
+        target_table = q_table if self.target_model is None else np.asarray(self.target_model.predict(self.identity))
+
+        target_vecs = q_table[states].copy()
+        # a terminal transition has no future to bootstrap from
+        target_vecs[np.arange(states.size), actions] = rewards + self.y * (1 - dones) * \
+            np.max(target_table[new_states], axis=1)
+        self.model.fit(self.identity[states], target_vecs, batch_size=states.size, epochs=1, verbose=0)
+        self.q_table = None
+        self.fits += 1
+
+        if self.target_model is not None and self.fits % self.target_update == 0:
+            self.target_model.set_weights(self.model.get_weights())
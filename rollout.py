@@ -0,0 +1,118 @@
+"""
+Runs Env episodes in parallel across a pool of worker processes.
+
+Each worker loads the map and builds its own Env (and therefore its own Cars and TrafficLights) once,
+when the pool starts. Jobs are (episode, action, seed) tuples; workers return the agent's route time and
+the transition it took, which the learner scores in order with Env.score.
+"""
+import multiprocessing
+import numpy as np
+import random
+
+
+# the Env held by this worker process
+_env = None
+
+
+def _init_worker(n, agent, dt, axis, seed, max_time=None):
+    """
+    builds the worker's Env. Seeding before the Env is built gives every worker the same light timers
+
+    :param     n:   int: number of cars to simulate
+    :param agent:   int: the ID of the car (agent)
+    :param    dt: double
+    :param  axis:  list: x and y ranges of the road network
+    :param  seed:   int
+    :param max_time: None or double: simulated seconds after which the agent is given up on
+    :return None:
+    """
+    # imported here so that the parent process does not need the map loaded to build a pool
+    from environment import Env
+    global _env
+
+    random.seed(seed)
+    np.random.seed(seed)
+    _env = Env(n=n, agent=agent, dt=dt, animate=False, max_time=max_time, axis=axis)
+
+
+def _run_job(job):
+    """
+    resets the worker's Env and simulates one action to arrival
+
+    :param     job: tuple: episode, action, seed
+    :return result:  dict
+    """
+    episode, action, seed = job
+    random.seed(seed)
+    np.random.seed(seed)
+
+    state = _env.reset((episode, None))
+    new_state, route_time = _env.act(action)
+    result = {'episode': episode,
+              'action': action,
+              'seed': seed,
+              'state': state,
+              'new-state': new_state,
+              'route-time': route_time,
+              'ticks': _env.stats['ticks'],
+              'timeout': _env.stats['timeout']}
+    return result
+
+
+class RolloutRunner:
+    def __init__(self, n, agent, dt, axis, processes=None, seed=0, max_time=None):
+        """
+        a pool of worker processes, each holding its own map and Env
+
+        :param         n:         int: number of cars to simulate
+        :param     agent:         int: the ID of the car (agent)
+        :param        dt:      double
+        :param      axis:        list: x and y ranges of the road network
+        :param processes: None or int: number of workers (default one per core)
+        :param      seed:         int: seeds the construction of every worker's Env
+        :param  max_time: None or double: simulated seconds after which an agent is given up on
+        """
+        self.processes = processes if processes else multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                         initargs=(n, agent, dt, axis, seed, max_time))
+
+    def run(self, jobs):
+        """
+        distributes jobs across the workers
+
+        :param     jobs: list: of (episode, action, seed) tuples
+        :return results: list: of result dicts, in the order of the jobs
+        """
+        return self.pool.map(_run_job, jobs, chunksize=1)
+
+    def transitions(self, jobs, env, num_episodes):
+        """
+        runs jobs and scores their route times in job order against the learner's environment
+
+        :param         jobs:  list: of (episode, action, seed) tuples
+        :param          env:   Env: the learner's environment, which keeps the history of route times
+        :param num_episodes:   int
+        :return transitions:  list: of (state, action, reward, new_state, done, timed_out) tuples
+        """
+        transitions = []
+        for result in self.run(jobs):
+            reward, done = env.score(result['route-time'], (result['episode'], num_episodes),
+                                     timed_out=result['timeout'])
+            transitions.append((result['state'], result['action'], reward, result['new-state'], done,
+                                result['timeout']))
+        return transitions
+
+    def close(self):
+        """
+        shuts the workers down
+
+        :return None:
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -61,8 +61,12 @@ def update_cars(cars, dt):
             new_vx.append(velocity[0])
             new_vy.append(velocity[1])
         else:
-            # end of route returns the final route time
-            return None, None, None, 0, 0, car[1]['route-time']
+            # end of route: the car stops where it is and its route time stops accruing
+            new_times.append(car[1]['route-time'])
+            new_xpaths.append(car[1]['xpath'])
+            new_ypaths.append(car[1]['ypath'])
+            new_vx.append(0)
+            new_vy.append(0)
 
     package = pd.Series(new_route), pd.Series(new_xpaths), pd.Series(new_ypaths), pd.Series(new_vx), \
         pd.Series(new_vy), pd.Series(new_times)
@@ -70,6 +74,33 @@ def update_cars(cars, dt):
     return package
 
 
+def free_flow(car, duration, speed=speed_limit):
+    """
+    advances a car along its path at a constant speed, ignoring obstacles and road curvature: the coarse model for
+    cars which are too far from the agent to affect it
+
+    :param                               car:  Series
+    :param                          duration: double: seconds
+    :param                             speed: double
+    :return x, y, xpath, ypath, route_time:  tuple
+    """
+    x, y = car['x'], car['y']
+    xpath, ypath = list(car['xpath']), list(car['ypath'])
+    distance = speed * duration
+    while xpath and distance > 0:
+        step = math.hypot(xpath[0] - x, ypath[0] - y)
+        if step > distance:
+            x, y = x + (xpath[0] - x) * distance / step, y + (ypath[0] - y) * distance / step
+            distance = 0
+        else:
+            x, y = xpath.pop(0), ypath.pop(0)
+            distance -= step
+
+    # the route time stops accruing once the car reaches the end of its path
+    route_time = car['route-time'] + duration - distance / speed
+    return x, y, xpath, ypath, route_time
+
+
 def accelerate(car):
     """
     determines if there is a car ahead or a red light. Returns True if the car should accelerate, False if not.
@@ -304,51 +335,66 @@ def init_culdesac_start_location(n, axis, car_id=None, alternate_route=None):
     return cars
 
 
-def init_traffic_lights(axis, prescale=10):
+def set_route(cars, car_id, alternate_route):
     """
-    traffic lights are initialized here
+    copies a car dataframe, prescribing an alternate route for one car
 
-    :return lights: list
+    :param            cars: dataframe
+    :param          car_id: int
+    :param alternate_route: tuple: route, xpath and ypath for the car
+    :return       new_cars: dataframe
     """
-    epsilon = 0.3  # a factor which forces the positions of the light faces to be close to the intersection
+    return set_routes(cars, {car_id: alternate_route})
 
-    light_nodes = nav.find_traffic_lights(prescale)
 
-    lights_data = []
+def set_routes(cars, alternate_routes):
+    """
+    copies a car dataframe, prescribing alternate routes for any number of cars
 
-    for i, light in enumerate(light_nodes):
+    :param             cars: dataframe
+    :param alternate_routes: dict: car ID -> tuple of route, xpath and ypath
+    :return        new_cars: dataframe
+    """
+    new_cars = cars.copy()
+    for car_id, alternate_route in alternate_routes.items():
+        new_cars.at[car_id, 'route'], new_cars.at[car_id, 'xpath'], new_cars.at[car_id, 'ypath'] = alternate_route
+    return new_cars
 
-        node_id = light[0]
 
-        try:
-            out_vectors = np.array(nav.determine_pedigree(node_id))
-        except NetworkXNoPath or ValueError:
-            print('Could not determine pedigree for light at node {}'.format(node_id))
-            continue
+def init_traffic_lights(axis, prescale=10):
+    """
+    traffic lights are initialized here; the faces of all lights are determined in one pass over the map's edges
+
+    :return lights: list
+    """
+    epsilon = 0.3  # a factor which forces the positions of the light faces to be close to the intersection
 
-        degree = len(out_vectors)
-        position = nav.get_position_of_node(node_id)
-        go = [False, True] * degree * 2
-        go = go[:degree]
-
-        light = {'object': 'light',
-                 'node': node_id,
-                 'degree': degree,
-                 'x': position[0],
-                 'y': position[1],
-                 'switch-counter': 0,
-                 'switch-time': models.determine_traffic_light_timer()
-                 }
-
-        light['out-xpositions'] = [position[0] + epsilon * out_vectors[j][0] for j in range(light['degree'])]
-        light['out-ypositions'] = [position[1] + epsilon * out_vectors[j][1] for j in range(light['degree'])]
-        light['out-xvectors'] = [out_vectors[j][0] for j in range(light['degree'])]
-        light['out-yvectors'] = [out_vectors[j][1] for j in range(light['degree'])]
-        light['go-values'] = np.array([go[j] for j in range(light['degree'])])
-
-        lights_data.append(light)
-
-    lights = pd.DataFrame(lights_data)
+    light_nodes = nav.find_traffic_lights(prescale)[:, 0]
+    positions = nav.node_index().positions_of(light_nodes)
+    faces = nav.light_faces(light_nodes)
+    offsets = faces['offsets']
+
+    # flat per-face arrays; the faces of each intersection alternate red and green, starting with red
+    face_xpositions = positions[faces['light'], 0] + epsilon * faces['xvectors']
+    face_ypositions = positions[faces['light'], 1] + epsilon * faces['yvectors']
+    face_go_values = (np.arange(faces['light'].size) - offsets[faces['light']]) % 2 == 1
+
+    def per_light(flat):
+        return pd.Series([flat[start:end] for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+    lights = pd.DataFrame({'object': 'light',
+                           'node': light_nodes,
+                           'degree': np.diff(offsets),
+                           'x': positions[:, 0],
+                           'y': positions[:, 1],
+                           'switch-counter': 0,
+                           'switch-time': [models.determine_traffic_light_timer() for _ in light_nodes]})
+
+    lights['out-xpositions'] = per_light(face_xpositions)
+    lights['out-ypositions'] = per_light(face_ypositions)
+    lights['out-xvectors'] = per_light(faces['xvectors'])
+    lights['out-yvectors'] = per_light(faces['yvectors'])
+    lights['go-values'] = per_light(face_go_values)
 
     # determine binning and assign bins to lights
     lights['xbin'], lights['ybin'] = models.determine_bins(axis, lights)
@@ -0,0 +1,15 @@
+import benchmark
+from cars import TrafficLights
+import navigation as nav
+import simulation as sim
+
+
+def test_a_map_without_lights_has_no_light_faces():
+    nav.set_graph(benchmark.grid_graph(6, 10))
+    axis = nav.map_bounds()
+    lights = TrafficLights(sim.init_traffic_lights(axis, prescale=4).iloc[:0], axis)
+    lights.update(1 / 1000)
+    xs, ys = lights.face_positions()
+    go_values = lights.face_go_values()
+    assert xs.size == ys.size == go_values.size == 0
+    assert xs.dtype == float and go_values.dtype == bool
@@ -0,0 +1,9 @@
+import golden
+
+
+def test_fleet_follows_the_reference_through_traffic_on_the_grid():
+    # enough cars, and lights at every other intersection, for cars to stop behind cars and at red lights
+    report = golden.compare('fleet', initial=golden.scenario(n=20, prescale=2, road_map='grid'), ticks=1000)
+    assert report['passed'], golden.summary(report)
+    assert report['reference-stops'] > 0
+    assert report['fast-stops'] == report['reference-stops']
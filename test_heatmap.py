@@ -0,0 +1,27 @@
+import benchmark
+from cars import Cars, TrafficLights
+import heatmap
+import navigation as nav
+import numpy as np
+import random
+import simulation as sim
+
+
+def test_heatmap_counts_every_car_of_every_sample(tmp_path):
+    nav.set_graph(benchmark.grid_graph(6, 10))
+    axis = nav.map_bounds()
+    random.seed(0)
+    np.random.seed(0)
+    cars = Cars(sim.init_culdesac_start_location(12, axis), axis)
+    lights = TrafficLights(sim.init_traffic_lights(axis, prescale=4), axis)
+    accumulator = heatmap.HeatmapAccumulator(axis, every=2, window=10, path=str(tmp_path)).attach(cars)
+    with accumulator:
+        for _ in range(50):
+            lights.update(1 / 1000)
+            cars.update(1 / 1000, lights.state)
+    assert accumulator.totals.samples == 25
+    assert accumulator.totals.occupancy.sum() == 25 * len(cars.state)
+    assert accumulator.windows == 3
+    totals = heatmap.Heatmap.load(str(tmp_path / 'totals.npz'))
+    assert np.array_equal(totals.occupancy, accumulator.totals.occupancy)
+    assert totals.coarsen().occupancy.sum() == totals.occupancy.sum()
@@ -0,0 +1,25 @@
+import benchmark
+from environment import Env
+import io
+import learn
+import navigation as nav
+import numpy as np
+import qfunctions
+import random
+from replay import BatchedQLearner
+
+
+def test_training_ends_episodes_which_time_out(monkeypatch):
+    nav.set_graph(benchmark.grid_graph(6, 10))
+    random.seed(0)
+    np.random.seed(0)
+    # no car can arrive within max_time, so every step times out
+    env = Env(n=8, dt=0.01, max_time=0.05, axis=nav.map_bounds())
+    monkeypatch.setattr(learn, 'num_episodes', 2)
+    monkeypatch.setattr(learn, 'eps', 0.5)
+
+    assert len(learn.train(env, qfunctions.TabularQ(), io.StringIO())) == 2
+    learner = BatchedQLearner(qfunctions.TabularQ())
+    assert len(learn.train_batched(env, learner, io.StringIO())) == 2
+    assert env.timeouts == 4
+    assert not len(learner.buffer)
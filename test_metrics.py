@@ -0,0 +1,50 @@
+import benchmark
+from cars import Cars, TrafficLights
+import metrics
+import navigation as nav
+import numpy as np
+import pandas as pd
+import random
+import simulation as sim
+
+
+def sample(fleet_metrics, remaining):
+    n = len(remaining)
+    fleet_metrics.sample(0., np.zeros(n), np.zeros(n), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64),
+                         np.zeros(n), np.array(remaining), np.zeros(n), np.zeros(n))
+
+
+def test_metrics_sample_every_tick_on_the_grid(tmp_path):
+    nav.set_graph(benchmark.grid_graph(6, 10))
+    axis = nav.map_bounds()
+    random.seed(0)
+    np.random.seed(0)
+    cars = Cars(sim.init_culdesac_start_location(12, axis), axis)
+    lights = TrafficLights(sim.init_traffic_lights(axis, prescale=4), axis)
+    filename = str(tmp_path / 'metrics.csv')
+    with metrics.FleetMetrics(filename, capacity=16).attach(cars, lights):
+        for _ in range(50):
+            lights.update(1 / 1000)
+            cars.update(1 / 1000, lights.state)
+    samples = pd.read_csv(filename)
+    assert list(samples.columns) == metrics.columns
+    assert len(samples) == 50
+    assert (samples['cars'] == len(cars.state)).all()
+    assert (samples['busiest-bin-cars'] <= samples['cars']).all()
+
+
+def test_throughput_survives_a_change_of_fleet(tmp_path):
+    fleet_metrics = metrics.FleetMetrics(str(tmp_path / 'metrics.csv'))
+    sample(fleet_metrics, [0, 3, 2])
+    sample(fleet_metrics, [0, 0, 2])
+    sample(fleet_metrics, [0, 0])
+    assert fleet_metrics.recent()['throughput'].tolist() == [1, 1, 2]
+
+
+def test_the_first_flush_overwrites_a_csv_file(tmp_path):
+    filename = tmp_path / 'metrics.csv'
+    filename.write_text('stale\n')
+    with metrics.FleetMetrics(str(filename), capacity=2) as fleet_metrics:
+        for _ in range(3):
+            sample(fleet_metrics, [1])
+    assert len(pd.read_csv(filename)) == 3
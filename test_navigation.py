@@ -0,0 +1,72 @@
+import benchmark
+from cars import Cars, TrafficLights
+import navigation as nav
+import numpy as np
+import pytest
+import random
+import simulation as sim
+
+
+dt = 1 / 1000
+
+
+@pytest.fixture
+def grid():
+    nav.set_graph(benchmark.grid_graph(6, 10))
+    return nav.node_index()
+
+
+@pytest.fixture
+def fleet(grid):
+    axis = nav.map_bounds()
+    random.seed(0)
+    np.random.seed(0)
+    cars = Cars(sim.init_culdesac_start_location(12, axis), axis)
+    lights = TrafficLights(sim.init_traffic_lights(axis, prescale=40), axis)
+    return cars, lights, axis
+
+
+def simulate(cars, lights, ticks):
+    for _ in range(ticks):
+        lights.update(dt)
+        cars.update(dt, lights.state)
+
+
+def test_indices_of_agrees_with_index_of(grid):
+    nodes = grid.ids[::-3]
+    assert grid.indices_of(nodes).tolist() == [grid.index_of[node] for node in nodes.tolist()]
+
+
+def test_indices_of_rejects_unknown_nodes(grid):
+    with pytest.raises(KeyError):
+        grid.indices_of([grid.ids[0], grid.sorted_ids[-1] + 1])
+    with pytest.raises(KeyError):
+        grid.indices_of([grid.sorted_ids[0] - 1])
+
+
+def test_arrived_is_a_box_around_the_destination():
+    x, y = np.array([4., 4., 6., 0.]), np.array([4., -5., 0., 0.])
+    assert nav.arrived(x, y, 0., 0., 5).tolist() == [True, True, False, True]
+
+
+def test_state_tracker_agrees_with_a_fresh_tracker(fleet):
+    cars, lights, axis = fleet
+    # car 3 has no obstacles on its route (state 7), so its state is found in the cache as it moves along
+    tracker = nav.StateTracker(axis, 3, cars.state, lights.state)
+    for _ in range(5):
+        simulate(cars, lights, 40)
+        tracker.update(cars.state, lights.state)
+        fresh = nav.StateTracker(axis, 3, cars.state, lights.state)
+        state, route, xpath, ypath = tracker.determine_state()
+        assert state == fresh.determine_state()[0]
+        assert state[6]
+        # the car's path as it is now, rather than when the state was cached
+        assert xpath is cars.state.at[3, 'xpath'] and ypath is cars.state.at[3, 'ypath']
+
+
+def test_state_tracker_takes_routes_as_arrays(fleet):
+    cars, lights, axis = fleet
+    tracker = nav.StateTracker(axis, 0, cars.state, lights.state)
+    route = np.asarray(tracker.route)
+    assert tracker.get_lights_in_route(route) == tracker.get_lights_in_route()
+    assert tracker.traffic_key(route) == tracker.traffic_key()
@@ -0,0 +1,36 @@
+import basemap
+import benchmark
+from cars import Cars, TrafficLights
+import navigation as nav
+import numpy as np
+import pytest
+import random
+import recorder
+import simulation as sim
+
+
+def record(path):
+    nav.set_graph(benchmark.grid_graph(6, 10))
+    axis = nav.map_bounds()
+    random.seed(0)
+    np.random.seed(0)
+    cars = Cars(sim.init_culdesac_start_location(12, axis), axis)
+    lights = TrafficLights(sim.init_traffic_lights(axis, prescale=4), axis)
+    return cars, lights, recorder.record(cars, lights, 1 / 1000, 50, path, decimation=7)
+
+
+def test_recording_replays_the_simulation(tmp_path):
+    cars, lights, recording = record(str(tmp_path))
+    assert len(recording) == 8
+    last = recording.frame(len(recording) - 1)
+    assert np.array_equal(last['x'], cars.state['x'].to_numpy(dtype=np.float32))
+    assert last['go-values'].size == lights.face_positions()[0].size
+
+
+def test_recording_is_tied_to_its_map(tmp_path):
+    _, _, recording = record(str(tmp_path))
+    assert recording.meta['map-key'] == basemap.map_key()
+    recording.load_map()
+    nav.set_graph(benchmark.grid_graph(5, 10))
+    with pytest.raises(ValueError):
+        recording.load_map()
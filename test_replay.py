@@ -0,0 +1,19 @@
+import numpy as np
+import qfunctions
+from replay import BatchedQLearner
+
+
+def learner_after(done):
+    model = qfunctions.TabularQ(learning_rate=1.0)
+    model.table[1] = 10.0
+    learner = BatchedQLearner(model, batch_size=1, train_every=1)
+    learner.observe(0, 1, 2.0, 1, done)
+    return learner
+
+
+def test_terminal_transitions_do_not_bootstrap():
+    assert learner_after(True).q_values()[0, 1] == 2.0
+
+
+def test_other_transitions_bootstrap_from_the_new_state():
+    assert np.isclose(learner_after(False).q_values()[0, 1], 2.0 + 0.95 * 10.0)
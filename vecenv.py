@@ -0,0 +1,91 @@
+import fleet
+import navigation as nav
+import numpy as np
+import simulation as sim
+
+
+class VecEnv:
+    def __init__(self, env, m, max_time=None, seed=0):
+        """
+        M independent scenarios of an environment, held in stacked arrays and stepped in lockstep. The first scenario
+        is the environment's own; every other one starts its lights in phases drawn from seed, so that the same
+        action can have a different outcome in each of them
+
+        :param      env:            Env: provides the initial fleet, the lights, the agent and dt
+        :param        m:            int: number of scenarios
+        :param max_time: None or double: simulated seconds after which an agent which has not arrived is given up on
+        :param     seed:            int: of the light phases of the scenarios
+        """
+        self.env = env
+        self.M = m
+        self.agent = env.agent
+        self.dt = env.dt
+        self.axis = env.axis
+        self.max_time = max_time
+        self.fleet = fleet.Fleet(env.init_cars, self.axis, m)
+        self.lights = fleet.LightPhases(env.lights_object.state, self.axis, m, seed)
+        self.route_times = [[] for _ in range(m)]
+
+        # the scenarios differ only in their light phases, on which the agent's state and alternate route do not
+        # depend, so the agent's decision is the same in all of them
+        stateview = nav.StateView(axis=self.axis, car_index=self.agent, cars=env.init_cars,
+                                  lights=env.lights_object.state)
+        state, new_route, new_xpath, new_ypath = stateview.determine_state()
+        self.alternate_route = (new_route, new_xpath, new_ypath)
+        self.initial_state = state.index(True)
+        alternate_cars = sim.set_route(env.init_cars, self.agent, self.alternate_route)
+        stateview = nav.StateView(axis=self.axis, car_index=self.agent, cars=alternate_cars,
+                                  lights=env.lights_object.state)
+        self.alternate_state = stateview.determine_state()[0].index(True)
+
+    def reset(self, scenarios=None):
+        """
+        resets scenarios (all by default) to the initial fleet and lights
+
+        :param scenarios: None or array of int
+        :return   states: array of int: the state of every scenario
+        """
+        self.fleet.reset(scenarios)
+        self.lights.reset(scenarios)
+        return np.full(self.M, self.initial_state)
+
+    def refresh_stateview(self, scenario):
+        """
+        prepares a fresh depiction of what state the agent is in, in one scenario
+
+        :param  scenario:    int
+        :return stateview: object
+        """
+        return nav.StateView(axis=self.axis, car_index=self.agent, cars=self.fleet.frame(scenario),
+                             lights=self.lights.frame(scenario))
+
+    def step(self, actions, num):
+        """
+        takes one action in every scenario and simulates all of them until every agent has arrived
+
+        :param                       actions: array of int: 0 or 1 for each scenario
+        :param                           num:        tuple: the simulation number out of the total number
+        :return new_states, rewards, dones, info:    arrays: one entry per scenario; info is a dict of arrays
+        """
+        actions = np.asarray(actions)
+        for scenario in np.flatnonzero(actions):
+            self.fleet.set_route(scenario, self.agent, self.alternate_route)
+        new_states = np.where(actions, self.alternate_state, self.initial_state)
+
+        max_ticks = np.inf if self.max_time is None else int(round(self.max_time / self.dt))
+        running = ~self.fleet.arrived(self.agent)
+        ticks = 0
+        while running.any() and ticks < max_ticks:
+            self.lights.update(self.dt, running)
+            fleet.update(self.fleet, self.lights, self.dt, running)
+            running &= ~self.fleet.arrived(self.agent)
+            ticks += 1
+
+        route_times = self.fleet.route_time[np.arange(self.M) * self.fleet.n + self.agent]
+        rewards, dones = np.zeros(self.M), np.zeros(self.M, dtype=bool)
+        for scenario in range(self.M):
+            rewards[scenario], dones[scenario] = self.env.score(route_times[scenario], num,
+                                                               self.route_times[scenario], running[scenario])
+
+        info = {'route-times': route_times, 'timeouts': running, 'ticks': ticks}
+        return new_states, rewards, dones, info